@@ -0,0 +1,201 @@
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import bcrypt
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+
+# ==========================================
+# AUTENTICACIÓN CON TOKENS FIRMADOS (JWT)
+# ==========================================
+# El login compara la contraseña con su hash bcrypt (en el threadpool: un
+# hash cuesta ~200 ms de CPU) y devuelve un JWT HS256 con el perfil y la
+# expiración. Cada request protegida solo verifica la firma en memoria:
+# no consulta la BD. Los tokens ya verificados se guardan en un LRU
+# pequeño hasta su expiración, así la firma se comprueba una vez por
+# token y proceso.
+#
+# El secreto sale de AUTH_SECRETO o, si no está, se genera una vez y se
+# guarda en la colección "configuracion" al arrancar, para que todos los
+# workers firmen y verifiquen con el mismo.
+#
+# Las rutas que escriben exigen además el perfil "administrador"
+# (requiere_perfil); el perfil "usuario" solo lee y exporta.
+#
+# Un enlace que el navegador abre directamente (la descarga de un
+# trabajo) no puede mandar la cabecera: lleva `?firma=`, un token corto
+# que solo vale para esa ruta y para GET (firmar_ruta).
+#
+#   AUTH_SECRETO          secreto HS256 (por defecto, el guardado en la BD)
+#   AUTH_EXPIRA_HORAS     vida de cada token (12)
+#   AUTH_FIRMA_MINUTOS    vida de un enlace firmado (10)
+#   AUTH_CACHE_TOKENS     tokens verificados en memoria por proceso (1024)
+#   AUTH_BCRYPT_ROUNDS    costo del hash de contraseñas (12)
+
+log = logging.getLogger("pme.auth")
+
+ALGORITMO = "HS256"
+AUTH_EXPIRA = timedelta(hours=float(os.getenv("AUTH_EXPIRA_HORAS", "12")))
+AUTH_FIRMA = timedelta(minutes=float(os.getenv("AUTH_FIRMA_MINUTOS", "10")))
+AUTH_CACHE_TOKENS = int(os.getenv("AUTH_CACHE_TOKENS", "1024"))
+AUTH_BCRYPT_ROUNDS = int(os.getenv("AUTH_BCRYPT_ROUNDS", "12"))
+
+# Sin token: login y sondas (salud y métricas las consulta la infraestructura)
+RUTAS_PUBLICAS = {"/api/login", "/healthz", "/readyz", "/metrics"}
+ADMINISTRADOR = "administrador"
+
+# bcrypt solo usa los primeros 72 bytes; se corta explícitamente porque
+# bcrypt>=5 rechaza contraseñas más largas en vez de truncarlas
+_MAX_BYTES = 72
+
+
+def _a_bytes(contrasena: str) -> bytes:
+    return contrasena.encode("utf-8")[:_MAX_BYTES]
+
+
+def _hashear(contrasena: str) -> str:
+    return bcrypt.hashpw(_a_bytes(contrasena), bcrypt.gensalt(AUTH_BCRYPT_ROUNDS)).decode("ascii")
+
+
+def _coincide(contrasena: str, hash_guardado: str) -> bool:
+    try:
+        return bcrypt.checkpw(_a_bytes(contrasena), hash_guardado.encode("ascii"))
+    except ValueError:
+        # Hash corrupto o de otro esquema
+        return False
+
+
+async def hashear(contrasena: str) -> str:
+    return await run_in_threadpool(_hashear, contrasena)
+
+
+async def verificar_contrasena(contrasena: str, hash_guardado: Optional[str]) -> bool:
+    if not hash_guardado:
+        return False
+    return await run_in_threadpool(_coincide, contrasena, hash_guardado)
+
+
+class Autenticador:
+    def __init__(self, max_tokens: int = AUTH_CACHE_TOKENS, expira: timedelta = AUTH_EXPIRA):
+        self.max_tokens = max_tokens
+        self.expira = expira
+        self.secreto: Optional[str] = os.getenv("AUTH_SECRETO") or None
+        # token -> (expiración en epoch, claims)
+        self._verificados: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+
+    async def cargar_secreto(self, bd):
+        """Lee (o crea la primera vez) el secreto compartido por los workers."""
+        if self.secreto:
+            return
+        try:
+            await bd.db["configuracion"].insert_one({"_id": "auth_secreto", "valor": secrets.token_urlsafe(48),
+                                                     "fecha": datetime.now()})
+            log.info("Secreto de tokens generado")
+        except DuplicateKeyError:
+            pass
+        doc = await bd.db["configuracion"].find_one({"_id": "auth_secreto"})
+        self.secreto = doc["valor"]
+
+    def emitir(self, perfil: str) -> dict:
+        if not self.secreto:
+            raise HTTPException(503, "Autenticación no inicializada")
+        expira = datetime.now(timezone.utc) + self.expira
+        token = jwt.encode({"sub": perfil, "perfil": perfil, "exp": expira}, self.secreto, algorithm=ALGORITMO)
+        return {"token": token, "expira": expira}
+
+    def firmar_ruta(self, ruta: str) -> str:
+        """`ruta` con un token de AUTH_FIRMA minutos en ?firma=, válido solo para ella."""
+        if not self.secreto:
+            raise HTTPException(503, "Autenticación no inicializada")
+        expira = datetime.now(timezone.utc) + AUTH_FIRMA
+        return f"{ruta}?firma={jwt.encode({'ruta': ruta, 'exp': expira}, self.secreto, algorithm=ALGORITMO)}"
+
+    def ruta_firmada(self, firma: str) -> Optional[str]:
+        """Ruta para la que vale `firma`, o None si no es válida o expiró."""
+        if not self.secreto:
+            return None
+        try:
+            return jwt.decode(firma, self.secreto, algorithms=[ALGORITMO]).get("ruta")
+        except JWTError:
+            return None
+
+    def verificar(self, token: str) -> dict:
+        """Claims del token, o 401 si la firma no es válida o expiró."""
+        ahora = time.time()
+        guardado = self._verificados.get(token)
+        if guardado:
+            if guardado[0] > ahora:
+                self._verificados.move_to_end(token)
+                return guardado[1]
+            del self._verificados[token]
+            raise HTTPException(401, "Token expirado", headers={"WWW-Authenticate": "Bearer"})
+
+        if not self.secreto:
+            raise HTTPException(503, "Autenticación no inicializada")
+        try:
+            claims = jwt.decode(token, self.secreto, algorithms=[ALGORITMO])
+        except JWTError:
+            raise HTTPException(401, "Token inválido o expirado", headers={"WWW-Authenticate": "Bearer"})
+        if "perfil" not in claims:
+            raise HTTPException(401, "Token sin perfil", headers={"WWW-Authenticate": "Bearer"})
+
+        if self.max_tokens > 0:
+            self._verificados[token] = (float(claims["exp"]), claims)
+            while len(self._verificados) > self.max_tokens:
+                self._verificados.popitem(last=False)
+        return claims
+
+
+autenticador = Autenticador()
+esquema_bearer = HTTPBearer(auto_error=False)
+
+
+async def usuario_actual(request: Request,
+                         credenciales: Optional[HTTPAuthorizationCredentials] = Depends(esquema_bearer)) -> Optional[dict]:
+    """Dependencia global: valida el Bearer token en memoria y deja el perfil en request.state."""
+    if request.url.path in RUTAS_PUBLICAS:
+        return None
+    if credenciales is None:
+        firma = request.query_params.get("firma")
+        if firma and request.method == "GET" and autenticador.ruta_firmada(firma) == request.url.path:
+            return None
+        raise HTTPException(401, "Falta el token de acceso", headers={"WWW-Authenticate": "Bearer"})
+    claims = autenticador.verificar(credenciales.credentials)
+    request.state.perfil = claims["perfil"]
+    return claims
+
+
+def requiere_perfil(*perfiles: str):
+    """Dependencia de ruta: el perfil del token debe ser uno de `perfiles` (403 si no)."""
+    async def verificar_perfil(claims: Optional[dict] = Depends(usuario_actual)):
+        if not claims or claims.get("perfil") not in perfiles:
+            raise HTTPException(403, "El perfil no tiene permiso para esta operación")
+    return verificar_perfil
+
+
+async def migrar_contrasenas(bd):
+    """Una sola vez por base: reemplaza las contraseñas en texto plano por su hash."""
+    if await bd.db["migraciones"].find_one({"_id": "usuarios_hash"}):
+        return
+    n = 0
+    async for u in bd.users.find({"contrasena": {"$exists": True}}):
+        # El filtro por la contraseña vieja hace inocua la carrera entre workers
+        r = await bd.users.update_one(
+            {"_id": u["_id"], "contrasena": u["contrasena"]},
+            {"$set": {"hash": await hashear(u["contrasena"])}, "$unset": {"contrasena": ""}},
+        )
+        n += r.modified_count
+    try:
+        await bd.db["migraciones"].insert_one({"_id": "usuarios_hash", "fecha": datetime.now(), "usuarios": n})
+    except DuplicateKeyError:
+        pass
+    if n:
+        log.info("Contraseñas migradas a bcrypt", extra={"usuarios": n})
@@ -1,55 +1,116 @@
+import time
+T_IMPORT = time.monotonic()  # referencia para medir el arranque (ver salud.py)
+
+import logging
 import os
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse, FileResponse
+import shutil
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Request, Depends
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel, Field, BeforeValidator, ConfigDict
 from openpyxl import Workbook
-from typing import List, Optional, Annotated
+from typing import Any, Dict, List, Literal, Optional, Annotated
 from datetime import datetime
 from bson import ObjectId
 import uuid
-import pandas as pd
-from io import BytesIO
-from dotenv import load_dotenv
-import certifi
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+
+from database import BaseDatos, MONGO_URI
+from clonacion import ClonadorPME, DestinoConDatos
+from indices import asegurar_indices
+import paginacion
+from resumen import ResumenPME
+from rollups import Rollups
+import exportacion
+import detalle
+import cambios
+import masivo
+import busqueda
+import instantaneas
+import identificadores
+import certificados
+from importacion import ImportadorExcel, preparar_accion, preparar_recurso, clave_accion, clave_recurso
+from cache import CacheLRU
+from serializacion import RespuestaJSON
+import trabajos
+from trabajos import ColaTrabajos
+import observabilidad
+import salud
+import auth
+from compresion import MiddlewareGzip
 
 # ==========================================
 # 1. CONFIGURACIÓN Y BASE DE DATOS
 # ==========================================
 
-load_dotenv()
-
-MONGO_URI = os.getenv("MONGO_URI", "localhost:27017/")
-DB_NAME = os.getenv("DB_NAME", "pme_colegios2")
-
-print(f"🔌 Conectando a: {MONGO_URI}")
-
-
-
-try:
-    # LOGICA: Si es localhost, conectar directo. Si es nube (Atlas), usar certificados.
-    if "localhost" in MONGO_URI or "127.0.0.1" in MONGO_URI:
-        print("🏠 Detectado entorno LOCAL: Conectando sin SSL...")
-        client = MongoClient(MONGO_URI)
-    else:
-        print("☁️ Detectado entorno NUBE: Conectando con certificados SSL...")
-        client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
-
-    db = client[DB_NAME]
-    client.admin.command('ping')
-    print("✅ Conexión exitosa a MongoDB")
-except Exception as e:
-    print(f"❌ Error conectando a MongoDB: {e}")
-
-# Colecciones
-col_colegios = db["colegios"]
-col_pme = db["pme"]
-col_acciones = db["acciones"]
-col_recursos = db["recursos"]
-col_users = db["users"]
-
-app = FastAPI(title="API Orquestador PME")
+# Logs JSON con nivel e id de request; métricas en /metrics (ver observabilidad.py)
+observabilidad.configurar_logging()
+log = logging.getLogger("pme.api")
+escucha_mongo = observabilidad.EscuchaComandos()
+
+# Cliente async (ver database.py para el pool y los timeouts). Se conecta
+# en el lifespan de cada worker: al importar no se abre ninguna conexión.
+bd = BaseDatos()
+arranque = salud.Arranque(T_IMPORT)
+
+clonador = ClonadorPME(bd)
+resumen = ResumenPME(bd)
+# Totales por colegio, año y dimensión para el sostenedor; ver rollups.py
+rollups = Rollups(bd, resumen)
+# Lecturas frecuentes (colegios, PMEs, acciones) con ETag, invalidadas entre workers; ver cache.py
+cache = CacheLRU(bd=bd)
+# Clonación, importación, exportación y eliminación en segundo plano; ver trabajos.py
+cola = ColaTrabajos(bd)
+
+async def crear_usuarios_iniciales():
+    # Una sola vez por base: el primer worker que inserta la marca siembra;
+    # los demás (y los reinicios) reciben DuplicateKeyError y siguen.
+    try:
+        await bd.db["migraciones"].insert_one({"_id": "usuarios_iniciales", "fecha": datetime.now()})
+    except DuplicateKeyError:
+        return
+    if not await bd.users.find_one({"perfil": "administrador"}):
+        await bd.users.insert_one({"perfil": "administrador", "hash": await auth.hashear("admin123")})
+        log.info("Usuario ADMIN creado")
+    if not await bd.users.find_one({"perfil": "usuario"}):
+        await bd.users.insert_one({"perfil": "usuario", "hash": await auth.hashear("user123")})
+        log.info("Usuario VISITA creado")
+
+async def inicializar():
+    """Pasos idempotentes: si alguno falla, salud.Arranque reintenta todo."""
+    await bd.ping()
+    await bd.calentar()
+    log.info("Conexión exitosa a MongoDB")
+    await asegurar_indices(bd.db)
+    await crear_usuarios_iniciales()
+    await identificadores.cargar_estado(bd)
+    await auth.migrar_contrasenas(bd)
+    await auth.autenticador.cargar_secreto(bd)
+    await cola.iniciar()
+    await rollups.iniciar()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sin credenciales en el log
+    log.info("Conectando a MongoDB", extra={"host": MONGO_URI.rsplit("@", 1)[-1], "pid": os.getpid()})
+    bd.conectar(event_listeners=[escucha_mongo])
+    arranque.lanzar(inicializar)
+    yield
+    await arranque.detener()
+    await cola.detener()
+    await rollups.detener()
+    certificados.cerrar_pool()
+    await bd.cerrar()
+
+# Todas las rutas exigen un Bearer token salvo auth.RUTAS_PUBLICAS; se
+# verifica en memoria, sin consultar la BD (ver auth.py).
+# Las que escriben exigen además el perfil administrador.
+app = FastAPI(title="API Orquestador PME", lifespan=lifespan, default_response_class=RespuestaJSON,
+              dependencies=[Depends(auth.usuario_actual)])
+SOLO_ADMIN = [Depends(auth.requiere_perfil(auth.ADMINISTRADOR))]
 
 # 1. Leer la variable de entorno
 # Si no existe, por defecto permitimos localhost para evitar bloqueos en desarrollo
@@ -58,13 +119,19 @@ origins_raw = os.getenv("ALLOWED_ORIGINS", "http://localhost:8090")
 # 2. Convertir el string "url1,url2" en una lista ["url1", "url2"]
 origins = [origin.strip() for origin in origins_raw.split(",")]
 
+# Listados JSON y CSV comprimidos con gzip sobre GZIP_MIN_BYTES (ver compresion.py)
+app.add_middleware(MiddlewareGzip)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins, # <--- ESTO PERMITE TODO (Para desarrollo)
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Último en agregarse = primero en ejecutarse: mide también CORS
+app.add_middleware(observabilidad.MiddlewareMetricas)
 
 # ==========================================
 # 2. UTILIDADES Y ESQUEMAS (ADAPTADO PYDANTIC V2)
@@ -81,6 +148,12 @@ class SchemaUser(BaseModel):
 class ExportColumnas(BaseModel):
     columnas: List[str]
 
+class SolicitudCertificados(BaseModel):
+    ids: Optional[List[str]] = None      # recursos puntuales; sin ids = todos los del PME
+    uuid_accion: Optional[str] = None
+    campos: Dict[str, bool] = {}         # visibilidad, igual que certFields del frontend
+    ciudad: str = "Alto Hospicio"
+
 class SchemaClonacion(BaseModel):
     id_pme_origen: str
     id_pme_destino: str
@@ -120,6 +193,8 @@ class Schema_PME_Create(BaseModel):
     director: str
     observacion: str
     clonar: bool = False
+    # Con clonar: el año nuevo hereda los documentos y copia solo lo que se edita (ver instantaneas.py)
+    instantanea: bool = False
 
 # --- Esquemas Acciones ---
 class Schema_Acciones(BaseModel):
@@ -163,467 +238,748 @@ class Schema_Recursos(BaseModel):
     monto: int = 0
     year: int
     fecha: datetime = Field(default_factory=datetime.now)
+    fecha_actualizacion: datetime = Field(default_factory=datetime.now)
 
     model_config = ConfigDict(
         populate_by_name=True,
         arbitrary_types_allowed=True,
     )
 
+# --- Edición masiva (ver masivo.py) ---
+class OperacionMasiva(BaseModel):
+    op: Literal["actualizar", "mover", "eliminar"]
+    id: str  # _id del recurso o uuid_accion de la acción
+    datos: Dict[str, Any] = {}
+    # Destino de "mover": acción del mismo PME (recursos) u otro PME (acciones)
+    uuid_accion: Optional[str] = None
+    id_pme: Optional[str] = None
+    year: Optional[int] = None
+
+class SolicitudMasiva(BaseModel):
+    operaciones: List[OperacionMasiva] = Field(min_length=1, max_length=masivo.MAX_OPERACIONES)
+    # PME desde el que se edita: sus documentos heredados se materializan antes
+    id_pme: Optional[str] = None
+
+importador_acciones = ImportadorExcel(bd, "acciones", Schema_Acciones, preparar_accion, resumen.sumar_acciones,
+                                     clave=clave_accion, al_quitar=lambda docs: resumen.sumar_acciones(docs, -1))
+importador_recursos = ImportadorExcel(bd, "recursos", Schema_Recursos, preparar_recurso, resumen.sumar_recursos,
+                                     clave=clave_recurso, al_quitar=lambda docs: resumen.sumar_recursos(docs, -1))
+
+# insertar: cada fila es un documento nuevo; actualizar: upsert por clave estable (ver importacion.py)
+PATRON_MODO_IMPORTACION = "^(insertar|actualizar)$"
+
 # ==========================================
 # 3. ENDPOINTS
 # ==========================================
 
 @app.post("/api/login")
-def login(user: SchemaUser):
-    usuario_encontrado = col_users.find_one({
-        "perfil": user.perfil, 
-        "contrasena": user.contrasena
-    })
-    if usuario_encontrado:
+async def login(user: SchemaUser):
+    usuario_encontrado = await bd.users.find_one({"perfil": user.perfil})
+    if usuario_encontrado and await auth.verificar_contrasena(user.contrasena, usuario_encontrado.get("hash")):
+        emitido = auth.autenticador.emitir(usuario_encontrado["perfil"])
         return {
             "msg": "Login exitoso", 
             "perfil": usuario_encontrado["perfil"],
-            "token": "token_simple_123"
+            "token": emitido["token"],
+            "expira": emitido["expira"],
         }
     raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
 # --- Colegios ---
 @app.get("/api/colegios")
-def get_colegios():
-    colegios = list(col_colegios.find())
-    for c in colegios: c["_id"] = str(c["_id"])
-    return colegios
-
-@app.post("/api/colegios")
-def create_colegio(col: SchemaColegio):
-    if col_colegios.find_one({"nombre": col.nombre}):
+async def get_colegios(request: Request):
+    async def cargar():
+        return await bd.colegios.find().to_list()
+    return await cache.responder(request, ("colegios",), cargar)
+
+@app.post("/api/colegios", dependencies=SOLO_ADMIN)
+async def create_colegio(col: SchemaColegio):
+    if await bd.colegios.find_one({"nombre": col.nombre}):
         raise HTTPException(status_code=400, detail="Nombre de colegio ya existe")
     
     # En V2 usamos model_dump en vez de dict()
     new_col = col.model_dump(by_alias=True, exclude={"id"}) 
-    new_col["_id"] = str(ObjectId())
+    new_col["_id"] = identificadores.nuevo()
     
-    col_colegios.insert_one(new_col)
-    return {"msg": "Colegio creado", "id": new_col["_id"]}
+    await bd.colegios.insert_one(new_col)
+    await cache.invalidar(("colegios",))
+    return {"msg": "Colegio creado", "id": str(new_col["_id"])}
 
 # --- PME ---
 @app.get("/api/pme/buscar")
-def get_pme_id(id_colegio: str, year: int):
-    pme = col_pme.find_one({"id_colegio": id_colegio, "year": year})
-    if pme:
-        return {"id_pme": str(pme["_id"]), "exist": True}
-    return {"exist": False, "msg": "No se encontró PME"}
+async def get_pme_id(request: Request, id_colegio: str, year: int):
+    async def cargar():
+        pme = await bd.pme.find_one({"id_colegio": id_colegio, "year": year})
+        if pme:
+            return {"id_pme": str(pme["_id"]), "exist": True}
+        return {"exist": False, "msg": "No se encontró PME"}
+    return await cache.responder(request, ("pme_buscar", id_colegio, year), cargar)
 
 @app.get("/api/pmes/colegio/{id_colegio}")
-def listar_pmes_por_colegio(id_colegio: str):
-    data = list(col_pme.find({"id_colegio": id_colegio}))
-    for p in data: p["_id"] = str(p["_id"])
-    data.sort(key=lambda x: x["year"], reverse=True)
-    return data
-
-@app.post("/api/pme")
-def create_pme(pme: Schema_PME_Create):
-    if col_pme.find_one({"id_colegio": pme.id_colegio, "year": pme.year}):
-        raise HTTPException(status_code=400, detail="El PME ya existe")
-    
-    new_pme = pme.model_dump(exclude={"clonar"})
-    new_pme["_id"] = str(ObjectId())
-    col_pme.insert_one(new_pme)
-    
-    acciones_copiadas = 0
+async def listar_pmes_por_colegio(request: Request, id_colegio: str):
+    async def cargar():
+        return await bd.pme.find({"id_colegio": id_colegio}).sort("year", -1).to_list()
+    return await cache.responder(request, ("pmes", id_colegio), cargar)
+
+async def invalidar_acciones(*ids_pme):
+    # Cada PME puede tener varias entradas (una por cada `fields` pedido)
+    for id_pme in set(ids_pme):
+        if id_pme is not None:
+            await cache.invalidar_grupo("acciones", id_pme)
+
+async def invalidar_pme(id_colegio: Optional[str], year: Optional[int] = None):
+    """Un PME se creó o eliminó: cambian la lista del colegio y su búsqueda."""
+    if id_colegio is None:
+        await cache.invalidar_grupo("pmes")
+        await cache.invalidar_grupo("pme_buscar")
+        return
+    await cache.invalidar(("pmes", id_colegio))
+    if year is None:
+        await cache.invalidar_grupo("pme_buscar", id_colegio)
+    else:
+        await cache.invalidar(("pme_buscar", id_colegio, year))
+
+@app.post("/api/pme", dependencies=SOLO_ADMIN)
+async def create_pme(pme: Schema_PME_Create):
+    # La unicidad (id_colegio, year) la garantiza el índice único de la colección
+    new_pme = pme.model_dump(exclude={"clonar", "instantanea"})
+    new_pme["_id"] = identificadores.nuevo()
+    # Las acciones, recursos y bases lo referencian como string
+    id_pme = str(new_pme["_id"])
     
+    pme_ant = None
     if pme.clonar:
-        year_ant = pme.year - 1
-        pme_ant = col_pme.find_one({"id_colegio": pme.id_colegio, "year": year_ant})
-        
-        if pme_ant:
-            id_old = str(pme_ant["_id"])
-            id_new = new_pme["_id"]
-            
-            acciones = list(col_acciones.find({"id_pme": id_old}))
-            for acc in acciones:
-                uuid_old = acc["uuid_accion"]
-                uuid_new = str(uuid.uuid4())
-                
-                acc_new = acc.copy()
-                del acc_new["_id"]
-                acc_new.update({"id_pme": id_new, "year": pme.year, "uuid_accion": uuid_new})
-                col_acciones.insert_one(acc_new)
-                acciones_copiadas += 1
-                
-                recursos = list(col_recursos.find({"uuid_accion": uuid_old}))
-                for rec in recursos:
-                    rec_new = rec.copy()
-                    del rec_new["_id"]
-                    rec_new.update({"id_pme": id_new, "year": pme.year, "uuid_accion": uuid_new})
-                    col_recursos.insert_one(rec_new)
-
-    return {"msg": "Creado", "id_pme": new_pme["_id"], "copiados": acciones_copiadas}
-
-@app.post("/api/pme/clonar")
-def clonar_pme_anio_anterior(datos: SchemaClonacion):
+        pme_ant = await bd.pme.find_one({"id_colegio": pme.id_colegio, "year": pme.year - 1})
+
     try:
-        pme_destino = col_pme.find_one({"_id": datos.id_pme_destino})
-        if not pme_destino:
-             pme_destino = col_pme.find_one({"_id": ObjectId(datos.id_pme_destino)})
-        
-        if not pme_destino:
-            raise HTTPException(status_code=404, detail="PME Destino no encontrado")
-        
-        nuevo_year = pme_destino["year"]
-        acciones_origen = list(col_acciones.find({"id_pme": datos.id_pme_origen}))
-        
-        cnt_acc = 0
-        for accion in acciones_origen:
-            uuid_old = accion["uuid_accion"]
-            uuid_new = str(uuid.uuid4())
-
-            nueva = accion.copy()
-            if "_id" in nueva: del nueva["_id"]
-            nueva.update({"id_pme": datos.id_pme_destino, "year": nuevo_year, "uuid_accion": uuid_new})
-            col_acciones.insert_one(nueva)
-            cnt_acc += 1
-
-            recursos = list(col_recursos.find({"uuid_accion": uuid_old}))
-            for r in recursos:
-                r_new = r.copy()
-                if "_id" in r_new: del r_new["_id"]
-                r_new.update({"id_pme": datos.id_pme_destino, "year": nuevo_year, "uuid_accion": uuid_new})
-                col_recursos.insert_one(r_new)
-
-        return {"msg": "Clonación manual exitosa", "acciones": cnt_acc}
+        if not pme_ant:
+            await bd.pme.insert_one(new_pme)
+            await invalidar_pme(pme.id_colegio, pme.year)
+            return {"msg": "Creado", "id_pme": id_pme, "copiados": 0, "recursos_copiados": 0}
+
+        if pme.instantanea:
+            # Una sola escritura: el resumen se reconstruye al leerlo
+            await bd.pme.insert_one({**new_pme, **instantaneas.nueva_instantanea(pme_ant)})
+            await invalidar_pme(pme.id_colegio, pme.year)
+            return {"msg": "Creado", "id_pme": id_pme, "copiados": 0, "recursos_copiados": 0,
+                    "instantanea": True, "base": str(pme_ant["_id"])}
+
+        # El PME nuevo y su copia se escriben en la misma transacción
+        copia = await clonador.clonar(str(pme_ant["_id"]), id_pme, pme.year, nuevo_pme=new_pme)
+        await invalidar_pme(pme.id_colegio, pme.year)
+        await invalidar_acciones(id_pme)
+        await resumen.reconstruir(id_pme)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="El PME ya existe")
     except Exception as e:
-        print(f"Error clonar: {e}")
+        log.exception("Error al clonar PME")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/api/pme/{id_pme}")
-def eliminar_pme_cascada(id_pme: str):
-    res = col_pme.delete_one({"_id": id_pme}) 
-    if res.deleted_count == 0:
+    return {"msg": "Creado", "id_pme": id_pme, "copiados": copia["acciones"], "recursos_copiados": copia["recursos"]}
+
+async def clonar_en_destino(id_pme_origen: str, id_pme_destino: str) -> dict:
+    pme_destino = await bd.pme.find_one(identificadores.filtro_id(id_pme_destino))
+    if not pme_destino:
+        raise HTTPException(status_code=404, detail="PME Destino no encontrado")
+    
+    try:
+        copia = await clonador.clonar(id_pme_origen, id_pme_destino, pme_destino["year"])
+    except DestinoConDatos as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await invalidar_acciones(id_pme_destino)
+    await resumen.reconstruir(id_pme_destino)
+    return {"msg": "Clonación manual exitosa", "acciones": copia["acciones"], "recursos": copia["recursos"]}
+
+@app.post("/api/pme/clonar", dependencies=SOLO_ADMIN)
+async def clonar_pme_anio_anterior(datos: SchemaClonacion, segundo_plano: bool = False):
+    if segundo_plano:
+        # El trabajo vuelve a verificarlo; así el 409 llega sin esperar la cola
         try:
-            col_pme.delete_one({"_id": ObjectId(id_pme)})
-        except: pass
+            await clonador.verificar_destino(datos.id_pme_destino)
+        except DestinoConDatos as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return await encolar_trabajo("clonar", datos.model_dump())
+    try:
+        return await clonar_en_destino(datos.id_pme_origen, datos.id_pme_destino)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Error al clonar PME")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def eliminar_pme(id_pme: str, avance=None) -> dict:
+    # Cada paso es idempotente: un trabajo interrumpido se puede repetir completo.
+    # Los años que heredan de este PME se quedan antes con su propia copia.
+    await invalidar_acciones(*await instantaneas.independizar(bd, id_pme))
+    borrado = await bd.pme.find_one_and_delete(identificadores.filtro_id(id_pme))
+    if avance: await avance(1, 4, forzar=True)
         
-    col_acciones.delete_many({"id_pme": id_pme})
-    col_recursos.delete_many({"id_pme": id_pme})
-    return {"msg": "Eliminado"}
+    acc = await bd.acciones.delete_many({"id_pme": id_pme})
+    if avance: await avance(2, 4, forzar=True)
+    rec = await bd.recursos.delete_many({"id_pme": id_pme})
+    if avance: await avance(3, 4, forzar=True)
+    await resumen.eliminar(id_pme)
+    await rollups.eliminar_pme(id_pme)
+    await bd.eliminados.delete_many({"id_pme": id_pme})
+    if borrado:
+        await invalidar_pme(borrado.get("id_colegio"), borrado.get("year"))
+    await invalidar_acciones(id_pme)
+    return {"msg": "Eliminado", "acciones": acc.deleted_count, "recursos": rec.deleted_count}
+
+@app.delete("/api/pme/{id_pme}", dependencies=SOLO_ADMIN)
+async def eliminar_pme_cascada(id_pme: str, segundo_plano: bool = False):
+    if segundo_plano:
+        return await encolar_trabajo("eliminar", {"id_pme": id_pme})
+    return await eliminar_pme(id_pme)
+
+@app.get("/api/pme/{id_pme}/cambios")
+async def cambios_pme(id_pme: str, since: Optional[str] = None):
+    """Acciones y recursos creados, modificados o eliminados desde el token `since`."""
+    return RespuestaJSON(await cambios.cambios_desde(bd, id_pme, since))
+
+@app.get("/api/pme/{id_pme}/resumen")
+async def obtener_resumen_pme(id_pme: str):
+    return await resumen.leer(id_pme)
+
+# --- Búsqueda ---
+@app.get("/api/buscar")
+async def buscar(
+    q: str = Query(..., min_length=2, max_length=200),
+    id_colegio: Optional[str] = None,
+    id_pme: Optional[str] = None,
+    year: Optional[int] = None,
+    pagina: int = Query(1, ge=1, le=busqueda.MAX_PAGINAS),
+    limite: int = Query(20, ge=1, le=busqueda.LIMITE_MAXIMO),
+):
+    """Acciones y recursos que coinciden con `q`, con fragmentos resaltados."""
+    # PME buscados: uno, los del colegio (todos los años o solo `year`) o todos
+    filtro_pme = {**({"year": year} if year is not None else {})}
+    if id_pme:
+        filtro_pme.update(identificadores.filtro_id(id_pme))
+    elif id_colegio:
+        filtro_pme["id_colegio"] = id_colegio
+    return RespuestaJSON(await busqueda.buscar(bd, q, filtro_pme or None, pagina, limite))
 
 # --- Acciones ---
 @app.get("/api/acciones/{id_pme}")
-def listar_acciones(id_pme: str):
-    data = list(col_acciones.find({"id_pme": id_pme}))
-    for d in data: d["_id"] = str(d["_id"])
-    return data
+async def listar_acciones(request: Request, id_pme: str, fields: Optional[str] = None):
+    try:
+        proy = paginacion.proyeccion(fields, paginacion.CAMPOS_ACCIONES, ["uuid_accion"])
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    async def cargar():
+        return await (await instantaneas.vista(bd, "acciones", id_pme, proy=proy)).to_list()
+    return await cache.responder(request, ("acciones", id_pme, fields or ""), cargar)
+
+@app.get("/api/acciones/pme/{id_pme}/pagina")
+async def paginar_acciones(
+    id_pme: str,
+    cursor: Optional[str] = None,
+    limite: int = Query(paginacion.LIMITE_DEFECTO, ge=1, le=paginacion.LIMITE_MAXIMO),
+    orden: str = "_id",
+    desc: bool = False,
+    dimension: Optional[str] = None,
+    responsable: Optional[str] = None,
+    monto_min: Optional[int] = None,
+    monto_max: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    if orden not in paginacion.ORDEN_ACCIONES:
+        raise HTTPException(400, f"Orden no permitido: {orden}")
+
+    filtro = {"id_pme": id_pme, **paginacion.filtro_monto("monto_total", monto_min, monto_max)}
+    if dimension: filtro["dimension"] = dimension
+    if responsable: filtro["responsable"] = responsable
 
-@app.post("/api/acciones")
-def crear_accion(accion: Schema_Acciones):
+    try:
+        proy = paginacion.proyeccion(fields, paginacion.CAMPOS_ACCIONES, ["uuid_accion"])
+        vista = await instantaneas.cadena(bd, id_pme)
+        return RespuestaJSON(await paginacion.paginar(bd.acciones, filtro, orden, not desc, limite, cursor, proy,
+                                                      instantaneas.etapas(vista, "acciones") if vista else None))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.post("/api/acciones", dependencies=SOLO_ADMIN)
+async def crear_accion(accion: Schema_Acciones):
     new_acc = accion.model_dump(by_alias=True, exclude={"id"})
-    col_acciones.insert_one(new_acc)
+    new_acc["_id"] = identificadores.nuevo()
+    await instantaneas.congelar(bd, "acciones", [new_acc])
+    await bd.acciones.insert_one(new_acc)
+    await invalidar_acciones(new_acc["id_pme"])
+    await resumen.sumar_acciones([new_acc])
     return {"msg": "Creada", "uuid": new_acc["uuid_accion"]}
 
-@app.put("/api/acciones/{uuid}")
-def modificar_accion(uuid: str, accion: Schema_Acciones):
+@app.post("/api/acciones/bulk", dependencies=SOLO_ADMIN)
+async def editar_acciones_masivo(sol: SolicitudMasiva):
+    res = await masivo.editar_acciones(bd, resumen, Schema_Acciones, sol.operaciones, sol.id_pme)
+    await invalidar_acciones(*res["pmes"])
+    return RespuestaJSON(res)
+
+@app.put("/api/acciones/{uuid}", dependencies=SOLO_ADMIN)
+async def modificar_accion(uuid: str, accion: Schema_Acciones):
     upd = accion.model_dump(exclude_unset=True, exclude={"id", "uuid_accion"})
     upd["fecha_actualizacion"] = datetime.now()
     
-    res = col_acciones.update_one({"uuid_accion": uuid}, {"$set": upd})
-    if res.modified_count == 0:
+    # Desde una instantánea, la acción heredada se copia al PME antes de editarla.
+    # Si no está en el PME del body se mueve desde otro, pero solo si el uuid está en uno
+    try:
+        objetivos = await instantaneas.para_escribir(bd, "acciones", {"uuid_accion": uuid}, upd["id_pme"])
+    except instantaneas.Ambiguo as e:
+        raise HTTPException(409, f"Acción {uuid}: {e}")
+    if not objetivos:
+        return {"msg": "No se modificó nada o no existe"}
+    antes = await bd.acciones.find_one_and_update({"_id": objetivos[0]["_id"]}, {"$set": upd}, return_document=ReturnDocument.BEFORE)
+    if antes is None:
         return {"msg": "No se modificó nada o no existe"}
+    await invalidar_acciones(antes.get("id_pme"), upd.get("id_pme"))
+    if upd.get("id_pme", antes.get("id_pme")) != antes.get("id_pme"):
+        await instantaneas.congelar(bd, "acciones", [{**antes, **upd}])
+        await instantaneas.ocultar(bd, "acciones", [antes])
+        await cambios.registrar_eliminados(bd, "acciones", [antes])
+    await resumen.reemplazar_accion(antes, {**antes, **upd})
     return {"msg": "Acción actualizada"}
 
-@app.delete("/api/acciones/{uuid}")
-def eliminar_accion(uuid: str):
-    col_acciones.delete_one({"uuid_accion": uuid})
-    col_recursos.delete_many({"uuid_accion": uuid})
+@app.delete("/api/acciones/{uuid}", dependencies=SOLO_ADMIN)
+async def eliminar_accion(uuid: str, id_pme: str):
+    # El uuid se repite en los años copiados o heredados: se borra solo en la
+    # vista de id_pme (en una instantánea, lo heredado se oculta)
+    borradas = await instantaneas.eliminar(bd, "acciones", {"uuid_accion": uuid}, id_pme)
+    borrada = borradas[0] if borradas else None
+    recursos = await instantaneas.eliminar(bd, "recursos", {"uuid_accion": uuid}, id_pme, varios=True)
+    if borrada:
+        await invalidar_acciones(borrada.get("id_pme"))
+        await resumen.sumar_acciones([borrada], -1)
+        await cambios.registrar_eliminados(bd, "acciones", [borrada])
+    await cambios.registrar_eliminados(bd, "recursos", recursos)
+    await resumen.quitar_recursos_de_uuid(uuid, list({r.get("id_pme") for r in recursos}))
     return {"msg": "Eliminada"}
 
-@app.post("/api/acciones/importar_excel")
-async def importar_acciones_excel(id_pme: str, year: int, file: UploadFile = File(...)):
+async def importar_acciones(fuente, id_pme: str, year: int, avance=None, modo: str = "insertar") -> dict:
     try:
-        contents = await file.read()
-        # Leemos el excel y rellenamos nulos con string vacío para evitar errores
-        df = pd.read_excel(BytesIO(contents)).fillna("")
-        
-        # Normalización de columnas
-        df.columns = [
-            c.strip().lower()
-            .replace(' ', '_')
-            .replace('ó','o').replace('é','e').replace('í','i').replace('á','a').replace('ú','u')
-            for c in df.columns
-        ]
-        
-        insert_list = []
-        for row in df.to_dict('records'):
-            # --- NUEVA LÓGICA DE UUID ---
-            # 1. Obtenemos el valor de uuid_accion (si existe) y lo limpiamos
-            uuid_traido = str(row.get("uuid_accion", "")).strip()
-
-            # 2. Si trae texto y no es "nan" (común en pandas), usamos ese.
-            #    Caso contrario, generamos uno nuevo.
-            if uuid_traido and uuid_traido.lower() not in ["nan", "none", ""]:
-                row["uuid_accion"] = uuid_traido
-            else:
-                row["uuid_accion"] = str(uuid.uuid4())
-            # -----------------------------
-
-            row["id_pme"] = id_pme
-            row["year"] = year
-            
-            # Tratamiento de subdimensiones
-            sub = str(row.get("subdimensiones", ""))
-            # Agregamos validación extra para que no falle si sub es "nan"
-            if sub and sub.lower() not in ["nan", "none"]:
-                row["subdimensiones"] = [s.strip() for s in sub.split(',')]
-            else:
-                row["subdimensiones"] = []
-
-            # Limpieza de montos
-            try:
-                row["monto_sep"] = int(str(row.get("monto_sep", 0)).replace('.', '').replace('$', ''))
-            except: row["monto_sep"] = 0
-            
-            try:
-                row["monto_total"] = int(str(row.get("monto_total", 0)).replace('.', '').replace('$', ''))
-            except: row["monto_total"] = 0
-
-            try:
-                # Validamos contra el esquema
-                acc = Schema_Acciones(**row)
-                acc_dict = acc.model_dump(by_alias=True, exclude={"id"})
-                acc_dict["_id"] = str(ObjectId())
-                insert_list.append(acc_dict)
-            except Exception as e: 
-                print(f"Fila saltada por error validación: {e}")
-                continue
-
-        if insert_list:
-            res = col_acciones.insert_many(insert_list)
-            return {"msg": "Importación exitosa", "total": len(res.inserted_ids)}
-        return {"msg": "No se importaron datos", "total": 0}
-
+        # Lectura y validación por lotes en el threadpool (no bloquean el event loop)
+        reporte = await importador_acciones.ejecutar(fuente, id_pme, year, avance, modo)
+    finally:
+        # Un error a mitad de camino puede dejar lotes ya insertados
+        await invalidar_acciones(id_pme)
+
+    escritos = reporte["insertados"] + reporte["actualizados"]
+    msg = "Importación exitosa" if escritos or reporte["sin_cambios"] else "No se importaron datos"
+    if modo == "actualizar" and (escritos or reporte["sin_cambios"]):
+        msg += f": {reporte['insertados']} nuevas, {reporte['actualizados']} actualizadas, {reporte['sin_cambios']} sin cambios"
+    return {"msg": msg, "total": escritos, "total_registrados": escritos, **reporte}
+
+@app.post("/api/acciones/importar_excel", dependencies=SOLO_ADMIN)
+async def importar_acciones_excel(id_pme: str, year: int, file: UploadFile = File(...), segundo_plano: bool = False,
+                                  modo: str = Query("insertar", pattern=PATRON_MODO_IMPORTACION)):
+    if segundo_plano:
+        return await encolar_importacion("acciones", id_pme, year, file, modo)
+    try:
+        return await importar_acciones(file.file, id_pme, year, modo=modo)
     except Exception as e:
-        print(f"Error importación: {e}")
+        log.exception("Error en importación de acciones")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def preparar_exportacion_acciones(id_pme: str, columnas: Optional[List[str]] = None):
+    # Sin columnas pedidas van todas las del esquema (comportamiento del endpoint)
+    columnas = exportacion.elegir_columnas(columnas or [], [c for c in Schema_Acciones.model_fields if c != "id"])
+    accs = await exportacion.con_primero(await instantaneas.vista(bd, "acciones", id_pme, proy={"_id": 0}))
+    if accs is None: raise HTTPException(404, "No hay datos")
+
+    filas = exportacion.filas_documentos(accs, columnas)
+    return columnas, filas, f"Acciones_PME_{exportacion.fecha_archivo()}"
+
 @app.get("/api/acciones/exportar/{id_pme}")
-def exportar_acciones_excel(id_pme: str):
-    accs = list(col_acciones.find({"id_pme": id_pme}))
-    if not accs: raise HTTPException(404, "No hay datos")
-    
-    df = pd.DataFrame(accs)
-    if "_id" in df.columns: del df["_id"]
-    
-    if "subdimensiones" in df.columns:
-        df["subdimensiones"] = df["subdimensiones"].apply(lambda x: ", ".join(x) if isinstance(x, list) else str(x))
-        
-    stream = BytesIO()
-    df.to_excel(stream, index=False)
-    stream.seek(0)
-    fname = f"Acciones_PME_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(stream, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename={fname}"})
+async def exportar_acciones_excel(id_pme: str, formato: str = Query("xlsx", pattern="^(xlsx|csv)$"), segundo_plano: bool = False):
+    if segundo_plano:
+        return await encolar_trabajo("exportar", {"vista": "acciones", "id": id_pme, "columnas": [], "formato": formato})
+    return exportacion.respuesta_exportacion(*await preparar_exportacion_acciones(id_pme), formato)
 
 # --- Recursos ---
 @app.get("/api/recursos/{uuid_accion}")
-def listar_recursos(uuid_accion: str):
-    data = list(col_recursos.find({"uuid_accion": uuid_accion}))
-    for d in data: d["_id"] = str(d["_id"])
-    return data
+async def listar_recursos(uuid_accion: str, id_pme: str, fields: Optional[str] = None):
+    try:
+        proy = paginacion.proyeccion(fields, paginacion.CAMPOS_RECURSOS, ["uuid_accion"])
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    # El uuid se repite en los años copiados o heredados: se lee la vista del PME
+    cursor = await instantaneas.vista(bd, "recursos", id_pme, {"uuid_accion": uuid_accion}, proy)
+    return RespuestaJSON(await cursor.to_list())
 
 @app.get("/api/recursos/pme/{id_pme}")
-def listar_todos_recursos_pme(id_pme: str):
-    data = list(col_recursos.find({"id_pme": id_pme}))
-    for d in data: d["_id"] = str(d["_id"])
-    return data
+async def listar_todos_recursos_pme(id_pme: str, fields: Optional[str] = None):
+    try:
+        proy = paginacion.proyeccion(fields, paginacion.CAMPOS_RECURSOS, ["uuid_accion"])
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return RespuestaJSON(await (await instantaneas.vista(bd, "recursos", id_pme, proy=proy)).to_list())
+
+@app.get("/api/recursos/pme/{id_pme}/detalle")
+async def detalle_recursos_pme(
+    id_pme: str,
+    fields: Optional[str] = None,
+    campos_accion: Optional[str] = None,
+    huerfanos: Optional[bool] = None,
+):
+    """Recursos del PME con su acción padre (`accion`) y la marca `huerfano`."""
+    try:
+        proy = paginacion.proyeccion(fields, paginacion.CAMPOS_RECURSOS, ["uuid_accion"])
+        campos_padre = detalle.CAMPOS_PADRE
+        if campos_accion:
+            campos_padre = list(paginacion.proyeccion(campos_accion, set(detalle.CAMPOS_PADRE), []))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    cursor = await detalle.detalle_recursos(bd, id_pme, proy, campos_padre, huerfanos)
+    return RespuestaJSON(await cursor.to_list())
+
+@app.get("/api/recursos/pme/{id_pme}/pagina")
+async def paginar_recursos(
+    id_pme: str,
+    cursor: Optional[str] = None,
+    limite: int = Query(paginacion.LIMITE_DEFECTO, ge=1, le=paginacion.LIMITE_MAXIMO),
+    orden: str = "_id",
+    desc: bool = False,
+    uuid_accion: Optional[str] = None,
+    dimension: Optional[str] = None,
+    responsable: Optional[str] = None,
+    huerfanos: Optional[bool] = None,
+    monto_min: Optional[int] = None,
+    monto_max: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    if orden not in paginacion.ORDEN_RECURSOS:
+        raise HTTPException(400, f"Orden no permitido: {orden}")
+
+    filtro = {"id_pme": id_pme, **paginacion.filtro_monto("monto", monto_min, monto_max)}
+    if responsable: filtro["responsable"] = responsable
+
+    # La dimensión y la condición de huérfano dependen de la acción padre:
+    # se resuelven con los uuid de las acciones del PME (consulta cubierta por índice)
+    vista = await instantaneas.cadena(bd, id_pme)
+    condiciones_uuid = []
+    if uuid_accion:
+        condiciones_uuid.append({"uuid_accion": uuid_accion})
+    if dimension:
+        uuids_dim = await instantaneas.distintos(bd, "acciones", "uuid_accion", id_pme, {"dimension": dimension}, info=vista)
+        condiciones_uuid.append({"uuid_accion": {"$in": uuids_dim}})
+    if huerfanos is not None:
+        uuids_pme = await instantaneas.distintos(bd, "acciones", "uuid_accion", id_pme, info=vista)
+        condiciones_uuid.append({"uuid_accion": {"$nin" if huerfanos else "$in": uuids_pme}})
+    if condiciones_uuid:
+        filtro["$and"] = condiciones_uuid
 
-@app.post("/api/recursos")
-def crear_recurso(recurso: Schema_Recursos):
+    try:
+        proy = paginacion.proyeccion(fields, paginacion.CAMPOS_RECURSOS, ["uuid_accion"])
+        return RespuestaJSON(await paginacion.paginar(bd.recursos, filtro, orden, not desc, limite, cursor, proy,
+                                                      instantaneas.etapas(vista, "recursos") if vista else None))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.post("/api/recursos", dependencies=SOLO_ADMIN)
+async def crear_recurso(recurso: Schema_Recursos):
     new = recurso.model_dump(by_alias=True, exclude={"id"})
-    res = col_recursos.insert_one(new)
+    new["_id"] = identificadores.nuevo()
+    await instantaneas.congelar(bd, "recursos", [new])
+    res = await bd.recursos.insert_one(new)
+    await resumen.sumar_recursos([new])
     return {"msg": "Creado", "id": str(res.inserted_id), "uuid_accion_padre": new["uuid_accion"]}
 
-@app.put("/api/recursos/{id_recurso}")
-def modificar_recurso(id_recurso: str, recurso: Schema_Recursos):
+@app.post("/api/recursos/bulk", dependencies=SOLO_ADMIN)
+async def editar_recursos_masivo(sol: SolicitudMasiva):
+    return RespuestaJSON(await masivo.editar_recursos(bd, resumen, Schema_Recursos, sol.operaciones, sol.id_pme))
+
+async def recurso_reemplazado(antes: dict, update_data: dict):
+    if update_data.get("id_pme", antes.get("id_pme")) != antes.get("id_pme"):
+        await instantaneas.congelar(bd, "recursos", [{**antes, **update_data}])
+        await instantaneas.ocultar(bd, "recursos", [antes])
+        await cambios.registrar_eliminados(bd, "recursos", [antes])
+    await resumen.reemplazar_recurso(antes, {**antes, **update_data})
+
+@app.put("/api/recursos/{id_recurso}", dependencies=SOLO_ADMIN)
+async def modificar_recurso(id_recurso: str, recurso: Schema_Recursos):
     # Preparamos los datos a actualizar
     update_data = recurso.model_dump(exclude_unset=True, exclude={"id"})
-    
-    # INTENTO 1: Buscar por ObjectId (Estándar de MongoDB)
-    try:
-        res = col_recursos.update_one({"_id": ObjectId(id_recurso)}, {"$set": update_data})
-        if res.matched_count > 0:
-            return {"msg": "Recurso actualizado (ObjectId)"}
-    except Exception as e:
-        # Si el ID no tiene formato válido de ObjectId, fallará el constructor, ignoramos y pasamos al Intento 2
-        pass 
-
-    # INTENTO 2: Buscar por String (Común en datos importados donde forzamos str(ObjectId))
-    res = col_recursos.update_one({"_id": id_recurso}, {"$set": update_data})
-    
-    if res.matched_count > 0:
-        return {"msg": "Recurso actualizado (String)"}
+    update_data["fecha_actualizacion"] = datetime.now()
+
+    # Caso común (PME sin instantáneas y el recurso es suyo): un solo
+    # find_one_and_update; el documento previo (BEFORE) da la diferencia
+    # para el resumen. Con instantáneas hay que congelar a los dependientes
+    # y materializar lo heredado antes de escribir, y un recurso que viene
+    # de otro PME se busca fuera: eso sigue por para_escribir.
+    id_pme = update_data.get("id_pme")
+    antes = None
+    if id_pme and await instantaneas.sin_dependencias(bd, id_pme):
+        antes = await bd.recursos.find_one_and_update({**identificadores.filtro_id(id_recurso), "id_pme": id_pme},
+                                                      {"$set": update_data}, return_document=ReturnDocument.BEFORE)
+    if antes is None:
+        # Desde una instantánea, el recurso heredado se copia al PME antes de editarlo
+        objetivos = await instantaneas.para_escribir(bd, "recursos", identificadores.filtro_id(id_recurso), id_pme)
+        if objetivos:
+            antes = await bd.recursos.find_one_and_update({"_id": objetivos[0]["_id"]}, {"$set": update_data},
+                                                          return_document=ReturnDocument.BEFORE)
+    if antes:
+        await recurso_reemplazado(antes, update_data)
+        return {"msg": "Recurso actualizado"}
     
     # Si llega aquí, es que no encontró nada de ninguna forma
-    print(f"⚠️ ALERTA: Se intentó actualizar ID {id_recurso} pero no existe en la BD.")
+    log.warning("Se intentó actualizar un recurso que no existe", extra={"id_recurso": id_recurso})
     # Retornamos 200 con advertencia para no romper el front, pero sabiendo que falló
     return {"msg": "No se realizaron cambios (ID no encontrado)"}
 
-@app.delete("/api/recursos/{id_recurso}")
-def eliminar_recurso(id_recurso: str):
-    try:
-        col_recursos.delete_one({"_id": ObjectId(id_recurso)})
-        return {"msg": "Recurso eliminado"}
-    except: raise HTTPException(400, "ID inválido")
-
-@app.post("/api/recursos/importar_excel")
-async def importar_recursos_excel(id_pme: str, year: int, file: UploadFile = File(...)):
+@app.delete("/api/recursos/{id_recurso}", dependencies=SOLO_ADMIN)
+async def eliminar_recurso(id_recurso: str, id_pme: str):
+    borrados = await instantaneas.eliminar(bd, "recursos", identificadores.filtro_id(id_recurso), id_pme)
+    if borrados:
+        await resumen.sumar_recursos(borrados, -1)
+        await cambios.registrar_eliminados(bd, "recursos", borrados)
+    return {"msg": "Recurso eliminado"}
+
+async def importar_recursos(fuente, id_pme: str, year: int, avance=None, modo: str = "insertar") -> dict:
+    reporte = await importador_recursos.ejecutar(fuente, id_pme, year, avance, modo)
+    if not (reporte["insertados"] or reporte["actualizados"] or reporte["sin_cambios"]):
+        return {"msg": "Sin datos válidos", "total_registrados": 0, **reporte}
+    msg = "Importado correctamente"
+    if modo == "actualizar":
+        msg += f": {reporte['insertados']} creados, {reporte['actualizados']} actualizados, {reporte['sin_cambios']} sin cambios"
+    return {
+        "msg": msg,
+        # Insertados + actualizados; el detalle va en insertados / actualizados / sin_cambios
+        "total_registrados": reporte["insertados"] + reporte["actualizados"],
+        "huérfanos": reporte["huerfanos"],
+        "nota": "Los recursos huérfanos se crearon pero deben asociarse manualmente.",
+        **reporte,
+    }
+
+@app.post("/api/recursos/importar_excel", dependencies=SOLO_ADMIN)
+async def importar_recursos_excel(id_pme: str, year: int, file: UploadFile = File(...), segundo_plano: bool = False,
+                                  modo: str = Query("insertar", pattern=PATRON_MODO_IMPORTACION)):
+    if segundo_plano:
+        return await encolar_importacion("recursos", id_pme, year, file, modo)
     try:
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents)).fillna("")
-        
-        # Normalización de columnas
-        df.columns = [
-            c.strip().lower()
-            .replace(' ', '_')
-            .replace('ó','o').replace('é','e').replace('í','i').replace('á','a').replace('ú','u')
-            .replace('descripción','descripcion') 
-            for c in df.columns
-        ]
-        
-        insert_list = []
-        for row in df.to_dict('records'):
-            row.update({"id_pme": id_pme, "year": year})
-            
-            # --- LOGICA UUID_ACCION ---
-            # 1. Buscamos si existe la columna uuid_accion en el excel
-            uuid_traido = str(row.get("uuid_accion", "")).strip()
-            
-            # 2. Si existe y no es "nan" ni vacío, lo usamos.
-            #    Si NO existe o está vacío, asignamos "sin asignar" (se crea el recurso igual)
-            if uuid_traido and uuid_traido.lower() not in ["nan", "none", ""]:
-                row["uuid_accion"] = uuid_traido
-            else:
-                row["uuid_accion"] = "sin asignar"
-            
-            # Tratamiento de lista de recursos (insumos)
-            # Acepta columna 'recursos_actividad' o 'insumos'
-            rs = str(row.get("recursos_actividad", row.get("insumos", "")))
-            row["recursos_actividad"] = [s.strip() for s in rs.split(',')] if rs and rs.lower() != "nan" else []
-            
-            # Limpieza de monto
-            try:
-                row["monto"] = int(str(row.get("monto", 0)).replace('.', '').replace('$', ''))
-            except: row["monto"] = 0
-
-            try:
-                res_obj = Schema_Recursos(**row)
-                res_dict = res_obj.model_dump(by_alias=True, exclude={"id"})
-                res_dict["_id"] = str(ObjectId())
-                insert_list.append(res_dict)
-            except Exception as e: 
-                print(f"Error fila recurso: {e}")
-                continue
-
-        if insert_list:
-            res = col_recursos.insert_many(insert_list)
-            # Contamos cuántos quedaron huérfanos para avisar al usuario
-            huerfanos = sum(1 for x in insert_list if x["uuid_accion"] == "sin asignar")
-            return {
-                "msg": "Importado correctamente", 
-                "total_registrados": len(res.inserted_ids), 
-                "huérfanos": huerfanos,
-                "nota": "Los recursos huérfanos se crearon pero deben asociarse manualmente."
-            }
-        return {"msg": "Sin datos válidos", "total_registrados": 0}
-
+        return await importar_recursos(file.file, id_pme, year, modo=modo)
     except Exception as e:
-        print(f"Error importacion recursos: {e}")
+        log.exception("Error en importación de recursos")
         raise HTTPException(500, str(e))
 
 
+async def preparar_exportacion_recursos(id_pme: str, columnas: List[str]):
+    # Las columnas elegidas se aplican como proyección; la acción padre viene unida ($lookup)
+    cols = exportacion.elegir_columnas(columnas, exportacion.COLUMNAS_RECURSOS)
+    recursos = await exportacion.con_primero(await detalle.detalle_recursos(
+        bd, id_pme, exportacion.proyeccion_recursos(cols), exportacion.campos_accion_padre(cols)))
+    if recursos is None: raise HTTPException(404, "No hay recursos")
+
+    filas = exportacion.filas_recursos(recursos, cols, exportacion.accion_unida, huerfano="Huérfano")
+    return cols, filas, f"Recursos_{exportacion.fecha_archivo()}"
+
 @app.post("/api/recursos/exportar_custom/{id_pme}")
-def exportar_recursos_custom(id_pme: str, payload: ExportColumnas):
-    recursos = list(col_recursos.find({"id_pme": id_pme}))
-    if not recursos: raise HTTPException(404, "No hay recursos")
+async def exportar_recursos_custom(id_pme: str, payload: ExportColumnas, formato: str = Query("xlsx", pattern="^(xlsx|csv)$"), segundo_plano: bool = False):
+    if segundo_plano:
+        return await encolar_trabajo("exportar", {"vista": "recursos_pme", "id": id_pme, "columnas": payload.columnas, "formato": formato})
+    return exportacion.respuesta_exportacion(*await preparar_exportacion_recursos(id_pme, payload.columnas), formato)
+
+async def preparar_exportacion_recursos_accion(uuid_accion: str, columnas: List[str], id_pme: str):
+    cols = exportacion.elegir_columnas(columnas, exportacion.COLUMNAS_RECURSOS)
+    proy_rec = exportacion.proyeccion_recursos(cols)
+    recursos = await exportacion.con_primero(await instantaneas.vista(bd, "recursos", id_pme, {"uuid_accion": uuid_accion}, proy_rec))
+    if recursos is None: raise HTTPException(404, "No hay recursos en esta acción")
     
-    acciones = list(col_acciones.find({"id_pme": id_pme}))
-    acciones_map = {a["uuid_accion"]: a for a in acciones}
+    proy_acc = {**(exportacion.proyeccion_acciones(cols) or {}), "nombre_accion": 1}
+    accion_padre = await (await instantaneas.vista(bd, "acciones", id_pme, {"uuid_accion": uuid_accion}, proy_acc)).to_list()
+    accion_padre = accion_padre[0] if accion_padre else {}
     
-    data_procesada = []
-    for rec in recursos:
-        padre = acciones_map.get(rec.get("uuid_accion"), {})
-        r_list = rec.get("recursos_actividad", [])
-        
-        fila = {
-            "nombre_actividad": rec.get("nombre_actividad", ""),
-            "descripcion_actividad": rec.get("descripcion_actividad", ""),
-            "responsable": rec.get("responsable", ""),
-            "medios_ver": rec.get("medios_ver", ""),
-            "recursos_actividad": ", ".join(r_list) if isinstance(r_list, list) else str(r_list),
-            "monto": rec.get("monto", 0),
-            "year": rec.get("year", ""),
-            "uuid_accion": rec.get("uuid_accion", ""),
-            "nombre_accion": padre.get("nombre_accion", "Huérfano"),
-            "descripcion_accion": padre.get("descripcion", ""),
-            "dimension": padre.get("dimension", "")
-        }
-        data_procesada.append(fila)
-        
-    df = pd.DataFrame(data_procesada)
-    cols = [c for c in payload.columnas if c in df.columns] or df.columns.tolist()
-    df = df[cols]
-    
-    stream = BytesIO()
-    df.to_excel(stream, index=False)
-    stream.seek(0)
-    fname = f"Recursos_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return StreamingResponse(stream, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename={fname}"})
+    filas = exportacion.filas_recursos(recursos, cols, lambda _: accion_padre)
+    nom_clean = str(accion_padre.get("nombre_accion", "Accion"))[:15].replace(" ", "_")
+    return cols, filas, f"Detalle_{nom_clean}"
 
 @app.post("/api/recursos/exportar_custom_accion/{uuid_accion}")
-def exportar_recursos_accion_custom(uuid_accion: str, payload: ExportColumnas):
-    recursos = list(col_recursos.find({"uuid_accion": uuid_accion}))
-    if not recursos: raise HTTPException(404, "No hay recursos en esta acción")
-    
-    accion_padre = col_acciones.find_one({"uuid_accion": uuid_accion}) or {}
-    
-    data_procesada = []
-    for rec in recursos:
-        r_list = rec.get("recursos_actividad", [])
-        fila = {
-            "nombre_actividad": rec.get("nombre_actividad", ""),
-            "descripcion_actividad": rec.get("descripcion_actividad", ""),
-            "responsable": rec.get("responsable", ""),
-            "medios_ver": rec.get("medios_ver", ""),
-            "recursos_actividad": ", ".join(r_list) if isinstance(r_list, list) else str(r_list),
-            "monto": rec.get("monto", 0),
-            "year": rec.get("year", ""),
-            "uuid_accion": uuid_accion,
-            "nombre_accion": accion_padre.get("nombre_accion", ""),
-            "descripcion_accion": accion_padre.get("descripcion", ""),
-            "dimension": accion_padre.get("dimension", "")
-        }
-        data_procesada.append(fila)
-        
-    df = pd.DataFrame(data_procesada)
-    cols = [c for c in payload.columnas if c in df.columns] or df.columns.tolist()
-    df = df[cols]
-    
-    stream = BytesIO()
-    df.to_excel(stream, index=False)
-    stream.seek(0)
-    
-    nom_clean = str(accion_padre.get("nombre_accion", "Accion"))[:15].replace(" ", "_")
-    fname = f"Detalle_{nom_clean}.xlsx"
-    return StreamingResponse(stream, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename={fname}"})
+async def exportar_recursos_accion_custom(uuid_accion: str, payload: ExportColumnas, formato: str = Query("xlsx", pattern="^(xlsx|csv)$"), segundo_plano: bool = False,
+                                          id_pme: str = Query(...)):
+    if segundo_plano:
+        return await encolar_trabajo("exportar", {"vista": "recursos_accion", "id": uuid_accion, "columnas": payload.columnas, "formato": formato, "id_pme": id_pme})
+    return exportacion.respuesta_exportacion(*await preparar_exportacion_recursos_accion(uuid_accion, payload.columnas, id_pme), formato)
+
+# --- Certificados ---
+async def preparar_certificados(id_pme: str, sol: SolicitudCertificados):
+    pme = await bd.pme.find_one(identificadores.filtro_id(id_pme))
+    if not pme: raise HTTPException(404, "PME no encontrado")
+
+    colegio = await bd.colegios.find_one(identificadores.filtro_id(pme.get("id_colegio")))
+    # El logo puede requerir una descarga: fuera del event loop
+    contexto = await run_in_threadpool(certificados.preparar_contexto, colegio or {}, pme, sol.campos, sol.ciudad)
+
+    filtro = {}
+    if sol.ids:
+        filtro.update(identificadores.filtro_ids(sol.ids))
+    if sol.uuid_accion:
+        filtro["uuid_accion"] = sol.uuid_accion
+    pipeline = detalle.pipeline_detalle(id_pme, campos_padre=detalle.CAMPOS_PADRE + ["subdimensiones"], filtro=filtro,
+                                        info=await instantaneas.cadena(bd, id_pme))
+    recursos = await exportacion.con_primero(await bd.recursos.aggregate(pipeline))
+    if recursos is None: raise HTTPException(404, "No hay recursos para certificar")
+    return contexto, recursos, f"Certificados_PME_{pme.get('year', '')}.zip"
+
+@app.post("/api/certificados/pme/{id_pme}")
+async def generar_certificados(id_pme: str, sol: SolicitudCertificados, segundo_plano: bool = False):
+    """Certificados PDF de los recursos del PME (o de `ids` / `uuid_accion`) en un ZIP."""
+    if segundo_plano:
+        return await encolar_trabajo("certificados", {"id_pme": id_pme, **sol.model_dump()})
+    contexto, recursos, nombre = await preparar_certificados(id_pme, sol)
+    return StreamingResponse(certificados.zip_certificados(contexto, recursos), media_type="application/zip",
+                             headers={"Content-Disposition": f"attachment; filename={nombre}"})
+
+# --- Trabajos en segundo plano ---
+# Con `segundo_plano=true` los endpoints de clonación, importación,
+# exportación y eliminación responden 202 con el id del trabajo; el avance
+# y el resultado se consultan en /api/jobs/{id}.
+
+async def encolar_trabajo(tipo: str, params: dict, archivos: Optional[list] = None):
+    id_trabajo = await cola.encolar(tipo, params, archivos)
+    return RespuestaJSON({"msg": "Trabajo encolado", "job_id": id_trabajo, "estado_url": f"/api/jobs/{id_trabajo}"}, status_code=202)
+
+async def encolar_importacion(coleccion: str, id_pme: str, year: int, file: UploadFile, modo: str = "insertar"):
+    # La planilla se guarda en disco para que el trabajo sobreviva a un reinicio
+    archivo = f"subida_{ObjectId()}.xlsx"
+    with open(trabajos.ruta_archivo(archivo), "wb") as destino:
+        await run_in_threadpool(shutil.copyfileobj, file.file, destino)
+    params = {"coleccion": coleccion, "id_pme": id_pme, "year": year, "archivo": archivo, "modo": modo}
+    return await encolar_trabajo("importar", params, [archivo])
+
+async def trabajo_clonar(trabajo: dict, avance) -> dict:
+    p = trabajo["params"]
+    return await clonar_en_destino(p["id_pme_origen"], p["id_pme_destino"])
+
+async def trabajo_eliminar(trabajo: dict, avance) -> dict:
+    return await eliminar_pme(trabajo["params"]["id_pme"], avance)
+
+async def trabajo_importar(trabajo: dict, avance) -> dict:
+    p = trabajo["params"]
+    importar = importar_acciones if p["coleccion"] == "acciones" else importar_recursos
+    return await importar(trabajos.ruta_archivo(p["archivo"]), p["id_pme"], p["year"], avance, p.get("modo", "insertar"))
+
+# vista -> (preparar, colección y campo de `id` para contar las filas)
+EXPORTACIONES = {
+    "acciones": (preparar_exportacion_acciones, "acciones", "id_pme"),
+    "recursos_pme": (preparar_exportacion_recursos, "recursos", "id_pme"),
+    "recursos_accion": (preparar_exportacion_recursos_accion, "recursos", "uuid_accion"),
+}
+
+async def trabajo_exportar(trabajo: dict, avance) -> dict:
+    p = trabajo["params"]
+    preparar, nombre_col, campo = EXPORTACIONES[p["vista"]]
+    # Se cuenta sobre la vista del PME: una instantánea exporta también lo heredado
+    if campo == "id_pme":
+        total = await instantaneas.contar(bd, nombre_col, p["id"])
+    else:
+        total = await instantaneas.contar(bd, nombre_col, p.get("id_pme"), {campo: p["id"]})
+    # Solo la exportación por acción usa id_pme (vista de una instantánea)
+    encabezados, filas, nombre_base = await preparar(p["id"], p["columnas"], **({"id_pme": p["id_pme"]} if p.get("id_pme") else {}))
+
+    archivo = f"exportacion_{trabajo['_id']}.{p['formato']}"
+    await cola.col.update_one({"_id": trabajo["_id"]}, {"$addToSet": {"archivos": archivo}})
+    filas = exportacion.con_avance(filas, avance, total)
+    ext = await exportacion.guardar_exportacion(encabezados, filas, trabajos.ruta_archivo(archivo), p["formato"])
+    return {"archivo": archivo, "nombre": f"{nombre_base}.{ext}", "descarga": f"/api/jobs/{trabajo['_id']}/descarga"}
+
+async def trabajo_certificados(trabajo: dict, avance) -> dict:
+    p = dict(trabajo["params"])
+    id_pme = p.pop("id_pme")
+    contexto, recursos, nombre = await preparar_certificados(id_pme, SolicitudCertificados(**p))
+
+    archivo = f"certificados_{trabajo['_id']}.zip"
+    await cola.col.update_one({"_id": trabajo["_id"]}, {"$addToSet": {"archivos": archivo}})
+    await exportacion.guardar_bloques(certificados.zip_certificados(contexto, recursos, avance), trabajos.ruta_archivo(archivo))
+    return {"archivo": archivo, "nombre": nombre, "descarga": f"/api/jobs/{trabajo['_id']}/descarga"}
+
+cola.registrar("clonar", trabajo_clonar)
+cola.registrar("eliminar", trabajo_eliminar)
+cola.registrar("importar", trabajo_importar)
+cola.registrar("exportar", trabajo_exportar)
+cola.registrar("certificados", trabajo_certificados)
+
+@app.get("/api/jobs/{id_trabajo}")
+async def estado_trabajo(id_trabajo: str):
+    trabajo = await cola.obtener(id_trabajo)
+    if not trabajo: raise HTTPException(404, "Trabajo no encontrado")
+    resultado = trabajo.get("resultado") or {}
+    if resultado.get("descarga"):
+        # Enlace firmado: el navegador lo abre sin la cabecera Authorization
+        resultado["descarga"] = auth.autenticador.firmar_ruta(resultado["descarga"])
+    return RespuestaJSON(trabajo)
+
+@app.get("/api/jobs/{id_trabajo}/descarga")
+async def descargar_trabajo(id_trabajo: str):
+    trabajo = await cola.obtener(id_trabajo)
+    if not trabajo: raise HTTPException(404, "Trabajo no encontrado")
+    resultado = trabajo.get("resultado") or {}
+    if trabajo["estado"] != "completado" or "archivo" not in resultado:
+        raise HTTPException(409, f"El trabajo no tiene archivo para descargar (estado: {trabajo['estado']})")
+
+    ruta = trabajos.ruta_archivo(resultado["archivo"])
+    if not os.path.exists(ruta): raise HTTPException(410, "El archivo ya no está disponible")
+    media = {".csv": exportacion.MEDIA_CSV, ".zip": "application/zip"}.get(os.path.splitext(ruta)[1], exportacion.MEDIA_XLSX)
+    return FileResponse(ruta, media_type=media, filename=resultado["nombre"])
+
+# --- Consolidado del sostenedor ---
+def _lista_colegios(colegios: Optional[str]) -> Optional[List[str]]:
+    return [c.strip() for c in colegios.split(",") if c.strip()] if colegios else None
+
+@app.get("/api/rollups")
+async def consultar_rollups(colegios: Optional[str] = None, desde: Optional[int] = None,
+                            hasta: Optional[int] = None, dimension: Optional[str] = None):
+    """Montos por colegio, año y dimensión (colegios: ids separados por coma)."""
+    return RespuestaJSON(await rollups.consultar(_lista_colegios(colegios), desde, hasta, dimension))
+
+@app.post("/api/rollups/refrescar", dependencies=SOLO_ADMIN)
+async def refrescar_rollups(todo: bool = False):
+    return RespuestaJSON(await rollups.refrescar(todo))
+
+@app.get("/api/rollups/exportar")
+async def exportar_rollups(colegios: Optional[str] = None, desde: Optional[int] = None,
+                           hasta: Optional[int] = None, dimension: Optional[str] = None):
+    hojas = await rollups.hojas_xlsx(_lista_colegios(colegios), desde, hasta, dimension)
+    return exportacion.respuesta_xlsx_hojas(hojas, f"Consolidado_PME_{exportacion.fecha_archivo()}")
+
+# --- Caché ---
+@app.get("/api/cache/estadisticas")
+async def estadisticas_cache():
+    return cache.estadisticas()
+
+# --- Salud ---
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: el proceso responde (no consulta la BD)."""
+    return {"estado": "ok", "pid": os.getpid()}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: inicialización completa, Mongo responde y los índices existen."""
+    estado = await salud.verificar_listo(bd, arranque)
+    return RespuestaJSON(estado, status_code=200 if estado["listo"] else 503)
+
+# --- Métricas ---
+# Eventos de la caché como contador de Prometheus (se leen al exponer)
+observabilidad.REGISTRO.agregar(observabilidad.Contador(
+    "pme_cache_eventos_total", "Eventos de la caché de lecturas", ("evento",),
+    lambda: {(k,): v for k, v in cache.estadisticas().items() if k in ("hits", "misses", "expirados", "obsoletos", "desalojados", "invalidaciones")}))
+observabilidad.REGISTRO.agregar(observabilidad.Medidor(
+    "pme_cache_entradas", "Entradas en la caché de lecturas", (), lambda: {(): cache.estadisticas()["entradas"]}))
+observabilidad.REGISTRO.agregar(observabilidad.Medidor(
+    "pme_arranque_segundos", "Segundos desde el import hasta cada hito del arranque", ("hito",),
+    lambda: {(k.removesuffix("_segundos"),): v for k, v in arranque.tiempos().items() if k.endswith("_segundos") and v is not None}))
+
+@app.get("/metrics", include_in_schema=False)
+async def metricas():
+    return Response(observabilidad.REGISTRO.exponer(), media_type=observabilidad.TIPO_CONTENIDO)
+
+@app.get("/api/metricas/lentos")
+async def comandos_lentos():
+    """Últimos comandos de Mongo sobre MONGO_LENTO_MS, con la forma de su filtro."""
+    return {"umbral_ms": escucha_mongo.umbral_ms, "comandos": list(reversed(escucha_mongo.lentos))}
 
     
-# --- Init Users ---
-if not col_users.find_one({"perfil": "administrador"}):
-    col_users.insert_one({"perfil": "administrador", "contrasena": "admin123"})
-    print(">>> Usuario ADMIN creado")
-if not col_users.find_one({"perfil": "usuario"}):
-    col_users.insert_one({"perfil": "usuario", "contrasena": "user123"})
-    print(">>> Usuario VISITA creado")
-
 if __name__ == "__main__":
     import uvicorn
     # Se usa el puerto 8000 dentro del contenedor
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, access_log=False)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import asyncio
+import html
+import re
+import unicodedata
+from collections import defaultdict
+from typing import List, Optional
+
+import instantaneas
+
+# ==========================================
+# BÚSQUEDA DE TEXTO (/api/buscar)
+# ==========================================
+# Busca en acciones y recursos con los índices de texto de MongoDB (ver
+# indices.py), en vez de descargar el PME completo y filtrar en el
+# navegador. Los índices usan el idioma español (raíces: "talleres"
+# encuentra "taller") y la versión 3 de índices de texto ya ignora tildes y
+# mayúsculas: "evaluacion" encuentra "Evaluación".
+#
+# Se consulta cada colección con el mismo filtro de alcance (colegio, PME,
+# año), se ordena por puntaje de texto y se mezclan las dos listas. La
+# paginación es por número de página: el orden por puntaje no sirve para
+# cursores keyset y una búsqueda rara vez pasa de las primeras páginas.
+#
+# Los fragmentos resaltados se arman en Python: MongoDB no indica qué
+# palabras coincidieron. Vienen como HTML escapado con <mark> en las
+# palabras que comparten raíz con algún término buscado.
+#
+# $text solo puede ir en la primera etapa, así que la vista de una
+# instantánea (ver instantaneas.py) no se puede filtrar en el servidor.
+# Si el alcance incluye instantáneas se buscan también sus bases y cada
+# coincidencia de una base se muestra en la instantánea que la ve (no
+# oculta y sin una versión más cercana en la cadena), con `heredado`.
+# Ese camino cuenta y pagina en Python sobre las primeras
+# MAX_PAGINAS * LIMITE_MAXIMO coincidencias de cada colección.
+
+CAMPOS = {
+    "acciones": {"nombre_accion": 5, "estrategia": 2, "descripcion": 1},
+    "recursos": {"nombre_actividad": 5, "recursos_actividad": 3, "descripcion_actividad": 1},
+}
+TITULO = {"acciones": "nombre_accion", "recursos": "nombre_actividad"}
+TIPO = {"acciones": "accion", "recursos": "recurso"}
+IDIOMA = "spanish"
+
+LIMITE_MAXIMO = 100
+MAX_PAGINAS = 50
+LARGO_FRAGMENTO = 160
+
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+# Palabras vacías frecuentes: el índice de texto las ignora y no se resaltan
+_VACIAS = {"con", "del", "las", "los", "por", "para", "que", "una", "uno", "sus", "como", "entre", "sin", "sobre"}
+
+
+def sin_tildes(texto: str) -> str:
+    descompuesto = unicodedata.normalize("NFD", texto.lower())
+    return "".join(c for c in descompuesto if unicodedata.category(c) != "Mn")
+
+
+def terminos(q: str) -> List[str]:
+    """Raíces aproximadas de los términos buscados (sin los excluidos con "-")."""
+    raices = []
+    for token in q.split():
+        if token.startswith("-"):
+            continue
+        for palabra in _PALABRA.findall(sin_tildes(token)):
+            if len(palabra) < 3 or palabra in _VACIAS:
+                continue
+            # Recorta el plural y la flexión final, como hace el stemmer
+            raices.append(palabra[:max(4, len(palabra) - 2)])
+    return raices
+
+
+def resaltar(texto: str, raices: List[str]) -> Optional[str]:
+    """Fragmento de `texto` alrededor de la primera coincidencia, o None si no hay."""
+    coincidencias = [m for m in _PALABRA.finditer(texto) if any(sin_tildes(m.group()).startswith(r) for r in raices)]
+    if not coincidencias:
+        return None
+    inicio = max(coincidencias[0].start() - LARGO_FRAGMENTO // 4, 0)
+    fin = min(inicio + LARGO_FRAGMENTO, len(texto))
+    if inicio > 0:
+        # No cortar palabras al inicio del fragmento
+        espacio = texto.find(" ", inicio)
+        inicio = espacio + 1 if 0 <= espacio < coincidencias[0].start() else inicio
+
+    partes, pos = [], inicio
+    for m in coincidencias:
+        if m.start() < inicio or m.end() > fin:
+            continue
+        partes.append(html.escape(texto[pos:m.start()]))
+        partes.append(f"<mark>{html.escape(m.group())}</mark>")
+        pos = m.end()
+    partes.append(html.escape(texto[pos:fin]))
+    return ("…" if inicio > 0 else "") + "".join(partes) + ("…" if fin < len(texto) else "")
+
+
+def fragmentos(doc: dict, coleccion: str, raices: List[str]) -> list:
+    salida = []
+    for campo in CAMPOS[coleccion]:
+        valor = doc.get(campo)
+        textos = valor if isinstance(valor, list) else [valor]
+        for texto in textos:
+            if isinstance(texto, str) and texto:
+                marcado = resaltar(texto, raices)
+                if marcado:
+                    salida.append({"campo": campo, "html": marcado})
+    return salida
+
+
+def _consulta(col, filtro: dict, coleccion: str, cantidad: int):
+    proy = {"puntaje": {"$meta": "textScore"}, "id_pme": 1, "year": 1, "uuid_accion": 1, "origen": 1,
+            **{c: 1 for c in CAMPOS[coleccion]}}
+    return col.find(filtro, proy).sort([("puntaje", {"$meta": "textScore"}), ("_id", 1)]).limit(cantidad).to_list()
+
+
+async def _alcance(bd, filtro_pme: Optional[dict]):
+    """(filtro por id_pme, PME buscados o None si son todos, instantáneas entre ellos)."""
+    proy = {"bases": 1, "ocultos": 1, "year": 1}
+    if filtro_pme is None:
+        vistas = [instantaneas.info_pme(p) async for p in bd.pme.find({"bases.0": {"$exists": True}}, proy)]
+        return {}, None, vistas
+    pmes = await bd.pme.find(filtro_pme, proy).to_list()
+    propios = {str(p["_id"]) for p in pmes}
+    vistas = [instantaneas.info_pme(p) for p in pmes if p.get("bases")]
+    ids = propios | {b for v in vistas for b in v["cadena"]}
+    return {"id_pme": {"$in": list(ids)}}, propios, vistas
+
+
+async def _en_vistas(bd, coleccion: str, filtro: dict, propios: Optional[set], vistas: List[dict]) -> List[dict]:
+    """Coincidencias tal como las ven los PME buscados (las de una base, una vez por instantánea que la ve)."""
+    col = getattr(bd, coleccion)
+    docs = await _consulta(col, filtro, coleccion, MAX_PAGINAS * LIMITE_MAXIMO)
+    raices = list({instantaneas.raiz(d) for d in docs})
+    # PME de la cadena con alguna versión de cada raíz: en la instantánea se ve la más cercana
+    versiones = defaultdict(set)
+    cadenas = list({p for v in vistas for p in v["cadena"]})
+    async for v in col.find({"id_pme": {"$in": cadenas}, "$or": [{"_id": {"$in": raices}}, {"origen": {"$in": raices}}]},
+                            {"id_pme": 1, "origen": 1}):
+        versiones[instantaneas.raiz(v)].add(v["id_pme"])
+
+    salida = []
+    for d in docs:
+        if propios is None or d.get("id_pme") in propios:
+            salida.append(d)
+        r = instantaneas.raiz(d)
+        for v in vistas:
+            cadena = v["cadena"]
+            if d.get("id_pme") not in cadena[1:] or r in v["ocultos"].get(coleccion, []):
+                continue
+            if versiones[r] & set(cadena[:cadena.index(d["id_pme"])]):
+                continue
+            salida.append({**d, "id_pme": v["id_pme"], "year": v["year"], "heredado": d["id_pme"]})
+    return salida
+
+
+async def buscar(bd, q: str, filtro_pme: Optional[dict], pagina: int, limite: int) -> dict:
+    """Página `pagina` (desde 1) de las coincidencias de `q` en los PME de `filtro_pme` (None: todos)."""
+    alcance, propios, vistas = await _alcance(bd, filtro_pme)
+    filtro = {"$text": {"$search": q, "$language": IDIOMA}, **alcance}
+    if vistas:
+        acciones, recursos = await asyncio.gather(
+            _en_vistas(bd, "acciones", filtro, propios, vistas),
+            _en_vistas(bd, "recursos", filtro, propios, vistas),
+        )
+        n_acciones, n_recursos = len(acciones), len(recursos)
+    else:
+        cantidad = pagina * limite  # cada colección aporta como mucho la página completa
+        acciones, recursos, n_acciones, n_recursos = await asyncio.gather(
+            _consulta(bd.acciones, filtro, "acciones", cantidad),
+            _consulta(bd.recursos, filtro, "recursos", cantidad),
+            bd.acciones.count_documents(filtro),
+            bd.recursos.count_documents(filtro),
+        )
+
+    mezclados = [("acciones", d) for d in acciones] + [("recursos", d) for d in recursos]
+    mezclados.sort(key=lambda par: -par[1].get("puntaje", 0))
+    raices = terminos(q)
+    resultados = []
+    for coleccion, doc in mezclados[(pagina - 1) * limite:pagina * limite]:
+        resultados.append({
+            "tipo": TIPO[coleccion],
+            "_id": doc["_id"],
+            "id_pme": doc.get("id_pme"),
+            "year": doc.get("year"),
+            "uuid_accion": doc.get("uuid_accion"),
+            "heredado": doc.get("heredado"),
+            "titulo": doc.get(TITULO[coleccion]),
+            "puntaje": round(doc.get("puntaje", 0), 3),
+            "fragmentos": fragmentos(doc, coleccion, raices),
+        })
+    return {
+        "q": q,
+        "pagina": pagina,
+        "limite": limite,
+        "total": n_acciones + n_recursos,
+        "totales": {"acciones": n_acciones, "recursos": n_recursos},
+        "resultados": resultados,
+    }
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+from serializacion import a_json
+
+# ==========================================
+# CACHÉ DE LECTURAS (LRU + TTL) CON ETAG
+# ==========================================
+# Colegios, PMEs de un colegio, búsqueda de PME y acciones de un PME se
+# piden en cada cambio de contexto de la interfaz y cambian poco. Se
+# guardan ya serializados, con su ETag, en un diccionario LRU en memoria
+# del proceso. Las claves son tuplas cuyo primer elemento es el grupo:
+#
+#   ("colegios",)                  ("pmes", id_colegio)
+#   ("pme_buscar", id_colegio, year)  ("acciones", id_pme, fields)
+#
+# Los endpoints de escritura invalidan las claves que afectan. Con varios
+# workers (servidor.py) o contenedores cada proceso tiene su caché, así
+# que invalidar también avanza una versión en Mongo (`cache_versiones`,
+# un documento por prefijo de clave: "acciones|<id_pme>", "pmes", ...).
+# Cada entrada guarda las versiones de sus prefijos al momento de
+# cargarla y en cada lectura se comparan con las actuales (una consulta
+# por _id, mucho más barata que la original): si otro proceso invalidó,
+# la entrada está obsoleta y se vuelve a cargar. Las versiones se leen
+# antes de cargar, así una escritura que ocurre durante la carga deja la
+# entrada obsoleta en la lectura siguiente.
+#
+#   CACHE_MAX_ENTRADAS   entradas máximas por proceso (2000)
+#   CACHE_TTL_SEGUNDOS   vida de cada entrada (60); 0 desactiva la caché
+
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "2000"))
+CACHE_TTL_SEGUNDOS = float(os.getenv("CACHE_TTL_SEGUNDOS", "60"))
+
+
+def calcular_etag(cuerpo: bytes) -> str:
+    return '"' + hashlib.sha1(cuerpo).hexdigest() + '"'
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Comparación débil: "W/" no cambia el valor (las respuestas comprimidas la usan)
+    candidatos = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return "*" in candidatos or etag in candidatos
+
+
+def prefijos(clave: tuple) -> List[str]:
+    """_id en cache_versiones de cada prefijo de la clave: "acciones", "acciones|<id_pme>", ..."""
+    return ["|".join(map(str, clave[:n])) for n in range(1, len(clave) + 1)]
+
+
+class CacheLRU:
+    """LRU en memoria del proceso; con `bd`, las invalidaciones se comparten por cache_versiones."""
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS, ttl: float = CACHE_TTL_SEGUNDOS, bd=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.bd = bd
+        self._datos: "OrderedDict[Hashable, Tuple[float, tuple, str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.obsoletos = 0
+        self.desalojados = 0
+        self.invalidaciones = 0
+
+    @property
+    def activa(self) -> bool:
+        return self.ttl > 0 and self.max_entradas > 0
+
+    async def versiones(self, clave: tuple) -> tuple:
+        """Versiones actuales de los prefijos de `clave` (0 si nunca se invalidaron)."""
+        if self.bd is None:
+            return ()
+        ids = prefijos(clave)
+        actuales = {d["_id"]: d["v"] async for d in self.bd.cache_versiones.find({"_id": {"$in": ids}})}
+        return tuple(actuales.get(i, 0) for i in ids)
+
+    async def _avanzar(self, clave: tuple):
+        if self.bd is not None and self.activa:
+            await self.bd.cache_versiones.update_one({"_id": prefijos(clave)[-1]}, {"$inc": {"v": 1}}, upsert=True)
+
+    def obtener(self, clave: Hashable, versiones: tuple = ()) -> Optional[Tuple[str, bytes]]:
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            self.misses += 1
+            return None
+        expira, guardadas, etag, cuerpo = entrada
+        if expira < time.monotonic():
+            del self._datos[clave]
+            self.expirados += 1
+            self.misses += 1
+            return None
+        if guardadas != versiones:
+            # Otro proceso invalidó la clave después de cargarla
+            del self._datos[clave]
+            self.obsoletos += 1
+            self.misses += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.hits += 1
+        return etag, cuerpo
+
+    def guardar(self, clave: Hashable, valor, versiones: tuple = ()) -> Tuple[str, bytes]:
+        cuerpo = a_json(valor)
+        etag = calcular_etag(cuerpo)
+        if self.activa:
+            self._datos[clave] = (time.monotonic() + self.ttl, versiones, etag, cuerpo)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.desalojados += 1
+        return etag, cuerpo
+
+    async def invalidar(self, *claves: tuple):
+        for clave in claves:
+            if self._datos.pop(clave, None) is not None:
+                self.invalidaciones += 1
+            await self._avanzar(clave)
+
+    async def invalidar_grupo(self, grupo: str, *prefijo):
+        """Borra las claves (grupo, *prefijo, ...), p.ej. ("pme_buscar", id_colegio)."""
+        n = len(prefijo) + 1
+        for clave in [c for c in self._datos if c[:n] == (grupo, *prefijo)]:
+            del self._datos[clave]
+            self.invalidaciones += 1
+        await self._avanzar((grupo, *prefijo))
+
+    def limpiar(self):
+        self.invalidaciones += len(self._datos)
+        self._datos.clear()
+
+    def estadisticas(self) -> dict:
+        consultas = self.hits + self.misses
+        return {
+            "entradas": len(self._datos),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "tasa_hits": round(self.hits / consultas, 4) if consultas else 0.0,
+            "expirados": self.expirados,
+            "obsoletos": self.obsoletos,
+            "desalojados": self.desalojados,
+            "invalidaciones": self.invalidaciones,
+        }
+
+    async def responder(self, request: Request, clave: Hashable, cargar: Callable[[], Awaitable]) -> Response:
+        """Lee de la caché (o de `cargar()`) y responde con ETag; 304 si el cliente ya lo tiene."""
+        versiones = await self.versiones(clave) if self.activa else ()
+        entrada = self.obtener(clave, versiones) if self.activa else None
+        if entrada is None:
+            entrada = self.guardar(clave, await cargar(), versiones)
+        etag, cuerpo = entrada
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_coincide(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(cuerpo, media_type="application/json", headers=headers)
@@ -0,0 +1,81 @@
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+import detalle
+import instantaneas
+
+# ==========================================
+# SINCRONIZACIÓN INCREMENTAL (/api/pme/{id_pme}/cambios)
+# ==========================================
+# El frontend guarda un token después de cada carga y, tras una edición,
+# pide solo lo que cambió desde ese token en vez de volver a descargar
+# todas las acciones y recursos del PME:
+#
+#   acciones / recursos   creados o modificados (fecha_actualizacion >= token)
+#   eliminados            _id de las acciones y recursos borrados o
+#                         movidos a otro PME (colección `eliminados`)
+#
+# El token es la hora del servidor en milisegundos. Se consulta con un
+# margen hacia atrás (escrituras en curso, relojes de otros workers): un
+# mismo cambio puede llegar dos veces y el cliente lo aplica por _id (el
+# uuid_accion puede repetirse en acciones importadas desde Excel).
+# Las marcas de eliminación expiran por TTL; un token más antiguo que la
+# retención, inválido o con demasiados cambios responde "completo": el
+# cliente recarga todo y sigue con el token nuevo.
+#
+#   CAMBIOS_RETENCION_HORAS  vida de las marcas de eliminación (72)
+#   CAMBIOS_LIMITE           máximo de documentos por respuesta (2000)
+
+RETENCION = timedelta(hours=float(os.getenv("CAMBIOS_RETENCION_HORAS", "72")))
+LIMITE = int(os.getenv("CAMBIOS_LIMITE", "2000"))
+MARGEN = timedelta(seconds=5)
+
+
+def token_de(fecha: datetime) -> str:
+    return str(int(fecha.timestamp() * 1000))
+
+
+def fecha_de_token(token: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromtimestamp(int(token) / 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+async def registrar_eliminados(bd, coleccion: str, docs: Iterable[dict]):
+    """Deja una marca por cada documento que desaparece de su PME."""
+    ahora = datetime.now()
+    marcas = [
+        {"id_pme": d["id_pme"], "coleccion": coleccion, "id": str(d["_id"]), "fecha_actualizacion": ahora}
+        for d in docs if d.get("id_pme")
+    ]
+    if marcas:
+        await bd.eliminados.insert_many(marcas, ordered=False)
+
+
+async def cambios_desde(bd, id_pme: str, since: Optional[str] = None) -> dict:
+    ahora = datetime.now()
+    token = token_de(ahora)
+    desde = fecha_de_token(since)
+    if desde is None or desde < ahora - RETENCION:
+        return {"completo": True, "token": token}
+
+    por_fecha = {"fecha_actualizacion": {"$gte": desde - MARGEN}}
+    filtro = {"id_pme": id_pme, **por_fecha}
+    # Contar antes de traer: una importación grande se resuelve mejor con una carga completa
+    for col in (bd.acciones, bd.recursos):
+        if await col.count_documents(filtro, limit=LIMITE + 1) > LIMITE:
+            return {"completo": True, "token": token}
+
+    acciones = await bd.acciones.find(filtro).to_list()
+    # Misma forma que /recursos/pme/{id}/detalle (accion y huerfano). En una
+    # instantánea lo heredado no cambia sin materializarse: basta con lo propio
+    pipeline = detalle.pipeline_detalle(id_pme, filtro=por_fecha, info=await instantaneas.cadena(bd, id_pme), solo_propios=True)
+    recursos = await (await bd.recursos.aggregate(pipeline)).to_list()
+
+    eliminados = {"acciones": [], "recursos": []}
+    async for marca in bd.eliminados.find(filtro, {"_id": 0, "coleccion": 1, "id": 1}):
+        eliminados.setdefault(marca["coleccion"], []).append(marca["id"])
+
+    return {"completo": False, "token": token, "acciones": acciones, "recursos": recursos, "eliminados": eliminados}
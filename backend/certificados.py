@@ -0,0 +1,376 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import urllib.request
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from string import Template
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Tuple
+
+# fpdf2 y Pillow solo se usan en los procesos del pool: se importan ahí
+# para no alargar el arranque de cada worker de la API
+if TYPE_CHECKING:
+    from PIL import Image
+
+# ==========================================
+# CERTIFICADOS PDF EN LOTE (SERVIDOR)
+# ==========================================
+# Misma información que el modal del frontend (mostrarModalCertificado):
+# datos del colegio y su logo (`imagen`), año, dimensión/subdimensión,
+# acción padre, actividad, insumos, monto y firma del director del PME.
+#
+# Los recursos se reparten en bloques de TAMANO_BLOQUE y cada bloque se
+# renderiza en un ProcessPoolExecutor (fpdf2 es CPU puro). Cada proceso
+# guarda en caché la plantilla compilada por configuración de campos y el
+# logo decodificado por hash, así un lote de cientos de certificados del
+# mismo colegio decodifica el logo una sola vez por proceso. Los PDF se
+# agregan a un ZIP que se envía por bloques a medida que se terminan.
+#
+#   CERTIFICADOS_PROCESOS   procesos del pool por worker (2)
+
+TAMANO_BLOQUE = 25
+PROCESOS = int(os.getenv("CERTIFICADOS_PROCESOS", "2"))
+TIMEOUT_LOGO = 5
+
+log = logging.getLogger("pme.certificados")
+
+# Campos visibles por defecto (AppState.config.certFields en script.js)
+CAMPOS_DEFECTO = {
+    "colegio": True, "anno": True, "dimension": True, "subdimension": True,
+    "nombre_accion": True, "desc_accion": True, "nombre_actividad": True,
+    "desc_actividad": True, "recursos": True, "monto": True, "firma": True,
+}
+
+# Filas del cuerpo: (campo de configuración, etiqueta, plantilla del valor)
+PLANTILLA_CUERPO = [
+    ("dimension", "Dimensión", "$dimension"),
+    ("subdimension", "Subdimensión", "$subdimension"),
+    None,
+    ("nombre_accion", "Nombre Acción", "$nombre_accion"),
+    ("desc_accion", "Desc. Acción", "$desc_accion"),
+    None,
+    ("nombre_actividad", "Actividad", "$nombre_actividad"),
+    ("desc_actividad", "Desc. Actividad", "$desc_actividad"),
+    ("recursos", "Insumos/Recursos", "$recursos"),
+    ("monto", "Monto Valorizado", "$monto"),
+]
+PLANTILLA_ENCABEZADO = ["$direccion", "$telefono", "RBD: $rbd | RUT: $rut"]
+PLANTILLA_PIE = "$direccion$fono"
+
+# Core fonts de PDF: latin-1. Se traducen los caracteres tipográficos más comunes.
+_REEMPLAZOS = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'", "–": "-", "—": "-", "…": "...", "•": "-", " ": " "})
+
+
+def _texto(valor) -> str:
+    if valor is None:
+        return ""
+    return str(valor).translate(_REEMPLAZOS).encode("latin-1", "replace").decode("latin-1")
+
+
+def _monto(valor) -> str:
+    # Formato es-CL: separador de miles con punto
+    return "$" + f"{int(valor or 0):,}".replace(",", ".")
+
+
+# --- Datos (proceso principal) ---
+
+def valores_certificado(recurso: dict, contexto: dict) -> dict:
+    """Mismos textos y valores por defecto que el modal del frontend."""
+    accion = recurso.get("accion")
+    colegio = contexto["colegio"]
+    # La subdimensión del recurso tiene prioridad sobre las de la acción
+    if str(recurso.get("subdimension") or "").strip():
+        subdimension = recurso["subdimension"]
+    elif accion and accion.get("subdimensiones"):
+        subdimension = ", ".join(accion["subdimensiones"])
+    else:
+        subdimension = "General"
+    insumos = recurso.get("recursos_actividad") or []
+    return {
+        "id": str(recurso["_id"]),
+        "year": recurso.get("year") or contexto.get("year"),
+        "dimension": accion.get("dimension") if accion else (recurso.get("dimension") or "S/D"),
+        "subdimension": subdimension,
+        "nombre_accion": accion.get("nombre_accion") if accion else "Sin Acción Asociada",
+        "desc_accion": accion.get("descripcion") if accion else "---",
+        "nombre_actividad": recurso.get("nombre_actividad") or "",
+        "desc_actividad": recurso.get("descripcion_actividad") or "Sin detalle.",
+        "recursos": ", ".join(insumos) if insumos else "No requiere insumos específicos.",
+        "monto": _monto(recurso.get("monto")),
+        "director": contexto.get("director") or colegio.get("director") or "Director(a)",
+    }
+
+
+def nombre_archivo(valores: dict) -> str:
+    base = re.sub(r"\s+", "_", valores["nombre_actividad"][:15]) or "Certificado"
+    base = re.sub(r"[^\w\-]", "", base)
+    return f"Certificado_{base}_{valores['id']}.pdf"
+
+
+# Logos descargados por URL; solo se guardan las descargas exitosas, así
+# una falla pasajera no deja al colegio sin logo hasta reiniciar
+_DESCARGADOS: Dict[str, bytes] = {}
+MAX_DESCARGADOS = 64
+
+
+def _descargar_logo(url: str) -> Optional[bytes]:
+    if url in _DESCARGADOS:
+        return _DESCARGADOS[url]
+    try:
+        with urllib.request.urlopen(url, timeout=TIMEOUT_LOGO) as r:
+            datos = r.read()
+    except Exception as e:
+        log.warning("No se pudo descargar el logo", extra={"url": url[:60], "error": str(e)})
+        return None
+    if len(_DESCARGADOS) >= MAX_DESCARGADOS:
+        _DESCARGADOS.pop(next(iter(_DESCARGADOS)), None)
+    _DESCARGADOS[url] = datos
+    return datos
+
+
+def obtener_logo(imagen: Optional[str]) -> Optional[bytes]:
+    """`imagen` del colegio: data URL en base64 o URL http(s). Sin logo si no se puede leer."""
+    if not imagen or not imagen.strip():
+        return None
+    imagen = imagen.strip()
+    if imagen.startswith("data:"):
+        try:
+            return base64.b64decode(imagen.split(",", 1)[1])
+        except Exception:
+            return None
+    if imagen.startswith(("http://", "https://")):
+        return _descargar_logo(imagen)
+    return None
+
+
+# --- Render (procesos del pool) ---
+
+@lru_cache(maxsize=32)
+def _plantilla(campos: Tuple[Tuple[str, bool], ...]):
+    """Filas visibles del cuerpo ya compiladas, por configuración de campos."""
+    visibles = dict(campos)
+    filas = []
+    for fila in PLANTILLA_CUERPO:
+        if fila is None:
+            if filas and filas[-1] is not None:
+                filas.append(None)
+            continue
+        campo, etiqueta, valor = fila
+        if visibles.get(campo, True):
+            filas.append((etiqueta, Template(valor)))
+    return {
+        "cuerpo": filas,
+        "encabezado": [Template(t) for t in PLANTILLA_ENCABEZADO],
+        "pie": Template(PLANTILLA_PIE),
+        "firma": visibles.get("firma", True),
+        "colegio": visibles.get("colegio", True),
+        "anno": visibles.get("anno", True),
+    }
+
+
+_LOGOS: Dict[str, Optional["Image.Image"]] = {}
+MAX_LOGOS = 16
+
+
+def _logo_decodificado(digest: str, datos: bytes) -> Optional["Image.Image"]:
+    """Logo decodificado una vez por proceso (clave: sha1 de los bytes)."""
+    from PIL import Image
+
+    if digest not in _LOGOS:
+        if len(_LOGOS) >= MAX_LOGOS:
+            _LOGOS.pop(next(iter(_LOGOS)))
+        try:
+            img = Image.open(io.BytesIO(datos))
+            img.load()
+            _LOGOS[digest] = img.convert("RGBA") if img.mode not in ("RGB", "RGBA", "L") else img
+        except Exception:
+            _LOGOS[digest] = None
+    return _LOGOS[digest]
+
+
+def _render(valores: dict, colegio: dict, plantilla: dict, logo: Optional["Image.Image"], ciudad: str) -> bytes:
+    from fpdf import FPDF
+
+    pdf = FPDF(unit="mm", format="letter")
+    pdf.set_auto_page_break(True, margin=20)
+    pdf.set_margins(20, 15, 20)
+    pdf.add_page()
+    ancho = pdf.w - pdf.l_margin - pdf.r_margin
+
+    # Encabezado: logo a la izquierda, datos del colegio a la derecha
+    if logo is not None:
+        pdf.image(logo, x=pdf.l_margin, y=15, h=22)
+    pdf.set_xy(pdf.l_margin, 15)
+    if plantilla["colegio"]:
+        pdf.set_font("Helvetica", "B", 12)
+        pdf.cell(ancho, 6, _texto(colegio.get("nombre")), align="R", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font("Helvetica", "", 8)
+        datos_colegio = {k: colegio.get(k) or "" for k in ("direccion", "telefono")}
+        datos_colegio.update(rbd=colegio.get("rbd") or "---", rut=colegio.get("rut") or "---")
+        for t in plantilla["encabezado"]:
+            pdf.cell(ancho, 4, _texto(t.safe_substitute(datos_colegio)), align="R", new_x="LMARGIN", new_y="NEXT")
+    if plantilla["anno"]:
+        pdf.set_font("Helvetica", "B", 16)
+        pdf.cell(ancho, 9, _texto(f"PME AÑO {valores['year']}"), align="R", new_x="LMARGIN", new_y="NEXT")
+
+    pdf.set_y(max(pdf.get_y(), 40) + 2)
+    pdf.set_draw_color(30, 64, 175)
+    pdf.set_line_width(0.6)
+    pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + ancho, pdf.get_y())
+    pdf.ln(6)
+    pdf.set_font("Helvetica", "B", 15)
+    pdf.cell(ancho, 10, _texto("Certificado de Acción SEP").upper(), align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(4)
+
+    # Cuerpo: tabla etiqueta : valor
+    ancho_etiqueta = 42
+    for fila in plantilla["cuerpo"]:
+        if fila is None:
+            pdf.ln(3)
+            continue
+        etiqueta, valor = fila
+        y = pdf.get_y()
+        pdf.set_font("Helvetica", "B", 10)
+        pdf.multi_cell(ancho_etiqueta, 6, _texto(etiqueta), new_x="RIGHT", new_y="TOP")
+        pdf.cell(4, 6, ":")
+        pdf.set_font("Helvetica", "", 10)
+        pdf.multi_cell(ancho - ancho_etiqueta - 4, 6, _texto(valor.safe_substitute(valores)), new_x="LMARGIN", new_y="NEXT")
+        pdf.set_y(max(pdf.get_y(), y + 6) + 1)
+
+    # Pie: ciudad y firma
+    if plantilla["firma"]:
+        pdf.set_y(max(pdf.get_y() + 15, pdf.h - 75))
+        y = pdf.get_y()
+        pdf.set_font("Helvetica", "", 10)
+        pdf.cell(ancho / 2, 6, _texto(ciudad))
+        x_firma = pdf.l_margin + ancho / 2
+        if logo is not None:
+            pdf.image(logo, x=x_firma, y=y - 4, h=16)
+        pdf.set_xy(x_firma + 20, y)
+        pdf.set_font("Helvetica", "B", 10)
+        pdf.cell(ancho / 2 - 20, 5, _texto(valores["director"]), align="C", new_x="LEFT", new_y="NEXT")
+        pdf.set_font("Helvetica", "", 9)
+        pdf.cell(ancho / 2 - 20, 5, "Director", align="C", new_x="LEFT", new_y="NEXT")
+        pdf.cell(ancho / 2 - 20, 5, _texto(colegio.get("nombre")), align="C", new_x="LMARGIN", new_y="NEXT")
+
+    # Pie fijo al final de la página: sin salto automático
+    pdf.set_auto_page_break(False)
+    pdf.set_y(pdf.h - 30)
+    pdf.set_draw_color(209, 213, 219)
+    pdf.set_line_width(0.2)
+    pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + ancho, pdf.get_y())
+    pdf.ln(2)
+    pdf.set_font("Helvetica", "B", 8)
+    pdf.cell(ancho, 4, _texto(colegio.get("nombre")), align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 7)
+    fono = f" - Fono: {colegio['telefono']}" if colegio.get("telefono") else ""
+    pdf.cell(ancho, 4, _texto(plantilla["pie"].safe_substitute(direccion=colegio.get("direccion") or "", fono=fono)),
+             align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 6)
+    pdf.cell(ancho, 4, _texto(valores["id"]), align="C")
+    return bytes(pdf.output())
+
+
+def renderizar_bloque(contexto: dict, lote: List[dict]) -> List[Tuple[str, bytes]]:
+    """Se ejecuta en un proceso del pool: devuelve [(nombre de archivo, pdf)]."""
+    plantilla = _plantilla(tuple(sorted(contexto["campos"].items())))
+    logo = None
+    if contexto.get("logo"):
+        logo = _logo_decodificado(contexto["logo_hash"], contexto["logo"])
+    return [(nombre_archivo(v), _render(v, contexto["colegio"], plantilla, logo, contexto["ciudad"])) for v in lote]
+
+
+# --- Pool y ZIP (proceso principal) ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: el proceso del servidor tiene hilos (driver, event loop) que fork no copia bien
+        _pool = ProcessPoolExecutor(max_workers=PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class _SalidaZip(io.RawIOBase):
+    """Destino no buscable: zipfile escribe con descriptores y se vacía por bloques."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.buffer += datos
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = bytes(self.buffer)
+        self.buffer.clear()
+        return datos
+
+
+def preparar_contexto(colegio: dict, pme: dict, campos: Optional[Dict[str, bool]], ciudad: str) -> dict:
+    logo = obtener_logo(colegio.get("imagen"))
+    return {
+        "colegio": {k: colegio.get(k) for k in ("nombre", "rbd", "rut", "direccion", "telefono", "director")},
+        "year": pme.get("year"),
+        "director": pme.get("director"),
+        "campos": {**CAMPOS_DEFECTO, **(campos or {})},
+        "ciudad": ciudad,
+        "logo": logo,
+        "logo_hash": hashlib.sha1(logo).hexdigest() if logo else None,
+    }
+
+
+async def zip_certificados(contexto: dict, recursos: AsyncIterator[dict], avance=None) -> AsyncIterator[bytes]:
+    """Renderiza en el pool por bloques y emite el ZIP a medida que avanza."""
+    loop = asyncio.get_running_loop()
+    salida = _SalidaZip()
+    # Los PDF ya vienen comprimidos: ZIP_STORED evita recomprimir
+    zf = zipfile.ZipFile(salida, mode="w", compression=zipfile.ZIP_STORED)
+    pendientes = []
+    procesados = 0
+
+    async def escribir(futuro):
+        nonlocal procesados
+        for nombre, pdf in await futuro:
+            zf.writestr(nombre, pdf)
+            procesados += 1
+        if avance:
+            await avance(procesados)
+
+    lote = []
+    async for rec in recursos:
+        lote.append(valores_certificado(rec, contexto))
+        if len(lote) >= TAMANO_BLOQUE:
+            pendientes.append(loop.run_in_executor(pool(), renderizar_bloque, contexto, lote))
+            lote = []
+            # Como máximo dos bloques en cola por proceso: memoria acotada
+            while len(pendientes) > 2 * PROCESOS:
+                await escribir(pendientes.pop(0))
+                yield salida.vaciar()
+    if lote:
+        pendientes.append(loop.run_in_executor(pool(), renderizar_bloque, contexto, lote))
+    for futuro in pendientes:
+        await escribir(futuro)
+        yield salida.vaciar()
+    if avance:
+        await avance(procesados, procesados, forzar=True)
+    zf.close()
+    yield salida.vaciar()
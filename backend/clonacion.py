@@ -0,0 +1,161 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+
+import identificadores
+import instantaneas
+
+# ==========================================
+# MOTOR DE CLONACIÓN DE PME
+# ==========================================
+# Copia las acciones y recursos de un PME a otro en pocas idas a la BD:
+# una lectura de acciones, una lectura de recursos ($in) y escrituras
+# en lotes con insert_many. Si el cluster soporta transacciones (Atlas),
+# todo se escribe en una sola transacción; si no, se compensa borrando
+# lo copiado cuando algo falla a mitad de camino.
+#
+# El origen puede ser una instantánea (ver instantaneas.py): se copia su
+# vista. Las copias no arrastran `origen`: son documentos nuevos.
+#
+# Clonar en un PME existente exige que su vista no tenga acciones: repetir
+# la clonación duplicaría todo. Mientras se copia, el PME destino queda
+# marcado en `clonando` para que una segunda solicitud simultánea (doble
+# clic, reintento del cliente) no pase la misma verificación; la marca
+# vence a los RESERVA_SEGUNDOS por si el proceso se cae a mitad de camino.
+
+TAMANO_LOTE = 1000
+RESERVA_SEGUNDOS = 600
+_NO_COPIAR = {"_id", "origen", "heredado"}
+
+log = logging.getLogger("pme.clonacion")
+
+
+class DestinoConDatos(ValueError):
+    """El PME destino ya tiene acciones o se está clonando: copiar de nuevo las duplicaría."""
+
+
+async def soporta_transacciones(client) -> bool:
+    """Las transacciones requieren replica set o cluster sharded."""
+    try:
+        hello = await client.admin.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+async def ejecutar_en_transaccion(client, operacion):
+    """Ejecuta `await operacion(session)` dentro de una transacción si es posible.
+
+    Sin soporte de transacciones se llama con session=None.
+    """
+    if not await soporta_transacciones(client):
+        return await operacion(None)
+    async with client.start_session() as session:
+        return await session.with_transaction(operacion)
+
+
+async def insertar_en_lotes(col, docs, session=None, tamano=TAMANO_LOTE):
+    for i in range(0, len(docs), tamano):
+        await col.insert_many(docs[i:i + tamano], ordered=False, session=session)
+
+
+class ClonadorPME:
+    def __init__(self, bd):
+        self.bd = bd
+
+    async def preparar(self, id_origen: str, id_destino: str, year_destino: int):
+        """Lee el PME origen y arma en memoria los documentos a insertar."""
+        info = await instantaneas.cadena(self.bd, id_origen)
+        acciones = await (await instantaneas.vista(self.bd, "acciones", id_origen, info=info)).to_list()
+        ahora = datetime.now()  # las copias son cambios nuevos para /cambios del destino
+
+        # Un mismo uuid puede repetirse en acciones importadas desde Excel:
+        # cada copia de la acción recibe su propio uuid y sus propios recursos.
+        mapa_uuid = {}
+        nuevas_acciones = []
+        for acc in acciones:
+            uuid_new = str(uuid.uuid4())
+            mapa_uuid.setdefault(acc["uuid_accion"], []).append(uuid_new)
+
+            nueva = {k: v for k, v in acc.items() if k not in _NO_COPIAR}
+            nueva.update({"_id": ObjectId(), "id_pme": id_destino, "year": year_destino, "uuid_accion": uuid_new, "fecha_actualizacion": ahora})
+            nuevas_acciones.append(nueva)
+
+        nuevos_recursos = []
+        if mapa_uuid:
+            recursos = await instantaneas.vista(self.bd, "recursos", id_origen,
+                                                {"uuid_accion": {"$in": list(mapa_uuid)}}, info=info)
+            async for rec in recursos:
+                for uuid_new in mapa_uuid[rec["uuid_accion"]]:
+                    nuevo = {k: v for k, v in rec.items() if k not in _NO_COPIAR}
+                    nuevo.update({"_id": ObjectId(), "id_pme": id_destino, "year": year_destino, "uuid_accion": uuid_new,
+                                  "fecha_actualizacion": ahora})
+                    nuevos_recursos.append(nuevo)
+
+        return nuevas_acciones, nuevos_recursos
+
+    async def verificar_destino(self, id_destino: str):
+        """DestinoConDatos si el PME destino ya ve acciones (propias o heredadas)."""
+        if await instantaneas.contar(self.bd, "acciones", id_destino):
+            raise DestinoConDatos("El PME destino ya tiene acciones")
+
+    async def _reservar(self, id_destino: str):
+        ahora = datetime.now()
+        libre = {"$or": [{"clonando": {"$exists": False}},
+                         {"clonando": {"$lt": ahora - timedelta(seconds=RESERVA_SEGUNDOS)}}]}
+        res = await self.bd.pme.update_one({**identificadores.filtro_id(id_destino), **libre},
+                                           {"$set": {"clonando": ahora}})
+        if not res.modified_count:
+            raise DestinoConDatos("Ya hay una clonación en curso hacia el PME destino")
+
+    async def clonar(self, id_origen: str, id_destino: str, year_destino: int, nuevo_pme: Optional[dict] = None):
+        """Clona acciones y recursos de `id_origen` en `id_destino`.
+
+        Si se entrega `nuevo_pme`, el documento del PME destino se inserta
+        en la misma transacción que sus acciones y recursos. Si no, el PME
+        destino ya existe y debe estar vacío (DestinoConDatos).
+        """
+        if nuevo_pme is not None:
+            return await self._copiar(id_origen, id_destino, year_destino, nuevo_pme)
+        await self._reservar(id_destino)
+        try:
+            await self.verificar_destino(id_destino)
+            return await self._copiar(id_origen, id_destino, year_destino, None)
+        finally:
+            await self.bd.pme.update_one(identificadores.filtro_id(id_destino), {"$unset": {"clonando": ""}})
+
+    async def _copiar(self, id_origen: str, id_destino: str, year_destino: int, nuevo_pme: Optional[dict]):
+        acciones, recursos = await self.preparar(id_origen, id_destino, year_destino)
+        # Un destino que ya es base de otros años no les agrega estas copias
+        await instantaneas.congelar(self.bd, "acciones", acciones)
+        await instantaneas.congelar(self.bd, "recursos", recursos)
+
+        async def escribir(session):
+            # Con reintentos de transacción los dicts ya traen _id; se reutiliza.
+            if nuevo_pme is not None:
+                await self.bd.pme.insert_one(nuevo_pme, session=session)
+            await insertar_en_lotes(self.bd.acciones, acciones, session)
+            await insertar_en_lotes(self.bd.recursos, recursos, session)
+
+        try:
+            await ejecutar_en_transaccion(self.bd.client, escribir)
+        except Exception:
+            await self._compensar(id_destino, acciones, nuevo_pme)
+            raise
+
+        return {"acciones": len(acciones), "recursos": len(recursos)}
+
+    async def _compensar(self, id_destino: str, acciones: list, nuevo_pme: Optional[dict]):
+        # Solo hace falta sin transacción, pero es inofensivo si ya se abortó.
+        uuids = [a["uuid_accion"] for a in acciones]
+        try:
+            if uuids:
+                await self.bd.recursos.delete_many({"id_pme": id_destino, "uuid_accion": {"$in": uuids}})
+                await self.bd.acciones.delete_many({"id_pme": id_destino, "uuid_accion": {"$in": uuids}})
+            if nuevo_pme is not None and "_id" in nuevo_pme:
+                await self.bd.pme.delete_one({"_id": nuevo_pme["_id"]})
+        except Exception:
+            log.exception("No se pudo revertir la clonación", extra={"id_pme": id_destino})
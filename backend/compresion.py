@@ -0,0 +1,52 @@
+import os
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+
+# ==========================================
+# COMPRESIÓN GZIP DE RESPUESTAS DE LA API
+# ==========================================
+# Los listados (acciones, recursos, detalle) devuelven cientos de KB de
+# JSON muy repetitivo: con gzip viajan ~10 veces más chicos, que en las
+# redes de los colegios pesa más que el tiempo de servidor. Se comprimen
+# solo los tipos de texto (JSON, CSV) sobre GZIP_MIN_BYTES: XLSX, ZIP y
+# PDF ya vienen comprimidos y recomprimirlos gasta CPU sin ganar bytes.
+# Las respuestas por partes (exportaciones CSV) se comprimen al vuelo.
+#
+# Con nginx delante (/api/) la respuesta ya llega comprimida y nginx la
+# pasa tal cual; ver frontend/nginx.conf.
+#
+#   GZIP_MIN_BYTES   tamaño mínimo a comprimir (1024)
+#   GZIP_NIVEL       nivel de zlib, 1-9 (5: casi la razón de 9 a una fracción del costo)
+
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_NIVEL = int(os.getenv("GZIP_NIVEL", "5"))
+
+COMPRIMIBLES = ("application/json", "text/")
+
+
+class _RespuestaGzip(GZipResponder):
+    async def send_with_compression(self, message):
+        if message["type"] == "http.response.start":
+            await super().send_with_compression(message)
+            tipo = Headers(raw=message["headers"]).get("content-type", "")
+            # Mismo camino que text/event-stream en Starlette: se envía sin tocar
+            self.content_type_is_excluded = self.content_type_is_excluded or not tipo.startswith(COMPRIMIBLES)
+            return
+        await super().send_with_compression(message)
+
+
+class MiddlewareGzip(GZipMiddleware):
+    """GZipMiddleware de Starlette limitado a respuestas de texto."""
+
+    def __init__(self, app, minimum_size: int = GZIP_MIN_BYTES, compresslevel: int = GZIP_NIVEL):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if "gzip" in Headers(scope=scope).get("accept-encoding", ""):
+            responder = _RespuestaGzip(self.app, self.minimum_size, compresslevel=self.compresslevel)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
@@ -0,0 +1,122 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient
+import certifi
+from typing import Optional
+
+# ==========================================
+# CAPA DE ACCESO A DATOS (DRIVER ASYNC)
+# ==========================================
+# Los endpoints usan el cliente async de PyMongo (AsyncMongoClient): cada
+# consulta cede el event loop mientras espera a Mongo, así la cantidad de
+# requests concurrentes la limita el pool de conexiones y no el threadpool
+# de Starlette (40 hilos). El pool se configura por variables de entorno:
+#
+#   MONGO_MAX_POOL_SIZE            conexiones máximas por proceso (100)
+#   MONGO_MIN_POOL_SIZE            conexiones que se mantienen abiertas (0)
+#   MONGO_MAX_IDLE_MS              cierre de conexiones ociosas (sin límite)
+#   MONGO_WAIT_QUEUE_TIMEOUT_MS    espera máxima por una conexión libre (sin límite)
+#   MONGO_SERVER_SELECTION_TIMEOUT_MS  espera para encontrar servidor (5000)
+#   MONGO_CONNECT_TIMEOUT_MS       timeout al abrir conexión (10000)
+#   MONGO_SOCKET_TIMEOUT_MS        timeout de cada operación (sin límite)
+#   MONGO_READ_PREFERENCE          primary, primaryPreferred, secondaryPreferred...
+#   MONGO_POOL_CALENTAR            conexiones que se abren al iniciar cada worker (4)
+#
+# El cliente se crea en el lifespan de cada worker (nunca al importar):
+# un AsyncMongoClient no sobrevive a un fork.
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+DB_NAME = os.getenv("DB_NAME", "pme_colegios2")
+
+
+def _entero_env(nombre: str, defecto=None):
+    valor = os.getenv(nombre)
+    return int(valor) if valor not in (None, "") else defecto
+
+
+def opciones_cliente() -> dict:
+    opciones = {
+        "maxPoolSize": _entero_env("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _entero_env("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": _entero_env("MONGO_MAX_IDLE_MS"),
+        "waitQueueTimeoutMS": _entero_env("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _entero_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "connectTimeoutMS": _entero_env("MONGO_CONNECT_TIMEOUT_MS", 10000),
+        "socketTimeoutMS": _entero_env("MONGO_SOCKET_TIMEOUT_MS"),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+    }
+    # LOGICA: Si es localhost, conectar directo. Si es nube (Atlas), usar certificados.
+    if not ("localhost" in MONGO_URI or "127.0.0.1" in MONGO_URI):
+        opciones["tlsCAFile"] = certifi.where()
+    return {k: v for k, v in opciones.items() if v is not None}
+
+
+class BaseDatos:
+    """Cliente async y colecciones de la app.
+
+    Los servicios (clonador, resumen, importadores) reciben esta instancia
+    y leen las colecciones al momento de usarlas.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.db = None
+
+    @property
+    def conectada(self) -> bool:
+        return self.client is not None
+
+    def conectar(self, uri: str = MONGO_URI, db_name: str = DB_NAME, event_listeners=None):
+        # El cliente no abre conexiones hasta la primera operación.
+        # `event_listeners`: p.ej. la escucha de comandos de observabilidad.py
+        self.client = AsyncMongoClient(uri, event_listeners=event_listeners or [], **opciones_cliente())
+        self.db = self.client[db_name]
+
+    async def cerrar(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            self.db = None
+
+    async def ping(self, timeout: Optional[float] = None):
+        if timeout is None:
+            await self.client.admin.command("ping")
+        else:
+            await asyncio.wait_for(self.client.admin.command("ping"), timeout)
+
+    async def calentar(self, conexiones: int = _entero_env("MONGO_POOL_CALENTAR", 4)):
+        """Abre `conexiones` conexiones del pool con pings concurrentes.
+
+        Así los primeros requests no pagan el handshake (TLS + auth en Atlas).
+        """
+        await asyncio.gather(*(self.ping() for _ in range(max(conexiones, 1))))
+
+    @property
+    def colegios(self): return self.db["colegios"]
+
+    @property
+    def pme(self): return self.db["pme"]
+
+    @property
+    def acciones(self): return self.db["acciones"]
+
+    @property
+    def recursos(self): return self.db["recursos"]
+
+    @property
+    def users(self): return self.db["users"]
+
+    @property
+    def resumen(self): return self.db["pme_resumen"]
+
+    @property
+    def eliminados(self): return self.db["eliminados"]
+
+    @property
+    def rollups(self): return self.db["rollups"]
+
+    @property
+    def cache_versiones(self): return self.db["cache_versiones"]
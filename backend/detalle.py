@@ -0,0 +1,75 @@
+from typing import List, Optional
+
+import instantaneas
+
+# ==========================================
+# DETALLE DE RECURSOS CON SU ACCIÓN PADRE ($lookup)
+# ==========================================
+# Una sola agregación devuelve los recursos de un PME ya unidos con los
+# campos de su acción padre, en vez de buscar la acción de cada recurso
+# en el navegador (tabla global) o armar un mapa en Python (exportación).
+# El $lookup usa el índice uuid_accion de acciones; el padre se restringe
+# al mismo PME (un uuid importado desde Excel puede repetirse entre PMEs).
+#
+# Cada documento trae:
+#   accion:   {nombre_accion, descripcion, dimension} o null
+#   huerfano: true si no existe la acción padre en el PME
+#
+# En una instantánea (ver instantaneas.py) los recursos salen de la vista
+# del PME y el padre se busca en toda la cadena: la versión más cercana
+# que no esté oculta.
+
+CAMPOS_PADRE = ["nombre_accion", "descripcion", "dimension"]
+
+
+def _buscar_padre(id_pme: str, info: Optional[dict]) -> list:
+    if info is None:
+        return [{"$match": {"id_pme": id_pme}}]
+    return [
+        {"$match": {"id_pme": {"$in": info["cadena"]}, **instantaneas.no_ocultos(info, "acciones")}},
+        {"$set": {"_prioridad": {"$indexOfArray": [info["cadena"], "$id_pme"]}}},
+        {"$sort": {"_prioridad": 1}},
+    ]
+
+
+def pipeline_detalle(id_pme: str, proy_recurso: Optional[dict] = None, campos_padre: Optional[List[str]] = None,
+                     huerfanos: Optional[bool] = None, filtro: Optional[dict] = None, info: Optional[dict] = None,
+                     solo_propios: bool = False) -> list:
+    """`info`: instantánea del PME (instantaneas.cadena); `solo_propios` deja fuera los recursos heredados."""
+    campos_padre = CAMPOS_PADRE if campos_padre is None else campos_padre
+    if info is not None and not solo_propios:
+        pipeline = instantaneas.etapas(info, "recursos", filtro)
+    else:
+        pipeline = [
+            {"$match": {"id_pme": id_pme, **(filtro or {})}},
+            {"$sort": {"_id": 1}},
+        ]
+    if proy_recurso:
+        pipeline.append({"$project": {**proy_recurso, "uuid_accion": 1}})
+    pipeline += [
+        {"$lookup": {
+            "from": "acciones",
+            "localField": "uuid_accion",
+            "foreignField": "uuid_accion",
+            "pipeline": _buscar_padre(id_pme, info) + [
+                {"$limit": 1},
+                # Sin campos pedidos basta saber si existe (para `huerfano`)
+                {"$project": {"_id": 0, **{c: 1 for c in campos_padre}} if campos_padre else {"_id": 1}},
+            ],
+            "as": "accion",
+        }},
+        {"$set": {
+            "accion": {"$first": "$accion"},
+            "huerfano": {"$eq": [{"$size": "$accion"}, 0]},
+        }},
+    ]
+    if huerfanos is not None:
+        pipeline.append({"$match": {"huerfano": huerfanos}})
+    return pipeline
+
+
+async def detalle_recursos(bd, id_pme: str, proy_recurso: Optional[dict] = None,
+                           campos_padre: Optional[List[str]] = None, huerfanos: Optional[bool] = None):
+    """Cursor async con los recursos del PME unidos a su acción padre."""
+    info = await instantaneas.cadena(bd, id_pme)
+    return await bd.recursos.aggregate(pipeline_detalle(id_pme, proy_recurso, campos_padre, huerfanos, info=info))
@@ -0,0 +1,236 @@
+import csv
+import io
+import re
+import tempfile
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from starlette.concurrency import run_in_threadpool
+
+# ==========================================
+# EXPORTACIÓN EN STREAMING (XLSX / CSV)
+# ==========================================
+# Las filas salen del cursor de Mongo (ya proyectado a las columnas
+# pedidas) directo al escritor, sin listas intermedias ni DataFrames:
+#  - CSV: se envía por bloques a medida que se leen las filas.
+#  - XLSX: openpyxl en modo write-only escribe las filas a disco y el
+#    archivo resultante se envía por bloques. La memoria no depende de
+#    la cantidad de filas. El trabajo de openpyxl (CPU y disco) corre en
+#    el threadpool para no bloquear el event loop.
+
+TAMANO_BLOQUE = 64 * 1024
+FILAS_POR_BLOQUE = 500
+
+MEDIA_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MEDIA_CSV = "text/csv; charset=utf-8"
+
+# Columnas de la exportación de recursos, en el orden de la planilla
+COLUMNAS_RECURSOS = [
+    "nombre_actividad", "descripcion_actividad", "responsable", "medios_ver", "recursos_actividad",
+    "monto", "year", "uuid_accion", "nombre_accion", "descripcion_accion", "dimension",
+]
+# Columnas que vienen de la acción padre: columna -> campo en la colección acciones
+COLUMNAS_ACCION_PADRE = {"nombre_accion": "nombre_accion", "descripcion_accion": "descripcion", "dimension": "dimension"}
+
+VALORES_DEFECTO_RECURSO = {"monto": 0}
+
+
+def _celda(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, list):
+        return ", ".join(str(v) for v in valor)
+    if isinstance(valor, (ObjectId, dict)):
+        return str(valor)
+    if isinstance(valor, str):
+        # openpyxl rechaza caracteres de control (frecuentes en textos pegados)
+        return ILLEGAL_CHARACTERS_RE.sub("", valor)
+    return valor
+
+
+def elegir_columnas(pedidas: List[str], disponibles: List[str]) -> List[str]:
+    """Mismo criterio que antes: se ignoran las desconocidas; si no queda ninguna, van todas."""
+    return [c for c in pedidas if c in disponibles] or list(disponibles)
+
+
+def proyeccion_recursos(columnas: List[str]) -> dict:
+    campos = [c for c in columnas if c not in COLUMNAS_ACCION_PADRE]
+    # uuid_accion se necesita para unir con la acción padre
+    return {c: 1 for c in campos + ["uuid_accion"]}
+
+
+def campos_accion_padre(columnas: List[str]) -> List[str]:
+    return [COLUMNAS_ACCION_PADRE[c] for c in columnas if c in COLUMNAS_ACCION_PADRE]
+
+
+def proyeccion_acciones(columnas: List[str]) -> Optional[dict]:
+    campos = campos_accion_padre(columnas)
+    if not campos:
+        return None
+    return {c: 1 for c in campos + ["uuid_accion"]}
+
+
+def accion_unida(rec: dict) -> Optional[dict]:
+    """Acción padre que trae un documento de detalle.pipeline_detalle."""
+    return rec.get("accion")
+
+
+async def filas_recursos(recursos: AsyncIterable[dict], columnas: List[str], padre_de, huerfano: str = "") -> AsyncIterator[list]:
+    """Arma cada fila de recurso; `padre_de(recurso)` devuelve la acción padre o None."""
+    async for rec in recursos:
+        padre = padre_de(rec)
+        fila = []
+        for c in columnas:
+            if c in COLUMNAS_ACCION_PADRE:
+                if padre is None:
+                    fila.append(huerfano if c == "nombre_accion" else "")
+                else:
+                    fila.append(padre.get(COLUMNAS_ACCION_PADRE[c], ""))
+            else:
+                fila.append(rec.get(c, VALORES_DEFECTO_RECURSO.get(c, "")))
+        yield [_celda(v) for v in fila]
+
+
+async def filas_documentos(docs: AsyncIterable[dict], columnas: List[str]) -> AsyncIterator[list]:
+    async for d in docs:
+        yield [_celda(d.get(c)) for c in columnas]
+
+
+async def _encadenar(primero: dict, cursor) -> AsyncIterator[dict]:
+    yield primero
+    async for d in cursor:
+        yield d
+
+
+async def con_primero(cursor) -> Optional[AsyncIterator[dict]]:
+    """Devuelve un iterador equivalente al cursor, o None si no trae documentos."""
+    try:
+        primero = await cursor.next()
+    except StopAsyncIteration:
+        return None
+    return _encadenar(primero, cursor)
+
+
+def _agregar_filas(ws, filas: List[list]):
+    for fila in filas:
+        ws.append(fila)
+
+
+async def _stream_xlsx(encabezados: List[str], filas: AsyncIterable[list]) -> AsyncIterator[bytes]:
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(encabezados)
+    lote = []
+    async for fila in filas:
+        lote.append(fila)
+        if len(lote) >= FILAS_POR_BLOQUE:
+            await run_in_threadpool(_agregar_filas, ws, lote)
+            lote = []
+    if lote:
+        await run_in_threadpool(_agregar_filas, ws, lote)
+
+    with tempfile.TemporaryFile() as tmp:
+        await run_in_threadpool(wb.save, tmp)
+        tmp.seek(0)
+        while bloque := await run_in_threadpool(tmp.read, TAMANO_BLOQUE):
+            yield bloque
+
+
+async def _stream_csv(encabezados: List[str], filas: AsyncIterable[list]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    # BOM para que Excel abra el CSV en UTF-8 (tildes y ñ)
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+    writer.writerow(encabezados)
+    i = 0
+    async for fila in filas:
+        writer.writerow(fila)
+        i += 1
+        if i % FILAS_POR_BLOQUE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _stream(encabezados: List[str], filas: AsyncIterable[list], formato: str):
+    if formato == "csv":
+        return _stream_csv(encabezados, filas), MEDIA_CSV, "csv"
+    return _stream_xlsx(encabezados, filas), MEDIA_XLSX, "xlsx"
+
+
+def respuesta_exportacion(encabezados: List[str], filas: AsyncIterable[list], nombre_base: str, formato: str = "xlsx") -> StreamingResponse:
+    stream, media, ext = _stream(encabezados, filas, formato)
+    fname = f"{nombre_base}.{ext}"
+    return StreamingResponse(stream, media_type=media, headers={"Content-Disposition": f"attachment; filename={fname}"})
+
+
+# --- Libro con varias hojas (consolidado por colegio, ver rollups.py) ---
+
+# (título, encabezados, filas)
+Hoja = Tuple[str, List[str], List[list]]
+
+
+def titulo_hoja(nombre: Optional[str], usados: set) -> str:
+    """Título válido y único para una hoja: máximo 31 caracteres y sin []:*?/\\."""
+    base = re.sub(r"[\[\]:*?/\\]", " ", str(nombre or "Hoja")).strip()[:31] or "Hoja"
+    titulo, i = base, 2
+    while titulo.lower() in usados:
+        sufijo = f" ({i})"
+        titulo, i = base[:31 - len(sufijo)] + sufijo, i + 1
+    usados.add(titulo.lower())
+    return titulo
+
+
+def _escribir_hojas(hojas: List[Hoja], destino):
+    wb = Workbook(write_only=True)
+    for titulo, encabezados, filas in hojas:
+        ws = wb.create_sheet(title=titulo)
+        ws.append(encabezados)
+        _agregar_filas(ws, filas)
+    wb.save(destino)
+
+
+async def _stream_xlsx_hojas(hojas: List[Hoja]) -> AsyncIterator[bytes]:
+    with tempfile.TemporaryFile() as tmp:
+        await run_in_threadpool(_escribir_hojas, hojas, tmp)
+        tmp.seek(0)
+        while bloque := await run_in_threadpool(tmp.read, TAMANO_BLOQUE):
+            yield bloque
+
+
+def respuesta_xlsx_hojas(hojas: List[Hoja], nombre_base: str) -> StreamingResponse:
+    return StreamingResponse(_stream_xlsx_hojas(hojas), media_type=MEDIA_XLSX,
+                             headers={"Content-Disposition": f"attachment; filename={nombre_base}.xlsx"})
+
+
+async def guardar_bloques(bloques: AsyncIterable[bytes], ruta: str):
+    with open(ruta, "wb") as f:
+        async for bloque in bloques:
+            await run_in_threadpool(f.write, bloque)
+
+
+async def guardar_exportacion(encabezados: List[str], filas: AsyncIterable[list], ruta: str, formato: str = "xlsx") -> str:
+    """Escribe la exportación en `ruta` (trabajos en segundo plano). Devuelve la extensión."""
+    stream, _, ext = _stream(encabezados, filas, formato)
+    await guardar_bloques(stream, ruta)
+    return ext
+
+
+async def con_avance(filas: AsyncIterable[list], avance, total: Optional[int] = None) -> AsyncIterator[list]:
+    """Informa a `avance(procesados, total)` cada FILAS_POR_BLOQUE filas."""
+    n = 0
+    async for fila in filas:
+        yield fila
+        n += 1
+        if n % FILAS_POR_BLOQUE == 0:
+            await avance(n, total)
+    await avance(n, total, forzar=True)
+
+
+def fecha_archivo() -> str:
+    return datetime.now().strftime('%Y%m%d')
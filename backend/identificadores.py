@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne, UpdateMany
+
+import clonacion
+
+# ==========================================
+# IDENTIFICADORES: UN SOLO TIPO DE _id
+# ==========================================
+# create_colegio, create_pme y los importadores guardaban str(ObjectId())
+# y crear_accion / crear_recurso un ObjectId, así que cada búsqueda por id
+# probaba las dos formas. El tipo canónico es ObjectId: todo lo nuevo se
+# crea así y la migración reescribe lo antiguo.
+#
+# Mientras quede algún _id string, filtro_id() busca ambas formas en una
+# sola consulta ({"_id": {"$in": [str, ObjectId]}}). Cuando la migración
+# termina (marca "ids_canonicos" completa en la colección migraciones),
+# cada worker lo lee al arrancar y busca solo por ObjectId.
+#
+# La migración avanza por lotes: respalda el lote en "migracion_ids",
+# borra los originales, los inserta con su ObjectId y actualiza las
+# referencias por _id (origen de las copias de una instantánea y
+# pme.ocultos). Lo migrado deja de aparecer en la consulta, así que
+# reanudarla es volver a correrla; antes termina el lote que haya
+# quedado respaldado. El borrado exige la misma fecha_actualizacion que
+# se leyó: un documento editado mientras tanto se vuelve a leer y migrar
+# en el mismo lote. Con transacciones (replica set) cada lote es atómico;
+# sin ellas, un documento del lote no se encuentra durante unos ms.
+#
+#   IDS_TAMANO_LOTE   documentos por lote (500)
+#
+#   python identificadores.py migrar [coleccion]
+#   python identificadores.py estado
+
+log = logging.getLogger("pme.identificadores")
+
+COLECCIONES = ("colegios", "pme", "acciones", "recursos")
+# Colecciones cuyo _id se guarda como raíz de una instantánea (ver instantaneas.py)
+CON_RAICES = ("acciones", "recursos")
+TAMANO_LOTE = int(os.getenv("IDS_TAMANO_LOTE", "500"))
+REINTENTOS = 5
+MARCA = "ids_canonicos"
+# Documentos del lote en curso, para terminarlo si la migración se corta
+RESPALDO = "migracion_ids"
+
+# Solo los string con forma de ObjectId (24 hexadecimales) se migran
+_FILTRO_STRING = {"_id": {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}}
+
+# True cuando la migración terminó: ya no hay _id string que buscar
+_solo_canonico = False
+
+
+def nuevo() -> ObjectId:
+    return ObjectId()
+
+
+def es_hex(valor) -> bool:
+    return isinstance(valor, str) and len(valor) == 24 and ObjectId.is_valid(valor)
+
+
+def posibles(ids: Iterable) -> list:
+    """Cada id como ObjectId y, si la migración no terminó, también como string."""
+    resultado = []
+    for i in ids:
+        if isinstance(i, ObjectId):
+            resultado.append(i)
+            if not _solo_canonico:
+                resultado.append(str(i))
+            continue
+        if es_hex(i):
+            resultado.append(ObjectId(i))
+        if not _solo_canonico:
+            resultado.append(i)
+    return resultado
+
+
+def filtro_ids(ids: Iterable) -> dict:
+    return {"_id": {"$in": posibles(ids)}}
+
+
+def filtro_id(id_) -> dict:
+    """Filtro de una sola consulta para un _id recibido como string (o ObjectId)."""
+    return filtro_ids([id_])
+
+
+async def cargar_estado(bd) -> bool:
+    """Se llama al arrancar: si la migración terminó, los filtros usan solo ObjectId."""
+    global _solo_canonico
+    marca = await bd.db["migraciones"].find_one({"_id": MARCA}, {"completa": 1})
+    _solo_canonico = bool(marca and marca.get("completa"))
+    return _solo_canonico
+
+
+class MigradorIds:
+    def __init__(self, bd, tamano_lote: int = TAMANO_LOTE):
+        self.bd = bd
+        self.tamano_lote = tamano_lote
+
+    async def _progreso(self, coleccion: str, migrados: int, completa: bool = False):
+        await self.bd.db["migraciones"].update_one(
+            {"_id": MARCA},
+            {"$inc": {f"colecciones.{coleccion}.migrados": migrados},
+             "$set": {f"colecciones.{coleccion}.completa": completa, "fecha": datetime.now()}},
+            upsert=True,
+        )
+
+    async def _referencias(self, coleccion: str, cambios: dict, session=None):
+        """Las copias (origen) y los ocultos de cada PME guardan el _id de la raíz."""
+        if coleccion not in CON_RAICES or not cambios:
+            return
+        await getattr(self.bd, coleccion).bulk_write(
+            [UpdateMany({"origen": viejo}, {"$set": {"origen": oid}}) for viejo, oid in cambios.items()],
+            ordered=False, session=session)
+        campo = f"ocultos.{coleccion}"
+        await self.bd.pme.bulk_write(
+            [UpdateMany({campo: viejo}, {"$addToSet": {campo: oid}}) for viejo, oid in cambios.items()]
+            + [UpdateMany({campo: {"$in": list(cambios)}}, {"$pullAll": {campo: list(cambios)}})],
+            session=session)
+
+    @property
+    def _respaldo(self):
+        return self.bd.db[RESPALDO]
+
+    async def _mover(self, coleccion: str, docs: List[dict]) -> List[str]:
+        """Reescribe un lote; devuelve los _id string que no se pudieron borrar (editados entretanto)."""
+        col = getattr(self.bd, coleccion)
+        cambios = {d["_id"]: ObjectId(d["_id"]) for d in docs}
+
+        async def escribir(session):
+            # Los índices únicos (nombre, id_colegio+year) impiden tener ambas
+            # copias a la vez: se respalda, se borra el original y se inserta
+            await self._respaldo.bulk_write(
+                [ReplaceOne({"_id": cambios[d["_id"]]}, {"coleccion": coleccion, "doc": {**d, "_id": cambios[d["_id"]]}},
+                            upsert=True) for d in docs],
+                ordered=False, session=session)
+            await col.bulk_write(
+                [DeleteOne({"_id": d["_id"], "fecha_actualizacion": d.get("fecha_actualizacion")}) for d in docs],
+                ordered=False, session=session)
+            pendientes = [d["_id"] async for d in col.find({"_id": {"$in": list(cambios)}}, {"_id": 1}, session=session)]
+            movidos = {viejo: oid for viejo, oid in cambios.items() if viejo not in set(pendientes)}
+            if movidos:
+                await col.bulk_write(
+                    [ReplaceOne({"_id": cambios[d["_id"]]}, {**d, "_id": cambios[d["_id"]]}, upsert=True)
+                     for d in docs if d["_id"] in movidos],
+                    ordered=False, session=session)
+                await self._referencias(coleccion, movidos, session)
+            await self._respaldo.delete_many({"_id": {"$in": list(cambios.values())}}, session=session)
+            return pendientes
+
+        return await clonacion.ejecutar_en_transaccion(self.bd.client, escribir)
+
+    async def _recuperar(self, coleccion: str):
+        """Termina los lotes que una corrida anterior dejó a medias (original borrado, copia sin insertar)."""
+        col = getattr(self.bd, coleccion)
+        async for r in self._respaldo.find({"coleccion": coleccion}):
+            viejo = str(r["_id"])
+            if not await col.find_one({"_id": viejo}, {"_id": 1}):
+                await col.replace_one({"_id": r["_id"]}, r["doc"], upsert=True)
+                await self._referencias(coleccion, {viejo: r["_id"]})
+            await self._respaldo.delete_one({"_id": r["_id"]})
+
+    async def migrar(self, coleccion: str) -> int:
+        """Migra una colección completa (o lo que le quede) y devuelve cuántos documentos movió."""
+        col = getattr(self.bd, coleccion)
+        await self._recuperar(coleccion)
+        total = 0
+        while True:
+            docs = await col.find(_FILTRO_STRING).sort("_id", 1).limit(self.tamano_lote).to_list()
+            if not docs:
+                break
+            pendientes = await self._mover(coleccion, docs)
+            for _ in range(REINTENTOS):
+                if not pendientes:
+                    break
+                # Se editaron durante el lote: se copia la versión actual
+                pendientes = await self._mover(coleccion, await col.find({"_id": {"$in": pendientes}}).to_list())
+            if pendientes:
+                raise RuntimeError(f"{coleccion}: {len(pendientes)} documentos cambian sin parar; reintentar más tarde")
+            total += len(docs)
+            await self._progreso(coleccion, len(docs))
+            log.info("Lote de _id migrado", extra={"coleccion": coleccion, "documentos": len(docs), "total": total})
+        await self._progreso(coleccion, 0, completa=True)
+        return total
+
+    async def migrar_todo(self, colecciones: Iterable[str] = COLECCIONES) -> dict:
+        movidos = {c: await self.migrar(c) for c in colecciones}
+        marca = await self.bd.db["migraciones"].find_one({"_id": MARCA}) or {}
+        estado = marca.get("colecciones", {})
+        if all(estado.get(c, {}).get("completa") for c in COLECCIONES):
+            await self.bd.db["migraciones"].update_one({"_id": MARCA}, {"$set": {"completa": True}})
+        return movidos
+
+    async def estado(self) -> dict:
+        """_id string que quedan por colección."""
+        return {c: await getattr(self.bd, c).count_documents({"_id": {"$type": "string"}}) for c in COLECCIONES}
+
+
+async def _main(accion: str, coleccion: Optional[str] = None):
+    from database import BaseDatos
+
+    bd = BaseDatos()
+    bd.conectar()
+    try:
+        migrador = MigradorIds(bd)
+        if accion == "estado":
+            print(await migrador.estado())
+        else:
+            print(await migrador.migrar_todo([coleccion] if coleccion else COLECCIONES))
+    finally:
+        await bd.cerrar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrar", "estado") or (len(sys.argv) > 2 and sys.argv[2] not in COLECCIONES):
+        print("Uso: python identificadores.py migrar [coleccion] | estado")
+        sys.exit(2)
+
+    asyncio.run(_main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
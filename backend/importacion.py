@@ -0,0 +1,360 @@
+import hashlib
+import json
+import uuid
+from collections import Counter
+from itertools import islice
+from typing import Awaitable, Callable, Iterator, Optional, Tuple
+
+from openpyxl import load_workbook
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+import cambios
+import identificadores
+import instantaneas
+from busqueda import sin_tildes
+
+# ==========================================
+# IMPORTACIÓN DE EXCEL POR LOTES
+# ==========================================
+# La planilla se lee con openpyxl en modo read-only (fila a fila), se
+# valida y se inserta por lotes con insert_many(ordered=False). La
+# lectura y validación de cada lote (CPU) corren en el threadpool para
+# no bloquear el event loop; la escritura usa el driver async. Las filas
+# rechazadas (validación o escritura) vuelven en el reporte con su
+# número de fila en la planilla.
+#
+# Modo "actualizar" (volver a subir una planilla corregida): cada fila
+# se identifica con una clave estable dentro del PME
+#
+#   acciones  uuid_accion (las filas sin uuid se crean nuevas)
+#   recursos  uuid_accion + nombre_actividad (sin tildes ni mayúsculas)
+#
+# más el número de repetición de esa clave en la planilla, así dos filas
+# iguales se emparejan con dos documentos distintos. Se compara la huella
+# (hash) de los campos que trae la planilla con la del documento guardado:
+# las filas sin cambios no se escriben y el resto va en un bulk_write:
+# UpdateOne(upsert=False) por _id para los documentos existentes y
+# upsert=True solo para las inserciones de documentos completos. Si un
+# documento se borró mientras corría la importación, su fila vuelve como
+# rechazada (no se recrea a medias). Solo se tocan las columnas presentes
+# en la planilla. Cambiar el nombre de una actividad crea un recurso nuevo.
+# Los documentos guardados se buscan por lote (uuid_accion $in de las
+# filas del lote), no se carga el PME completo en memoria; los de una
+# misma clave se ordenan por su raíz para que la repetición n siempre
+# apunte al mismo documento.
+# En una instantánea (ver instantaneas.py) se compara contra la vista del
+# PME y una fila que cambia un documento heredado inserta su copia.
+
+TAMANO_LOTE = 1000
+MAX_RECHAZOS_DETALLE = 1000
+
+VALORES_VACIOS = ["nan", "none", ""]
+MODOS = ("insertar", "actualizar")
+# Campos que no cuentan para la huella ni se sobrescriben al actualizar
+CAMPOS_SIN_HUELLA = {"_id", "fecha", "fecha_actualizacion"}
+CAMPOS_NUMERICOS = {"year", "monto", "monto_sep", "monto_total"}
+
+
+def normalizar_encabezado(c) -> str:
+    if c is None:
+        return ""
+    return (
+        str(c).strip().lower()
+        .replace(' ', '_')
+        .replace('ó','o').replace('é','e').replace('í','i').replace('á','a').replace('ú','u')
+    )
+
+
+def _celda(columna: str, valor):
+    # Equivalente al fillna("") de pandas; los números en columnas de texto pasan a string
+    if valor is None:
+        return ""
+    if columna not in CAMPOS_NUMERICOS and isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return str(int(valor)) if float(valor).is_integer() else str(valor)
+    return valor
+
+
+def limpiar_monto(valor) -> int:
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return int(valor)
+    try:
+        return int(str(valor).replace('.', '').replace('$', '').strip())
+    except (TypeError, ValueError):
+        return 0
+
+
+def leer_filas(fuente, desde_fila: int = 0) -> Iterator[Tuple[int, dict]]:
+    """Itera (número de fila en la planilla, fila como dict) sin cargar la hoja completa.
+
+    `desde_fila` salta las filas ya procesadas (reanudar un trabajo).
+    """
+    wb = load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        filas = wb.active.iter_rows(values_only=True)
+        encabezados = [normalizar_encabezado(c) for c in next(filas, ())]
+        for nro, valores in enumerate(filas, start=2):
+            if nro <= desde_fila:
+                continue
+            if all(v is None or (isinstance(v, str) and not v.strip()) for v in valores):
+                continue
+            yield nro, {col: _celda(col, v) for col, v in zip(encabezados, valores) if col}
+    finally:
+        wb.close()
+
+
+def contar_filas(fuente) -> Optional[int]:
+    """Filas de datos según la dimensión de la hoja (aproximado: incluye filas vacías)."""
+    wb = load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        max_row = wb.active.max_row
+        return max(max_row - 1, 0) if max_row else None
+    finally:
+        wb.close()
+
+
+def _motivo(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
+    return str(error)
+
+
+# --- Preparación de filas (misma lógica que tenían los endpoints) ---
+
+def _uuid_de(row: dict) -> Optional[str]:
+    uuid_traido = str(row.get("uuid_accion", "")).strip()
+    if uuid_traido and uuid_traido.lower() not in VALORES_VACIOS:
+        return uuid_traido
+    return None
+
+
+def preparar_accion(row: dict, id_pme: str, year: int) -> dict:
+    # Si la planilla trae uuid_accion se respeta; si no, se genera uno nuevo
+    row["uuid_accion"] = _uuid_de(row) or str(uuid.uuid4())
+    row["id_pme"] = id_pme
+    row["year"] = year
+
+    sub = str(row.get("subdimensiones", ""))
+    if sub and sub.lower() not in ["nan", "none"]:
+        row["subdimensiones"] = [s.strip() for s in sub.split(',')]
+    else:
+        row["subdimensiones"] = []
+
+    row["monto_sep"] = limpiar_monto(row.get("monto_sep", 0))
+    row["monto_total"] = limpiar_monto(row.get("monto_total", 0))
+    return row
+
+
+def preparar_recurso(row: dict, id_pme: str, year: int) -> dict:
+    row.update({"id_pme": id_pme, "year": year})
+    # Sin uuid_accion el recurso se crea igual, como huérfano
+    row["uuid_accion"] = _uuid_de(row) or "sin asignar"
+
+    # Acepta columna 'recursos_actividad' o 'insumos'
+    rs = str(row.get("recursos_actividad", row.get("insumos", "")))
+    row["recursos_actividad"] = [s.strip() for s in rs.split(',')] if rs and rs.lower() != "nan" else []
+
+    row["monto"] = limpiar_monto(row.get("monto", 0))
+    return row
+
+
+_CAMPOS_FILA = "__campos_fila"
+
+
+def clave_accion(doc: dict) -> str:
+    return str(doc.get("uuid_accion"))
+
+
+def clave_recurso(doc: dict) -> str:
+    return f"{doc.get('uuid_accion')}|{sin_tildes(str(doc.get('nombre_actividad') or '')).strip()}"
+
+
+def huella(doc: dict, campos) -> str:
+    contenido = json.dumps({c: doc.get(c) for c in campos}, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(contenido.encode()).hexdigest()
+
+
+class ImportadorExcel:
+    def __init__(self, bd, coleccion: str, schema, preparar: Callable[[dict, str, int], dict],
+                 al_insertar: Optional[Callable[[list], Awaitable[None]]] = None, tamano_lote: int = TAMANO_LOTE,
+                 clave: Optional[Callable[[dict], str]] = None,
+                 al_quitar: Optional[Callable[[list], Awaitable[None]]] = None,
+                 campo_busqueda: str = "uuid_accion"):
+        self.bd = bd
+        self.coleccion = coleccion
+        self.schema = schema
+        self.preparar = preparar
+        self.al_insertar = al_insertar
+        self.tamano_lote = tamano_lote
+        # Modo "actualizar": clave estable de cada fila y qué hacer con la versión anterior
+        self.clave = clave
+        self.al_quitar = al_quitar
+        # Campo (parte de la clave) con el que se buscan por lote los documentos guardados
+        self.campo_busqueda = campo_busqueda
+
+    @property
+    def col(self):
+        return getattr(self.bd, self.coleccion)
+
+    def validar_lote(self, lote, id_pme: str, year: int):
+        validos, numeros, rechazados = [], [], []
+        for nro, row in lote:
+            try:
+                preparada = self.preparar(row, id_pme, year)
+                obj = self.schema(**preparada)
+                doc = obj.model_dump(by_alias=True, exclude={"id"})
+                doc["_id"] = identificadores.nuevo()
+                # Columnas que trajo la planilla (las demás quedan con el valor por defecto)
+                doc[_CAMPOS_FILA] = [c for c in doc if c in preparada and c not in CAMPOS_SIN_HUELLA]
+                validos.append(doc)
+                numeros.append(nro)
+            except Exception as e:
+                rechazados.append({"fila": nro, "motivo": _motivo(e)})
+        return validos, numeros, rechazados
+
+    def leer_lote(self, filas: Iterator, id_pme: str, year: int):
+        """Lee y valida el siguiente lote (se ejecuta en el threadpool)."""
+        lote = list(islice(filas, self.tamano_lote))
+        ultima_fila = lote[-1][0] if lote else 0
+        return (len(lote), ultima_fila, *self.validar_lote(lote, id_pme, year))
+
+    async def escribir_lote(self, docs: list, numeros: list):
+        """insert_many sin orden: un documento malo no detiene el resto del lote."""
+        for d in docs:
+            d.pop(_CAMPOS_FILA, None)
+        if not docs:
+            return [], []
+        # Los años que heredan de este PME no ven las filas nuevas
+        await instantaneas.congelar(self.bd, self.coleccion, docs)
+        try:
+            await self.col.insert_many(docs, ordered=False)
+            return docs, []
+        except BulkWriteError as e:
+            fallidos = {err["index"]: err.get("errmsg", "Error de escritura") for err in e.details.get("writeErrors", [])}
+            insertados = [d for i, d in enumerate(docs) if i not in fallidos]
+            return insertados, [{"fila": numeros[i], "motivo": m} for i, m in fallidos.items()]
+
+    # --- Modo "actualizar" ---
+
+    async def existentes(self, docs: list, id_pme: str, info, conocidos: dict, buscados: set):
+        """Agrega a `conocidos` ({clave: [documentos]}) lo guardado para las filas del lote.
+
+        Solo consulta los valores de `campo_busqueda` que no se buscaron en
+        lotes anteriores; lo que escribe esta misma importación no entra.
+        """
+        valores = list({d.get(self.campo_busqueda) for d in docs} - buscados)
+        if not valores:
+            return
+        buscados.update(valores)
+        nuevos = {}
+        filtro = {self.campo_busqueda: {"$in": valores}}
+        async for d in await instantaneas.vista(self.bd, self.coleccion, id_pme, filtro, info=info):
+            nuevos.setdefault(self.clave(d), []).append(d)
+        for base, lista in nuevos.items():
+            conocidos[base] = sorted(lista, key=lambda d: str(instantaneas.raiz(d)))
+
+    async def actualizar_lote(self, docs: list, numeros: list, conocidos: dict, vistos: Counter):
+        """Escribe solo las filas nuevas o con cambios. Devuelve (insertados, [(antes, después)], sin_cambios, fallidos)."""
+        escrituras, origen, sin_cambios = [], [], 0
+        for nro, doc in zip(numeros, docs):
+            campos = doc.pop(_CAMPOS_FILA)
+            base = self.clave(doc)
+            vistos[base] += 1
+            guardados = conocidos.get(base, [])
+            antes = guardados[vistos[base] - 1] if vistos[base] <= len(guardados) else None
+            if antes is None:
+                escrituras.append(UpdateOne({"_id": doc["_id"]}, {"$set": {k: v for k, v in doc.items() if k != "_id"}}, upsert=True))
+            elif huella(doc, campos) == huella(antes, campos):
+                sin_cambios += 1
+                continue
+            else:
+                nuevos = {c: doc[c] for c in campos}
+                nuevos["fecha_actualizacion"] = doc["fecha_actualizacion"]
+                if antes.get("heredado"):
+                    # Heredado de una instantánea: se inserta su copia con los cambios
+                    doc = {**instantaneas.nueva_copia(antes), **nuevos}
+                    escrituras.append(UpdateOne({"_id": doc["_id"]}, {"$set": {k: v for k, v in doc.items() if k != "_id"}}, upsert=True))
+                else:
+                    escrituras.append(UpdateOne({"_id": antes["_id"]}, {"$set": nuevos}, upsert=False))
+                    doc = {**antes, **nuevos}
+            origen.append((nro, antes, doc))
+
+        # Antes de escribir: los años que heredan de este PME se quedan con lo que veían
+        await instantaneas.congelar(self.bd, self.coleccion, [antes or doc for _, antes, doc in origen])
+
+        fallidos = {}
+        # Índices de los UpdateOne sin upsert (documentos propios que ya existían)
+        sin_upsert = [i for i, (_, antes, _) in enumerate(origen) if antes is not None and not antes.get("heredado")]
+        coincidencias = len(sin_upsert)
+        if escrituras:
+            try:
+                resultado = await self.col.bulk_write(escrituras, ordered=False)
+                coincidencias = resultado.matched_count
+            except BulkWriteError as e:
+                fallidos = {err["index"]: err.get("errmsg", "Error de escritura") for err in e.details.get("writeErrors", [])}
+                coincidencias = e.details.get("nMatched", 0)
+        if coincidencias < len([i for i in sin_upsert if i not in fallidos]):
+            # Alguno se borró mientras corría la importación: su fila no se escribió
+            ids = [origen[i][1]["_id"] for i in sin_upsert if i not in fallidos]
+            vivos = {d["_id"] async for d in self.col.find({"_id": {"$in": ids}}, {"_id": 1})}
+            for i in sin_upsert:
+                if i not in fallidos and origen[i][1]["_id"] not in vivos:
+                    fallidos[i] = "El documento se eliminó durante la importación"
+        insertados = [doc for i, (_, antes, doc) in enumerate(origen) if i not in fallidos and antes is None]
+        actualizados = [(antes, doc) for i, (_, antes, doc) in enumerate(origen) if i not in fallidos and antes is not None]
+        # El cliente conocía los heredados por el _id del original
+        await cambios.registrar_eliminados(self.bd, self.coleccion, [antes for antes, _ in actualizados if antes.get("heredado")])
+        return insertados, actualizados, sin_cambios, [{"fila": origen[i][0], "motivo": m} for i, m in sorted(fallidos.items())]
+
+    async def ejecutar(self, fuente, id_pme: str, year: int, avance=None, modo: str = "insertar") -> dict:
+        """Importa la planilla `fuente` (ruta o archivo).
+
+        Con `avance` (trabajos.Avance) se informa el progreso después de
+        cada lote y, si el trabajo se está reanudando, se continúa desde la
+        última fila confirmada con el reporte acumulado hasta ahí. En modo
+        "actualizar" se relee la planilla completa: las filas ya escritas
+        salen sin cambios.
+        """
+        actualizar = modo == "actualizar"
+        reanudar = {} if actualizar else getattr(avance, "reanudar", None) or {}
+        reporte = reanudar.get("reporte") or {"filas_leidas": 0, "insertados": 0, "actualizados": 0, "sin_cambios": 0,
+                                              "total_rechazados": 0, "rechazados": [], "huerfanos": 0}
+        total = await run_in_threadpool(contar_filas, fuente) if avance else None
+        # Modo "actualizar": documentos guardados de las claves ya vistas y repeticiones de cada clave
+        info = await instantaneas.cadena(self.bd, id_pme) if actualizar else None
+        conocidos, buscados, vistos = {}, set(), Counter()
+        filas = leer_filas(fuente, reanudar.get("ultima_fila", 0))
+        try:
+            while True:
+                leidas, ultima_fila, validos, numeros, rechazados = await run_in_threadpool(self.leer_lote, filas, id_pme, year)
+                if not leidas:
+                    break
+                reporte["filas_leidas"] += leidas
+                if actualizar:
+                    await self.existentes(validos, id_pme, info, conocidos, buscados)
+                    insertados, actualizados, sin_cambios, fallidos = await self.actualizar_lote(validos, numeros, conocidos, vistos)
+                    reporte["actualizados"] += len(actualizados)
+                    reporte["sin_cambios"] += sin_cambios
+                    if actualizados and self.al_quitar:
+                        await self.al_quitar([antes for antes, _ in actualizados])
+                    # El resumen suma la versión nueva igual que una inserción
+                    escritos = insertados + [despues for _, despues in actualizados]
+                else:
+                    insertados, fallidos = await self.escribir_lote(validos, numeros)
+                    escritos = insertados
+                rechazados += fallidos
+
+                if escritos and self.al_insertar:
+                    await self.al_insertar(escritos)
+                reporte["insertados"] += len(insertados)
+                reporte["huerfanos"] += sum(1 for d in insertados if d.get("uuid_accion") == "sin asignar")
+                reporte["total_rechazados"] += len(rechazados)
+                espacio = MAX_RECHAZOS_DETALLE - len(reporte["rechazados"])
+                reporte["rechazados"] += rechazados[:max(espacio, 0)]
+                if avance:
+                    await avance(reporte["filas_leidas"], total, reanudar={"ultima_fila": ultima_fila, "reporte": reporte}, forzar=True)
+        finally:
+            filas.close()
+        return reporte
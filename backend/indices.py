@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import sys
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from busqueda import CAMPOS as CAMPOS_TEXTO, IDIOMA
+from cambios import RETENCION
+
+# ==========================================
+# ÍNDICES DE LA BASE DE DATOS
+# ==========================================
+# Índices que necesitan las consultas de los endpoints. Se crean al
+# iniciar la app (lifespan) y se pueden verificar con:
+#
+#   python indices.py verificar
+#
+# que ejecuta explain() sobre cada forma de consulta y falla si alguna
+# termina en COLLSCAN.
+
+log = logging.getLogger("pme.indices")
+
+def _indice_texto(coleccion: str) -> IndexModel:
+    # Un solo índice de texto por colección (/api/buscar, ver busqueda.py).
+    # language_override apunta a un campo que no existe: ningún documento
+    # cambia el idioma del índice por tener un campo "language".
+    campos = CAMPOS_TEXTO[coleccion]
+    return IndexModel([(c, TEXT) for c in campos], name="texto", weights=dict(campos),
+                      default_language=IDIOMA, language_override="idioma_texto")
+
+
+INDICES = {
+    "pme": [
+        # Único: reemplaza el find-then-insert de create_pme
+        IndexModel([("id_colegio", ASCENDING), ("year", DESCENDING)], name="colegio_year_unico", unique=True),
+        # Años que heredan de un PME (instantaneas.py); solo los PME con bases entran al índice
+        IndexModel([("bases", ASCENDING)], name="bases", sparse=True),
+    ],
+    "acciones": [
+        IndexModel([("id_pme", ASCENDING), ("uuid_accion", ASCENDING)], name="pme_uuid"),
+        IndexModel([("uuid_accion", ASCENDING)], name="uuid_accion"),
+        IndexModel([("id_pme", ASCENDING), ("_id", ASCENDING)], name="pme_id"),
+        IndexModel([("id_pme", ASCENDING), ("fecha_actualizacion", ASCENDING)], name="pme_fecha"),
+        IndexModel([("origen", ASCENDING)], name="origen", sparse=True),
+        _indice_texto("acciones"),
+    ],
+    "recursos": [
+        IndexModel([("id_pme", ASCENDING), ("uuid_accion", ASCENDING)], name="pme_uuid"),
+        IndexModel([("uuid_accion", ASCENDING)], name="uuid_accion"),
+        # Orden de las páginas keyset: (id_pme, campo, _id)
+        IndexModel([("id_pme", ASCENDING), ("_id", ASCENDING)], name="pme_id"),
+        IndexModel([("id_pme", ASCENDING), ("monto", ASCENDING), ("_id", ASCENDING)], name="pme_monto_id"),
+        IndexModel([("id_pme", ASCENDING), ("nombre_actividad", ASCENDING), ("_id", ASCENDING)], name="pme_nombre_id"),
+        IndexModel([("id_pme", ASCENDING), ("fecha_actualizacion", ASCENDING)], name="pme_fecha"),
+        # Copias materializadas de una instantánea, por raíz
+        IndexModel([("origen", ASCENDING)], name="origen", sparse=True),
+        _indice_texto("recursos"),
+    ],
+    "eliminados": [
+        # Marcas de eliminación para /cambios; expiran solas (ver cambios.py)
+        IndexModel([("id_pme", ASCENDING), ("fecha_actualizacion", ASCENDING)], name="pme_fecha"),
+        IndexModel([("fecha_actualizacion", ASCENDING)], name="expira",
+                   expireAfterSeconds=int(RETENCION.total_seconds())),
+    ],
+    "users": [
+        IndexModel([("perfil", ASCENDING)], name="perfil"),
+    ],
+    "pme_resumen": [
+        # PME cuyo resumen cambió desde la última pasada de los rollups
+        IndexModel([("fecha_actualizacion", ASCENDING)], name="fecha_actualizacion"),
+    ],
+    "rollups": [
+        # Clave del $merge (rollups.py): debe ser única
+        IndexModel([("id_colegio", ASCENDING), ("year", ASCENDING), ("dimension", ASCENDING)],
+                   name="colegio_year_dimension", unique=True),
+        IndexModel([("year", ASCENDING)], name="year"),
+        IndexModel([("id_pme", ASCENDING), ("fecha_actualizacion", ASCENDING)], name="pme_fecha"),
+    ],
+    "colegios": [
+        IndexModel([("nombre", ASCENDING)], name="nombre"),
+    ],
+    "jobs": [
+        # Toma del siguiente trabajo pendiente y recuperación de abandonados
+        IndexModel([("estado", ASCENDING), ("tipo", ASCENDING), ("creado", ASCENDING)], name="estado_tipo_creado"),
+        IndexModel([("estado", ASCENDING), ("latido", ASCENDING)], name="estado_latido"),
+        IndexModel([("expira", ASCENDING)], name="expira", sparse=True),
+    ],
+}
+
+# Forma de la consulta principal de cada endpoint: (endpoint, colección, filtro)
+FORMAS_CONSULTA = [
+    ("login", "users", {"perfil": "x"}),
+    ("create_colegio", "colegios", {"nombre": "x"}),
+    ("get_pme_id", "pme", {"id_colegio": "x", "year": 2024}),
+    ("listar_pmes_por_colegio", "pme", {"id_colegio": "x"}),
+    ("listar_acciones", "acciones", {"id_pme": "x"}),
+    ("modificar_accion", "acciones", {"uuid_accion": "x"}),
+    ("listar_recursos", "recursos", {"uuid_accion": "x"}),
+    ("listar_todos_recursos_pme", "recursos", {"id_pme": "x"}),
+    ("clonar_pme", "recursos", {"id_pme": "x", "uuid_accion": {"$in": ["x"]}}),
+    ("paginar_acciones", "acciones", {"id_pme": "x", "_id": {"$gt": "x"}}),
+    ("paginar_recursos", "recursos", {"id_pme": "x", "monto": {"$gte": 0}, "_id": {"$gt": "x"}}),
+    ("cambios_acciones", "acciones", {"id_pme": "x", "fecha_actualizacion": {"$gte": 0}}),
+    ("cambios_recursos", "recursos", {"id_pme": "x", "fecha_actualizacion": {"$gte": 0}}),
+    ("cambios_eliminados", "eliminados", {"id_pme": "x", "fecha_actualizacion": {"$gte": 0}}),
+    ("buscar_acciones", "acciones", {"$text": {"$search": "x"}}),
+    ("buscar_recursos", "recursos", {"$text": {"$search": "x"}}),
+    ("instantaneas_dependientes", "pme", {"bases": "x"}),
+    ("instantaneas_copias", "recursos", {"origen": {"$in": ["x"]}}),
+    ("rollups_cambiados", "pme_resumen", {"fecha_actualizacion": {"$gte": 0}}),
+    ("rollups_colegio", "rollups", {"id_colegio": "x"}),
+    ("rollups_years", "rollups", {"year": {"$gte": 2024}}),
+    ("tomar_trabajo", "jobs", {"estado": "pendiente", "tipo": {"$in": ["x"]}}),
+    ("trabajos_abandonados", "jobs", {"estado": "en_curso", "latido": {"$lt": 0}}),
+]
+
+
+async def indices_faltantes(db) -> dict:
+    """Devuelve {colección: [nombres]} con los índices declarados que no existen."""
+    faltantes = {}
+    for nombre_col, modelos in INDICES.items():
+        existentes = set(await db[nombre_col].index_information())
+        nombres = [m.document["name"] for m in modelos if m.document["name"] not in existentes]
+        if nombres:
+            faltantes[nombre_col] = nombres
+    return faltantes
+
+
+async def asegurar_indices(db) -> dict:
+    """Crea los índices declarados que falten. Devuelve los que se crearon."""
+    creados = {}
+    for nombre_col, nombres in (await indices_faltantes(db)).items():
+        modelos = [m for m in INDICES[nombre_col] if m.document["name"] in nombres]
+        try:
+            await db[nombre_col].create_indexes(modelos)
+            creados[nombre_col] = nombres
+            log.info("Índices creados", extra={"coleccion": nombre_col, "indices": nombres})
+        except OperationFailure as e:
+            # Ej: datos duplicados que impiden el índice único; la app sigue funcionando
+            log.error("No se pudieron crear índices", extra={"coleccion": nombre_col, "error": str(e)})
+    return creados
+
+
+def _etapas(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for valor in plan.values():
+            yield from _etapas(valor)
+    elif isinstance(plan, list):
+        for valor in plan:
+            yield from _etapas(valor)
+
+
+async def verificar_planes(db) -> list:
+    """Ejecuta explain() sobre cada forma de consulta. Devuelve los endpoints con COLLSCAN."""
+    con_collscan = []
+    for endpoint, nombre_col, filtro in FORMAS_CONSULTA:
+        plan = await db[nombre_col].find(filtro).explain()
+        etapas = list(_etapas(plan.get("queryPlanner", {}).get("winningPlan", {})))
+        estado = "❌ COLLSCAN" if "COLLSCAN" in etapas else "✅"
+        print(f"{estado} {endpoint} ({nombre_col}): {' > '.join(etapas)}")
+        if "COLLSCAN" in etapas:
+            con_collscan.append(endpoint)
+    return con_collscan
+
+
+async def _main(comando: str) -> int:
+    from database import BaseDatos
+
+    bd = BaseDatos()
+    bd.conectar()
+    try:
+        await asegurar_indices(bd.db)
+        if comando == "verificar" and await verificar_planes(bd.db):
+            return 1
+        return 0
+    finally:
+        await bd.cerrar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("crear", "verificar"):
+        print("Uso: python indices.py [crear|verificar]")
+        sys.exit(2)
+
+    from observabilidad import configurar_logging
+    configurar_logging(formato="texto")
+    sys.exit(asyncio.run(_main(sys.argv[1])))
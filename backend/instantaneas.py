@@ -0,0 +1,298 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import cambios
+import identificadores
+
+# ==========================================
+# INSTANTÁNEAS DE PME (COPIA AL ESCRIBIR)
+# ==========================================
+# Un año creado con clonar=True e instantanea=True no copia documentos:
+# el PME nuevo guarda `bases` (el PME de origen y las bases de este, del
+# más cercano al más lejano) y ve las acciones y recursos de ellas como
+# propios. Crear el año es una sola escritura, sin importar el tamaño.
+#
+#   raíz      identidad de un documento entre años: el _id del original;
+#             cada copia la guarda en `origen`
+#   vista     por cada raíz, la primera versión en [PME] + bases, salvo
+#             las raíces de `ocultos`. Los heredados salen con el id_pme
+#             y year del PME y `heredado` = PME de donde vienen
+#
+# Un heredado se copia al PME (se "materializa") la primera vez que se
+# modifica; eliminarlo agrega su raíz a `ocultos` del PME. El cliente
+# recibe una marca de eliminación del _id heredado (ver cambios.py) y la
+# copia nueva por /cambios.
+#
+# Los PME que son base de otros siguen editables: antes de escribir en
+# uno se "congela" la vista de sus dependientes (se materializa lo que
+# heredaban de esos documentos y se ocultan las raíces nuevas), así lo
+# que se edita en el año anterior no aparece en el siguiente. Eliminar
+# un PME base materializa todo lo que sus dependientes heredaban de él.
+
+TAMANO_LOTE = 1000
+
+log = logging.getLogger("pme.instantaneas")
+
+_CONSULTAR = object()
+
+
+class Ambiguo(ValueError):
+    """El filtro encuentra documentos en más de un PME y no se indicó en cuál escribir."""
+
+
+def raiz(doc: dict):
+    return doc.get("origen", doc["_id"])
+
+
+def info_pme(pme: dict) -> dict:
+    id_pme = str(pme["_id"])
+    return {"id_pme": id_pme, "cadena": [id_pme] + list(pme.get("bases", [])),
+            "year": pme.get("year"), "ocultos": pme.get("ocultos") or {}}
+
+
+async def cadena(bd, id_pme: str) -> Optional[dict]:
+    """Datos de la instantánea {id_pme, cadena, year, ocultos}, o None si el PME no hereda de otro."""
+    pme = await bd.pme.find_one(identificadores.filtro_id(id_pme), {"bases": 1, "ocultos": 1, "year": 1})
+    if not pme or not pme.get("bases"):
+        return None
+    return {**info_pme(pme), "id_pme": id_pme}
+
+
+def no_ocultos(info: dict, coleccion: str) -> dict:
+    """Condición de consulta: la raíz del documento no está oculta en el PME."""
+    ocultos = info["ocultos"].get(coleccion, [])
+    if not ocultos:
+        return {}
+    return {"$nor": [{"origen": {"$in": ocultos}}, {"origen": {"$exists": False}, "_id": {"$in": ocultos}}]}
+
+
+def etapas(info: dict, coleccion: str, filtro: Optional[dict] = None, raices: Optional[list] = None) -> list:
+    """Etapas de agregación que producen la vista del PME (opcionalmente filtrada)."""
+    previo = {"id_pme": {"$in": info["cadena"]}, **no_ocultos(info, coleccion)}
+    if raices is not None:
+        previo = {"$and": [previo, {"$or": [{"_id": {"$in": raices}}, {"origen": {"$in": raices}}]}]}
+    cambiar = {"id_pme": info["id_pme"],
+               "heredado": {"$cond": [{"$gt": ["$_prioridad", 0]}, "$id_pme", "$$REMOVE"]}}
+    if info["year"] is not None:
+        cambiar["year"] = info["year"]
+    pipeline = [
+        {"$match": previo},
+        {"$set": {"_raiz": {"$ifNull": ["$origen", "$_id"]},
+                  "_prioridad": {"$indexOfArray": [info["cadena"], "$id_pme"]}}},
+        # La versión más cercana de cada raíz
+        {"$sort": {"_raiz": 1, "_prioridad": 1}},
+        {"$group": {"_id": "$_raiz", "doc": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$doc"}},
+        {"$set": cambiar},
+        {"$unset": ["_raiz", "_prioridad"]},
+    ]
+    if filtro:
+        # Después de elegir la versión: una copia puede haber cambiado el campo filtrado
+        pipeline.append({"$match": filtro})
+    pipeline.append({"$sort": {"_id": 1}})
+    return pipeline
+
+
+async def vista(bd, coleccion: str, id_pme: str, filtro: Optional[dict] = None, proy: Optional[dict] = None,
+                info=_CONSULTAR):
+    """Cursor async con los documentos que ve el PME: un find normal o la agregación de la instantánea."""
+    if info is _CONSULTAR:
+        info = await cadena(bd, id_pme)
+    col = getattr(bd, coleccion)
+    if info is None:
+        return col.find({"id_pme": id_pme, **(filtro or {})}, proy).sort("_id", 1)
+    pipeline = etapas(info, coleccion, filtro)
+    if proy:
+        pipeline.append({"$project": proy})
+    return await col.aggregate(pipeline)
+
+
+async def contar(bd, coleccion: str, id_pme: str, filtro: Optional[dict] = None, info=_CONSULTAR) -> int:
+    if info is _CONSULTAR:
+        info = await cadena(bd, id_pme)
+    if info is None:
+        return await getattr(bd, coleccion).count_documents({"id_pme": id_pme, **(filtro or {})})
+    cursor = await getattr(bd, coleccion).aggregate(etapas(info, coleccion, filtro) + [{"$count": "n"}])
+    return next(iter(await cursor.to_list()), {}).get("n", 0)
+
+
+async def distintos(bd, coleccion: str, campo: str, id_pme: str, filtro: Optional[dict] = None,
+                    info=_CONSULTAR) -> list:
+    if info is _CONSULTAR:
+        info = await cadena(bd, id_pme)
+    if info is None:
+        return await getattr(bd, coleccion).distinct(campo, {"id_pme": id_pme, **(filtro or {})})
+    cursor = await vista(bd, coleccion, id_pme, filtro, {campo: 1}, info=info)
+    return list({d[campo] async for d in cursor if campo in d})
+
+
+# --- Escrituras ---
+
+def nueva_copia(doc: dict) -> dict:
+    """Copia de un documento de la vista como documento propio del PME."""
+    copia = {k: v for k, v in doc.items() if k != "heredado"}
+    copia.update({"_id": identificadores.nuevo(), "origen": raiz(doc)})
+    return copia
+
+
+async def materializar(bd, coleccion: str, heredados: List[dict]) -> List[dict]:
+    """Inserta en su PME la copia de cada documento heredado (tal como se veía) y las devuelve."""
+    if not heredados:
+        return []
+    ahora = datetime.now()
+    copias = [{**nueva_copia(h), "fecha_actualizacion": ahora} for h in heredados]
+    col = getattr(bd, coleccion)
+    for i in range(0, len(copias), TAMANO_LOTE):
+        await col.insert_many(copias[i:i + TAMANO_LOTE], ordered=False)
+    # El cliente conocía el heredado por el _id del original
+    await cambios.registrar_eliminados(bd, coleccion, heredados)
+    return copias
+
+
+async def _ocultar_raices(bd, coleccion: str, id_pme: str, raices: list):
+    if raices:
+        await bd.pme.update_one(identificadores.filtro_id(id_pme), {"$addToSet": {f"ocultos.{coleccion}": {"$each": raices}}})
+
+
+async def ocultar(bd, coleccion: str, docs: List[dict]):
+    """Los documentos salieron de su PME: si venían de una base, su raíz deja de verse ahí."""
+    por_pme = defaultdict(list)
+    for d in docs:
+        if d.get("heredado") or "origen" in d:
+            por_pme[d["id_pme"]].append(raiz(d))
+    for id_pme, raices in por_pme.items():
+        await _ocultar_raices(bd, coleccion, id_pme, raices)
+
+
+async def congelar(bd, coleccion: str, docs: List[dict]) -> List[str]:
+    """Antes de escribir `docs` (cada uno en su id_pme): los PME que heredan de ellos se quedan con lo que veían.
+
+    Devuelve los PME dependientes que se tocaron.
+    """
+    por_pme = defaultdict(list)
+    for d in docs:
+        por_pme[d.get("id_pme")].append(raiz(d))
+    tocados = []
+    for id_pme, raices in por_pme.items():
+        if id_pme is None:
+            continue
+        raices = list(dict.fromkeys(raices))
+        async for pme in bd.pme.find({"bases": id_pme}, {"bases": 1, "ocultos": 1, "year": 1}):
+            info = info_pme(pme)
+            visibles = await (await getattr(bd, coleccion).aggregate(etapas(info, coleccion, raices=raices))).to_list()
+            await materializar(bd, coleccion, [v for v in visibles if v.get("heredado")])
+            vistas = {raiz(v) for v in visibles}
+            # Raíces que el dependiente no veía (documentos nuevos): no debe empezar a verlas
+            await _ocultar_raices(bd, coleccion, info["id_pme"], [r for r in raices if r not in vistas])
+            tocados.append(info["id_pme"])
+    if tocados:
+        log.info("Instantáneas congeladas antes de escribir", extra={"coleccion": coleccion, "pmes": tocados})
+    return tocados
+
+
+async def sin_dependencias(bd, id_pme: str) -> bool:
+    """True si `id_pme` no hereda de otro PME ni otro hereda de él: sus documentos se escriben directo."""
+    relacionados = bd.pme.find({"$or": [{**identificadores.filtro_id(id_pme), "bases.0": {"$exists": True}},
+                                        {"bases": id_pme}]}, {"_id": 1})
+    return not await relacionados.limit(1).to_list()
+
+
+def _un_pme(docs: List[dict]) -> List[dict]:
+    pmes = {d.get("id_pme") for d in docs}
+    if len(pmes) > 1:
+        raise Ambiguo(f"Está en {len(pmes)} PME distintos; indicar id_pme")
+    return docs
+
+
+async def _objetivos(bd, coleccion: str, filtro: dict, id_pme: Optional[str], varios: bool,
+                     fuera: bool = True) -> Tuple[Optional[dict], list]:
+    """Documentos que `filtro` encuentra vistos desde `id_pme` (si se indica).
+
+    Con `fuera`, lo que no está en la vista se busca en los demás PME (una
+    edición que mueve el documento de PME), pero solo si está en uno: un
+    uuid_accion se repite en cada año copiado o heredado.
+    """
+    info = await cadena(bd, id_pme) if id_pme else None
+    col = getattr(bd, coleccion)
+    if info is not None:
+        docs = await (await col.aggregate(etapas(info, coleccion, filtro))).to_list()
+        if docs or varios or not fuera:
+            return info, docs if varios else docs[:1]
+        # Fuera de la vista (otro PME): nunca una versión reemplazada u oculta de la cadena
+        filtro = {**filtro, "id_pme": {"$nin": info["cadena"]}}
+    elif id_pme:
+        propios = col.find({**filtro, "id_pme": id_pme})
+        docs = await (propios if varios else propios.limit(1)).to_list()
+        if docs or varios or not fuera:
+            return None, docs
+        filtro = {**filtro, "id_pme": {"$ne": id_pme}}
+    if varios:
+        return info, _un_pme(await col.find(filtro).to_list())
+    return info, _un_pme(await col.find(filtro).limit(2).to_list())[:1]
+
+
+async def para_escribir(bd, coleccion: str, filtro: dict, id_pme: Optional[str] = None, varios: bool = False) -> List[dict]:
+    """Documentos físicos sobre los que se aplica una edición hecha desde `id_pme`.
+
+    Los heredados se materializan antes y se congelan los dependientes.
+    """
+    _, docs = await _objetivos(bd, coleccion, filtro, id_pme, varios)
+    await congelar(bd, coleccion, docs)
+    heredados = [d for d in docs if d.get("heredado")]
+    copias = await materializar(bd, coleccion, heredados)
+    return [d for d in docs if not d.get("heredado")] + copias
+
+
+async def eliminar(bd, coleccion: str, filtro: dict, id_pme: Optional[str] = None, varios: bool = False) -> List[dict]:
+    """Elimina lo que `filtro` encuentra desde `id_pme` y devuelve esos documentos como se veían.
+
+    Un heredado no se borra de su base: su raíz se oculta en el PME. Con
+    `id_pme` no se borra nada fuera de su vista.
+    """
+    _, docs = await _objetivos(bd, coleccion, filtro, id_pme, varios, fuera=False)
+    await congelar(bd, coleccion, docs)
+    fisicos = [d["_id"] for d in docs if not d.get("heredado")]
+    if fisicos:
+        await getattr(bd, coleccion).delete_many({"_id": {"$in": fisicos}})
+    await ocultar(bd, coleccion, docs)
+    return docs
+
+
+async def resolver_heredados(bd, coleccion: str, id_pme: Optional[str], filtro: dict) -> Tuple[Optional[dict], dict]:
+    """Materializa los heredados del PME que cumplen `filtro` (edición masiva).
+
+    Devuelve (instantánea o None, {str(_id visto): documento a escribir}):
+    los propios del PME tal cual y cada heredado con su copia.
+    """
+    info = await cadena(bd, id_pme) if id_pme else None
+    if info is None:
+        return None, {}
+    vistos = await (await getattr(bd, coleccion).aggregate(etapas(info, coleccion, filtro))).to_list()
+    heredados = [d for d in vistos if d.get("heredado")]
+    await congelar(bd, coleccion, heredados)
+    copias = dict(zip((str(h["_id"]) for h in heredados), await materializar(bd, coleccion, heredados)))
+    return info, {str(d["_id"]): copias.get(str(d["_id"]), d) for d in vistos}
+
+
+async def independizar(bd, id_pme: str) -> List[str]:
+    """Antes de eliminar `id_pme`: sus dependientes materializan lo que heredaban de él y lo quitan de `bases`."""
+    tocados = []
+    async for pme in bd.pme.find({"bases": id_pme}, {"bases": 1, "ocultos": 1, "year": 1}):
+        info = info_pme(pme)
+        for coleccion in ("acciones", "recursos"):
+            cursor = await getattr(bd, coleccion).aggregate(etapas(info, coleccion))
+            await materializar(bd, coleccion, [d async for d in cursor if d.get("heredado") == id_pme])
+        await bd.pme.update_one({"_id": pme["_id"]}, {"$pull": {"bases": id_pme}})
+        tocados.append(info["id_pme"])
+    return tocados
+
+
+def nueva_instantanea(pme_origen: dict) -> dict:
+    """Campos del PME nuevo que hereda de `pme_origen`."""
+    return {
+        "bases": [str(pme_origen["_id"])] + list(pme_origen.get("bases", [])),
+        # Lo que el origen eliminó de sus propias bases tampoco se ve en el año nuevo
+        "ocultos": pme_origen.get("ocultos") or {},
+    }
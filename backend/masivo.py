@@ -0,0 +1,323 @@
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from pydantic import TypeAdapter, ValidationError
+from pymongo import DeleteMany, DeleteOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import cambios
+import identificadores
+import instantaneas
+
+# ==========================================
+# EDICIÓN MASIVA (/api/recursos/bulk, /api/acciones/bulk)
+# ==========================================
+# Muchas operaciones en un solo request, en vez de un PUT/DELETE por fila:
+#
+#   {"op": "actualizar", "id": ..., "datos": {campo: valor, ...}}
+#   {"op": "mover", "id": ..., "uuid_accion": ...}       recurso -> otra acción del PME
+#   {"op": "mover", "id": ..., "id_pme": ..., "year": ...} acción (con sus recursos) -> otro PME
+#   {"op": "eliminar", "id": ...}
+#
+# Los recursos se identifican por _id y las acciones por uuid_accion. Los
+# documentos afectados se leen con una sola consulta (ver identificadores.py
+# para los _id string que quedan sin migrar), cada operación
+# se valida contra el esquema y todas se escriben con un bulk_write sin
+# orden. Una operación inválida o que falla no detiene a las demás; la
+# respuesta trae un resultado por operación, en el mismo orden.
+#
+# Un recurso que cambia de acción ("mover", o "actualizar" con
+# uuid_accion) toma la dimensión de la acción destino, que debe existir
+# en su PME.
+#
+# El resumen presupuestario (un update por PME) y las marcas de /cambios
+# se actualizan con los documentos leídos antes de escribir.
+#
+# Con `id_pme` (PME desde el que se edita) los documentos que ese PME
+# hereda de una instantánea se materializan antes (ver instantaneas.py);
+# las versiones de la cadena que el PME ya no ve cuentan como no
+# encontradas. Las acciones se buscan solo en ese PME; sin `id_pme`, un
+# uuid_accion que está en varios PME falla como en PUT /api/acciones.
+#
+#   BULK_MAX_OPERACIONES   operaciones por request (5000)
+
+MAX_OPERACIONES = int(os.getenv("BULK_MAX_OPERACIONES", "5000"))
+
+# Campos que no se cambian con "actualizar"
+PROTEGIDOS = {"id", "fecha_actualizacion", "id_pme", "year"}
+
+_validadores: Dict[tuple, TypeAdapter] = {}
+
+
+def validar_campos(schema, datos: dict, protegidos: set) -> dict:
+    """Valida solo los campos enviados; el resto del documento no se toca."""
+    if not datos:
+        raise ValueError("Sin datos para actualizar")
+    limpios = {}
+    for campo, valor in datos.items():
+        if campo in protegidos or campo not in schema.model_fields:
+            raise ValueError(f"{campo}: campo no modificable")
+        clave = (schema.__name__, campo)
+        if clave not in _validadores:
+            _validadores[clave] = TypeAdapter(schema.model_fields[campo].annotation)
+        try:
+            limpios[campo] = _validadores[clave].validate_python(valor)
+        except ValidationError as e:
+            raise ValueError(f"{campo}: {e.errors()[0]['msg']}")
+    return limpios
+
+
+class _Lote:
+    """Escrituras de un bulk_write con el índice de la operación que las originó."""
+
+    def __init__(self, resultados: list):
+        self.resultados = resultados
+        self.escrituras = []
+        self.origen = []
+
+    def agregar(self, indice: int, escritura):
+        self.escrituras.append(escritura)
+        self.origen.append(indice)
+
+    async def escribir(self, col) -> set:
+        """Ejecuta el lote; devuelve los índices de operación que fallaron."""
+        if not self.escrituras:
+            return set()
+        try:
+            await col.bulk_write(self.escrituras, ordered=False)
+            return set()
+        except BulkWriteError as e:
+            fallidos = set()
+            for err in e.details.get("writeErrors", []):
+                i = self.origen[err["index"]]
+                self.resultados[i].update(ok=False, error=err.get("errmsg", "Error de escritura"))
+                fallidos.add(i)
+            return fallidos
+
+
+def _resultados(operaciones) -> list:
+    resultados, vistos = [], set()
+    for i, op in enumerate(operaciones):
+        resultados.append({"indice": i, "id": op.id, "op": op.op, "ok": True})
+        # En un bulk_write sin orden dos operaciones sobre el mismo documento no tienen orden definido
+        if op.id in vistos:
+            _fallar(resultados, i, "Operación repetida para el mismo id")
+        vistos.add(op.id)
+    return resultados
+
+
+def _fallar(resultados: list, i: int, error: str):
+    resultados[i].update(ok=False, error=error)
+
+
+def _respuesta(resultados: list, pmes: set) -> dict:
+    errores = sum(1 for r in resultados if not r["ok"])
+    return {"total": len(resultados), "ok": len(resultados) - errores, "errores": errores,
+            "pmes": sorted(p for p in pmes if p), "resultados": resultados}
+
+
+def _fuera_de_vista(docs: dict, info, id_pme) -> dict:
+    """Sin las versiones de la cadena de la instantánea que el PME reemplazó u ocultó."""
+    if info is None:
+        return docs
+    return {k: d for k, d in docs.items() if d.get("id_pme") == id_pme or d.get("id_pme") not in info["cadena"]}
+
+
+async def _congelar(bd, seccion: str, pendientes: list):
+    """Los años que heredan de los PME que se van a escribir se quedan con lo que veían."""
+    docs = [doc for _, doc, _ in pendientes] + [nuevo for _, doc, nuevo in pendientes
+                                                if nuevo is not None and nuevo.get("id_pme") != doc.get("id_pme")]
+    await instantaneas.congelar(bd, seccion, docs)
+
+
+async def _aplicar_efectos(bd, resumen, seccion: str, pendientes: list, fallidos: set, pmes: set):
+    """Resumen y marcas de eliminación de las operaciones que sí se escribieron."""
+    antes, despues, salieron = [], [], []
+    for i, doc, nuevo in pendientes:
+        if i in fallidos:
+            continue
+        antes.append(doc)
+        pmes.add(doc.get("id_pme"))
+        if nuevo is None or nuevo.get("id_pme") != doc.get("id_pme"):
+            salieron.append(doc)
+        if nuevo is not None:
+            despues.append(nuevo)
+            pmes.add(nuevo.get("id_pme"))
+    # Un solo update del resumen por PME (resta lo anterior y suma lo nuevo)
+    reemplazar = resumen.reemplazar_recursos if seccion == "recursos" else resumen.reemplazar_acciones
+    await reemplazar(antes, despues)
+    await cambios.registrar_eliminados(bd, seccion, salieron)
+    await instantaneas.ocultar(bd, seccion, salieron)
+
+
+def _accion_destino(op) -> Optional[str]:
+    """uuid_accion al que va el recurso: el de "mover" o el que trae "actualizar"."""
+    if op.op == "mover":
+        return op.uuid_accion
+    if op.op == "actualizar" and isinstance(op.datos.get("uuid_accion"), str):
+        return op.datos["uuid_accion"]
+    return None
+
+
+async def _padres(bd, destinos: set, pmes: set, info, id_pme) -> dict:
+    """{(id_pme, uuid_accion): acción} de las acciones destino, buscadas solo en los PME de los recursos."""
+    padres = {}
+    if not destinos:
+        return padres
+    proy = {"uuid_accion": 1, "id_pme": 1, "dimension": 1}
+    filtro = {"uuid_accion": {"$in": list(destinos)}}
+    if info is not None and id_pme in pmes:
+        # La acción destino puede ser heredada: se busca en la vista del PME
+        async for a in await instantaneas.vista(bd, "acciones", id_pme, filtro, proy, info=info):
+            padres[(a["id_pme"], a["uuid_accion"])] = a
+        pmes = pmes - {id_pme}
+    if pmes:
+        async for a in bd.acciones.find({**filtro, "id_pme": {"$in": list(pmes)}}, proy):
+            padres.setdefault((a.get("id_pme"), a["uuid_accion"]), a)
+    return padres
+
+
+async def editar_recursos(bd, resumen, schema, operaciones: list, id_pme: Optional[str] = None) -> dict:
+    resultados = _resultados(operaciones)
+    ids = {op.id for op in operaciones}
+    filtro = identificadores.filtro_ids(ids)
+    # En una instantánea, la vista trae en una consulta los propios y los heredados (ya materializados)
+    info, docs = await instantaneas.resolver_heredados(bd, "recursos", id_pme, filtro)
+    faltan = ids - set(docs)
+    if faltan:
+        fuera = identificadores.filtro_ids(faltan)
+        if info is not None:
+            # Fuera de la vista: nunca una versión de la cadena que el PME reemplazó u ocultó
+            fuera = {**fuera, "id_pme": {"$nin": info["cadena"]}}
+        async for d in bd.recursos.find(fuera):
+            docs[str(d["_id"])] = d
+
+    # Acción destino de cada "mover" (o "actualizar" con uuid_accion), buscada en el PME del recurso
+    destinos = {u for u in map(_accion_destino, operaciones) if u}
+    padres = await _padres(bd, destinos, {d.get("id_pme") for d in docs.values()}, info, id_pme)
+
+    ahora = datetime.now()
+    lote, pendientes = _Lote(resultados), []
+    for i, op in enumerate(operaciones):
+        doc = docs.get(op.id)
+        if not resultados[i]["ok"]:
+            continue
+        if doc is None:
+            _fallar(resultados, i, "Recurso no encontrado")
+            continue
+        if op.op == "eliminar":
+            lote.agregar(i, DeleteOne({"_id": doc["_id"]}))
+            pendientes.append((i, doc, None))
+            continue
+        if op.op == "mover":
+            datos = {"uuid_accion": op.uuid_accion}
+        else:
+            try:
+                datos = validar_campos(schema, op.datos, PROTEGIDOS)
+            except ValueError as e:
+                _fallar(resultados, i, str(e))
+                continue
+        if "uuid_accion" in datos:
+            # La dimensión del recurso es la de su acción: se recalcula al cambiar de acción
+            padre = padres.get((doc.get("id_pme"), datos["uuid_accion"]))
+            if padre is None:
+                _fallar(resultados, i, "La acción destino no existe en el PME del recurso")
+                continue
+            datos["dimension"] = padre.get("dimension")
+        datos["fecha_actualizacion"] = ahora
+        lote.agregar(i, UpdateOne({"_id": doc["_id"]}, {"$set": datos}))
+        pendientes.append((i, doc, {**doc, **datos}))
+
+    await _congelar(bd, "recursos", pendientes)
+    fallidos = await lote.escribir(bd.recursos)
+    pmes = set()
+    await _aplicar_efectos(bd, resumen, "recursos", pendientes, fallidos, pmes)
+    return _respuesta(resultados, pmes)
+
+
+async def editar_acciones(bd, resumen, schema, operaciones: list, id_pme: Optional[str] = None) -> dict:
+    resultados = _resultados(operaciones)
+    filtro = {"uuid_accion": {"$in": list({op.id for op in operaciones})}}
+    # Las copias quedan en el PME indicado y las encuentra la consulta siguiente
+    info, _ = await instantaneas.resolver_heredados(bd, "acciones", id_pme, filtro)
+    if id_pme:
+        # Solo las acciones que ve el PME indicado: las de la cadena ya se copiaron a él
+        filtro = {**filtro, "id_pme": {"$in": [id_pme] + (info["cadena"] if info else [])}}
+    docs, ambiguos = {}, {}
+    async for d in bd.acciones.find(filtro).sort("_id", 1):
+        docs.setdefault(d["uuid_accion"], d)
+        ambiguos.setdefault(d["uuid_accion"], set()).add(d.get("id_pme"))
+    docs = _fuera_de_vista(docs, info, id_pme)
+    # Sin id_pme, un uuid repetido en varios PME (copias por Excel) no se escribe en cualquiera
+    ambiguos = {u: len(p) for u, p in ambiguos.items() if not id_pme and len(p) > 1}
+
+    # Recursos que arrastran los "mover" y "eliminar" (mismo PME que su acción)
+    arrastran = [docs[op.id] for op in operaciones if op.op != "actualizar" and op.id in docs and op.id not in ambiguos]
+    recursos_de = {}
+    if arrastran and info is not None:
+        await instantaneas.resolver_heredados(bd, "recursos", id_pme, {"uuid_accion": {"$in": [a["uuid_accion"] for a in arrastran]}})
+    if arrastran:
+        claves = {(a.get("id_pme"), a["uuid_accion"]) for a in arrastran}
+        async for r in bd.recursos.find({"uuid_accion": {"$in": list({u for _, u in claves})}}):
+            if (r.get("id_pme"), r["uuid_accion"]) in claves:
+                recursos_de.setdefault((r.get("id_pme"), r["uuid_accion"]), []).append(r)
+
+    ahora = datetime.now()
+    lote, pendientes = _Lote(resultados), []
+    for i, op in enumerate(operaciones):
+        doc = docs.get(op.id)
+        if not resultados[i]["ok"]:
+            continue
+        if op.id in ambiguos:
+            _fallar(resultados, i, f"Está en {ambiguos[op.id]} PME distintos; indicar id_pme")
+            continue
+        if doc is None:
+            _fallar(resultados, i, "Acción no encontrada")
+            continue
+        if op.op == "eliminar":
+            lote.agregar(i, DeleteOne({"_id": doc["_id"]}))
+            pendientes.append((i, doc, None))
+            continue
+        if op.op == "mover":
+            if not op.id_pme:
+                _fallar(resultados, i, "Falta id_pme destino")
+                continue
+            datos = {"id_pme": op.id_pme}
+            if op.year is not None:
+                datos["year"] = op.year
+        else:
+            try:
+                datos = validar_campos(schema, op.datos, PROTEGIDOS | {"uuid_accion"})
+            except ValueError as e:
+                _fallar(resultados, i, str(e))
+                continue
+        datos["fecha_actualizacion"] = ahora
+        lote.agregar(i, UpdateOne({"_id": doc["_id"]}, {"$set": datos}))
+        pendientes.append((i, doc, {**doc, **datos}))
+
+    await _congelar(bd, "acciones", pendientes)
+    fallidos = await lote.escribir(bd.acciones)
+    pmes = set()
+    await _aplicar_efectos(bd, resumen, "acciones", pendientes, fallidos, pmes)
+
+    # Segundo bulk_write: los recursos siguen a su acción (solo si la acción se escribió)
+    lote_rec, pendientes_rec = _Lote(resultados), []
+    for i, doc, nuevo in pendientes:
+        if i in fallidos or (nuevo is not None and nuevo.get("id_pme") == doc.get("id_pme")):
+            continue
+        hijos = recursos_de.get((doc.get("id_pme"), doc["uuid_accion"]), [])
+        if not hijos:
+            continue
+        filtro = {"_id": {"$in": [r["_id"] for r in hijos]}}
+        if nuevo is None:
+            lote_rec.agregar(i, DeleteMany(filtro))
+            pendientes_rec += [(i, r, None) for r in hijos]
+        else:
+            mover = {"id_pme": nuevo["id_pme"], "year": nuevo.get("year"), "fecha_actualizacion": ahora}
+            lote_rec.agregar(i, UpdateMany(filtro, {"$set": mover}))
+            pendientes_rec += [(i, r, {**r, **mover}) for r in hijos]
+    await _congelar(bd, "recursos", pendientes_rec)
+    fallidos_rec = await lote_rec.escribir(bd.recursos)
+    await _aplicar_efectos(bd, resumen, "recursos", pendientes_rec, fallidos_rec, pmes)
+    return _respuesta(resultados, pmes)
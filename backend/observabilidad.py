@@ -0,0 +1,369 @@
+import contextvars
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from pymongo import monitoring
+
+# ==========================================
+# OBSERVABILIDAD: LOGS, MÉTRICAS Y COMANDOS MONGO
+# ==========================================
+# - Logging estructurado (una línea JSON por evento) con nivel y el id
+#   del request en curso; el id llega en X-Request-ID o se genera, y se
+#   devuelve en la respuesta.
+# - MiddlewareMetricas: latencia (histograma) y conteo por ruta y status.
+#   La ruta es la plantilla ("/api/acciones/{id_pme}"), no la URL, para no
+#   crear una serie por cada id.
+# - EscuchaComandos: duración de cada comando de Mongo por colección y
+#   comando; los que superan MONGO_LENTO_MS se registran (WARNING) con la
+#   forma de su filtro (valores reemplazados por 1) y el request que los hizo.
+# - REGISTRO.exponer(): formato de texto de Prometheus para /metrics.
+#
+# Las métricas son del proceso: con varios workers cada uno expone las
+# suyas (Prometheus las suma por instancia).
+#
+#   LOG_NIVEL        DEBUG, INFO (defecto), WARNING, ERROR
+#   LOG_FORMATO      json (defecto) o texto (desarrollo)
+#   MONGO_LENTO_MS   umbral de comando lento (100)
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json")
+MONGO_LENTO_MS = float(os.getenv("MONGO_LENTO_MS", "100"))
+MAX_LENTOS = 200
+# Sondas y scraping: se registran en DEBUG para no llenar el log
+RUTAS_SILENCIOSAS = {"/healthz", "/readyz", "/metrics"}
+
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_MONGO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+log_http = logging.getLogger("pme.http")
+log_mongo = logging.getLogger("pme.mongo")
+
+
+# ==========================================
+# LOGGING
+# ==========================================
+
+# Atributos propios de LogRecord; el resto viene de `extra=` y va como campo
+_ATRIBUTOS_RECORD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "color_message"}
+
+
+def _campos_extra(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _ATRIBUTOS_RECORD}
+
+
+class FiltroRequestId(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        evento = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.request_id:
+            evento["request_id"] = record.request_id
+        evento.update(_campos_extra(record))
+        if record.exc_info:
+            evento["error"] = self.formatException(record.exc_info)
+        return orjson.dumps(evento, default=str).decode()
+
+
+class FormatoTexto(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        linea = super().format(record)
+        extra = _campos_extra(record)
+        return f"{linea} {extra}" if extra else linea
+
+
+def configurar_logging(nivel: str = LOG_NIVEL, formato: str = LOG_FORMATO):
+    """Handler único en stderr para la app y uvicorn (idempotente)."""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(FiltroRequestId())
+    handler.setFormatter(FormatoJSON() if formato == "json" else FormatoTexto())
+
+    raiz = logging.getLogger()
+    for h in list(raiz.handlers):
+        raiz.removeHandler(h)
+    raiz.addHandler(handler)
+    raiz.setLevel(nivel)
+    # uvicorn trae sus propios handlers; se unifican con el formato de la app.
+    # El acceso lo registra MiddlewareMetricas (con request id y latencia).
+    for nombre in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(nombre).handlers = []
+        logging.getLogger(nombre).propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+
+# ==========================================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# ==========================================
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: Tuple[str, ...], valores: Tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador por combinación de etiquetas.
+
+    Con `funcion` los valores se leen al exponer ({(etiquetas...): valor}),
+    p.ej. de las estadísticas de la caché.
+    """
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 funcion: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self.funcion = funcion
+        self._valores: Dict[Tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *valores, cantidad: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def muestras(self) -> Iterable[str]:
+        valores_actuales = self.funcion() if self.funcion is not None else dict(self._valores)
+        for valores, n in sorted(valores_actuales.items()):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(n)}"
+
+
+class Medidor(Contador):
+    """Valor que sube y baja (inc con cantidad negativa) o se calcula con `funcion`."""
+    tipo = "gauge"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS_HTTP):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # valores de etiquetas -> [conteos por bucket (no acumulados), suma, total]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = Lock()
+
+    def observar(self, valor: float, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def muestras(self) -> Iterable[str]:
+        with self._lock:
+            series = [(v, (list(c), s, t)) for v, (c, s, t) in self._series.items()]
+        for valores, (conteos, suma, total) in sorted(series):
+            acumulado = 0
+            for limite, n in zip(self.buckets, conteos):
+                acumulado += n
+                le = 'le="' + _numero(limite) + '"'
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(suma)}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {total}"
+
+
+class Registro:
+    def __init__(self):
+        self._metricas: List = []
+
+    def agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def exponer(self) -> str:
+        lineas = []
+        for m in self._metricas:
+            lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+            lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+            lineas.extend(m.muestras())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_PETICIONES = REGISTRO.agregar(Contador(
+    "pme_http_peticiones_total", "Peticiones HTTP por ruta y status", ("metodo", "ruta", "status")))
+HTTP_DURACION = REGISTRO.agregar(Histograma(
+    "pme_http_duracion_segundos", "Latencia de las peticiones HTTP", ("metodo", "ruta")))
+HTTP_EN_CURSO = REGISTRO.agregar(Medidor(
+    "pme_http_en_curso", "Peticiones HTTP en curso"))
+MONGO_COMANDOS = REGISTRO.agregar(Contador(
+    "pme_mongo_comandos_total", "Comandos enviados a MongoDB", ("coleccion", "comando", "resultado")))
+MONGO_DURACION = REGISTRO.agregar(Histograma(
+    "pme_mongo_duracion_segundos", "Duración de los comandos de MongoDB", ("coleccion", "comando"), BUCKETS_MONGO))
+MONGO_LENTOS = REGISTRO.agregar(Contador(
+    "pme_mongo_comandos_lentos_total", "Comandos de MongoDB sobre el umbral MONGO_LENTO_MS", ("coleccion", "comando")))
+
+
+# ==========================================
+# MIDDLEWARE HTTP (ASGI)
+# ==========================================
+
+def _ruta(scope) -> str:
+    route = scope.get("route")
+    # Sin ruta (404) se agrupa todo en una sola serie
+    return getattr(route, "path", None) or "sin_ruta"
+
+
+class MiddlewareMetricas:
+    """Latencia y status por ruta, id de request (X-Request-ID) y log de acceso."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        entrante = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        rid = entrante if re.fullmatch(r"[\w\-.]{1,64}", entrante) else uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = 500
+        t0 = time.perf_counter()
+        HTTP_EN_CURSO.inc(cantidad=1)
+
+        async def enviar(mensaje):
+            nonlocal status
+            if mensaje["type"] == "http.response.start":
+                status = mensaje["status"]
+                mensaje.setdefault("headers", [])
+                mensaje["headers"] = list(mensaje["headers"]) + [(b"x-request-id", rid.encode())]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        except Exception:
+            log_http.exception("Error no controlado", extra={"metodo": scope["method"], "url": scope["path"]})
+            raise
+        finally:
+            segundos = time.perf_counter() - t0
+            HTTP_EN_CURSO.inc(cantidad=-1)
+            ruta = _ruta(scope)
+            HTTP_PETICIONES.inc(scope["method"], ruta, str(status))
+            HTTP_DURACION.observar(segundos, scope["method"], ruta)
+            if ruta in RUTAS_SILENCIOSAS:
+                nivel = logging.DEBUG
+            else:
+                nivel = logging.ERROR if status >= 500 else logging.INFO
+            log_http.log(nivel, "%s %s %s", scope["method"], scope["path"], status,
+                    extra={"ruta": ruta, "status": status, "ms": round(segundos * 1000, 2)})
+            request_id.reset(token)
+
+
+# ==========================================
+# COMANDOS DE MONGO (CommandListener)
+# ==========================================
+
+# Comandos cuyo valor es el nombre de la colección
+_CON_COLECCION = {"find", "aggregate", "insert", "update", "delete", "findAndModify", "count",
+                  "distinct", "createIndexes", "listIndexes", "drop"}
+_IGNORADOS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+
+
+def forma_filtro(valor):
+    """Estructura del filtro sin valores: {"id_pme": 1, "monto": {"$gte": 1}}."""
+    if isinstance(valor, dict):
+        return {k: forma_filtro(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        # $and/$or conservan cada rama; $in y similares se reducen a un valor
+        return [forma_filtro(v) for v in valor] if valor and isinstance(valor[0], dict) else [1]
+    return 1
+
+
+def _filtro_de(nombre: str, comando) -> Optional[dict]:
+    if nombre in ("find", "count", "distinct"):
+        return comando.get("filter", comando.get("query"))
+    if nombre == "findAndModify":
+        return comando.get("query")
+    if nombre == "aggregate":
+        etapas = comando.get("pipeline") or []
+        return etapas[0].get("$match") if etapas and "$match" in etapas[0] else None
+    if nombre in ("update", "delete"):
+        ops = comando.get("updates" if nombre == "update" else "deletes") or []
+        return ops[0].get("q") if ops else None
+    return None
+
+
+class EscuchaComandos(monitoring.CommandListener):
+    def __init__(self, umbral_ms: float = MONGO_LENTO_MS):
+        self.umbral_ms = umbral_ms
+        self._pendientes: Dict[Tuple, Tuple[str, Optional[dict]]] = {}
+        self.lentos: deque = deque(maxlen=MAX_LENTOS)
+
+    def started(self, event):
+        if event.command_name in _IGNORADOS:
+            return
+        comando = event.command
+        if event.command_name in _CON_COLECCION:
+            coleccion = comando.get(event.command_name)
+        else:
+            coleccion = comando.get("collection")  # getMore
+        coleccion = coleccion if isinstance(coleccion, str) else "-"
+        self._pendientes[(event.connection_id, event.request_id)] = (coleccion, _filtro_de(event.command_name, comando))
+
+    def _terminar(self, event, resultado: str):
+        pendiente = self._pendientes.pop((event.connection_id, event.request_id), None)
+        if pendiente is None:
+            return
+        coleccion, filtro = pendiente
+        segundos = event.duration_micros / 1e6
+        MONGO_COMANDOS.inc(coleccion, event.command_name, resultado)
+        MONGO_DURACION.observar(segundos, coleccion, event.command_name)
+
+        ms = segundos * 1000
+        if ms >= self.umbral_ms:
+            MONGO_LENTOS.inc(coleccion, event.command_name)
+            lento = {
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "coleccion": coleccion,
+                "comando": event.command_name,
+                "ms": round(ms, 1),
+                "forma": forma_filtro(filtro) if filtro is not None else None,
+                "request_id": request_id.get(),
+            }
+            self.lentos.append(lento)
+            log_mongo.warning("Comando Mongo lento", extra={k: v for k, v in lento.items() if k not in ("fecha", "request_id")})
+
+    def succeeded(self, event):
+        self._terminar(event, "ok")
+
+    def failed(self, event):
+        self._terminar(event, "error")
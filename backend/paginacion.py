@@ -0,0 +1,162 @@
+import base64
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId, json_util
+
+# ==========================================
+# PAGINACIÓN POR CURSOR (KEYSET)
+# ==========================================
+# Las páginas se piden "después de" la última fila vista, ordenando por
+# (campo, _id). El cursor es opaco para el cliente: guarda el valor del
+# campo y el _id de esa fila en Extended JSON, así se conservan los
+# tipos (ObjectId vs string, fechas).
+#
+# MongoDB solo compara valores del mismo tipo ($gt: "abc" no trae
+# ObjectIds), y en la BD conviven _id string y ObjectId, además de
+# campos opcionales en null. Por eso la condición "después de" agrega
+# explícitamente los tipos que van antes/después en el orden BSON.
+
+LIMITE_DEFECTO = 100
+LIMITE_MAXIMO = 500
+
+# Orden BSON de los tipos presentes en nuestras colecciones
+_ORDEN_TIPOS = ["null", "number", "string", "objectId", "date"]
+
+ORDEN_ACCIONES = {"_id", "nombre_accion", "dimension", "monto_total", "monto_sep", "fecha_actualizacion"}
+ORDEN_RECURSOS = {"_id", "nombre_actividad", "monto", "fecha"}
+
+CAMPOS_ACCIONES = {
+    "uuid_accion", "id_pme", "year", "nombre_accion", "descripcion", "dimension", "subdimensiones",
+    "objetivo_estrategico", "estrategia", "planes", "responsable", "recursos_necesarios_ejecucion",
+    "medios_verificacion", "monto_sep", "monto_total", "fecha_actualizacion",
+}
+CAMPOS_RECURSOS = {
+    "id_pme", "uuid_accion", "dimension", "subdimension", "nombre_actividad", "descripcion_actividad",
+    "medios_ver", "responsable", "recursos_actividad", "monto", "year", "fecha",
+}
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _tipo_bson(valor) -> str:
+    if valor is None:
+        return "null"
+    if isinstance(valor, bool):
+        raise CursorInvalido("Tipo no soportado en cursor")
+    if isinstance(valor, (int, float)):
+        return "number"
+    if isinstance(valor, str):
+        return "string"
+    if isinstance(valor, ObjectId):
+        return "objectId"
+    if isinstance(valor, datetime):
+        return "date"
+    raise CursorInvalido("Tipo no soportado en cursor")
+
+
+def _despues_de(campo: str, valor, ascendente: bool) -> Optional[dict]:
+    """Filtro de los valores de `campo` que van estrictamente después de `valor`.
+
+    Devuelve None si no hay ninguno.
+    """
+    pos = _ORDEN_TIPOS.index(_tipo_bson(valor))
+    otros_tipos = _ORDEN_TIPOS[pos + 1:] if ascendente else _ORDEN_TIPOS[:pos]
+
+    condiciones = []
+    if valor is not None:
+        condiciones.append({campo: {"$gt" if ascendente else "$lt": valor}})
+    if "null" in otros_tipos:
+        # {campo: None} también cubre documentos sin el campo
+        condiciones.append({campo: None})
+        otros_tipos = [t for t in otros_tipos if t != "null"]
+    condiciones.extend({campo: {"$type": t}} for t in otros_tipos)
+
+    if not condiciones:
+        return None
+    return condiciones[0] if len(condiciones) == 1 else {"$or": condiciones}
+
+
+def codificar_cursor(doc: dict, campo: str) -> str:
+    estado = {"v": doc.get(campo), "id": doc["_id"]}
+    return base64.urlsafe_b64encode(json_util.dumps(estado).encode()).decode()
+
+
+def decodificar_cursor(cursor: str) -> dict:
+    try:
+        estado = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+        _tipo_bson(estado["v"])
+        _tipo_bson(estado["id"])
+        return estado
+    except CursorInvalido:
+        raise
+    except Exception:
+        raise CursorInvalido("Cursor inválido")
+
+
+def condicion_keyset(cursor: str, campo: str, ascendente: bool) -> dict:
+    estado = decodificar_cursor(cursor)
+    despues_id = _despues_de("_id", estado["id"], ascendente)
+    if campo == "_id":
+        return despues_id or {"_id": {"$in": []}}
+
+    opciones = []
+    despues_valor = _despues_de(campo, estado["v"], ascendente)
+    if despues_valor:
+        opciones.append(despues_valor)
+    if despues_id:
+        opciones.append({"$and": [{campo: estado["v"]}, despues_id]})
+    return {"$or": opciones} if opciones else {"_id": {"$in": []}}
+
+
+def proyeccion(fields: Optional[str], permitidos: set, obligatorios: List[str]) -> Optional[dict]:
+    """Convierte `fields=a,b,c` en una proyección. None = documento completo."""
+    if not fields:
+        return None
+    pedidos = [f.strip() for f in fields.split(",") if f.strip()]
+    desconocidos = [f for f in pedidos if f not in permitidos]
+    if desconocidos:
+        raise ValueError(f"Campos no permitidos: {', '.join(desconocidos)}")
+    return {f: 1 for f in pedidos + obligatorios}
+
+
+async def paginar(col, filtro: dict, orden: str, ascendente: bool, limite: int,
+            cursor: Optional[str] = None, proy: Optional[dict] = None, etapas: Optional[list] = None) -> dict:
+    """Ejecuta una página keyset y arma la respuesta {items, cursor_siguiente}.
+
+    Con `etapas` (vista de una instantánea, ver instantaneas.py) la página se
+    arma con una agregación sobre esa vista en vez de un find.
+    """
+    if cursor:
+        filtro = {"$and": [filtro, condicion_keyset(cursor, orden, ascendente)]}
+
+    direccion = 1 if ascendente else -1
+    sort = [("_id", direccion)] if orden == "_id" else [(orden, direccion), ("_id", direccion)]
+    if proy is not None:
+        proy = {**proy, orden: 1}
+
+    # Pedimos una fila extra para saber si existe otra página
+    if etapas is None:
+        docs = await col.find(filtro, proy).sort(sort).limit(limite + 1).to_list()
+    else:
+        pipeline = etapas + [{"$match": filtro}, {"$sort": dict(sort)}, {"$limit": limite + 1}]
+        if proy is not None:
+            pipeline.append({"$project": proy})
+        docs = await (await col.aggregate(pipeline)).to_list()
+    hay_mas = len(docs) > limite
+    docs = docs[:limite]
+
+    siguiente = codificar_cursor(docs[-1], orden) if hay_mas else None
+    # Los _id (ObjectId o string) se convierten al serializar (serializacion.py)
+    return {"items": docs, "cursor_siguiente": siguiente, "limite": limite}
+
+
+def filtro_monto(campo: str, monto_min: Optional[int], monto_max: Optional[int]) -> dict:
+    rango = {}
+    if monto_min is not None:
+        rango["$gte"] = monto_min
+    if monto_max is not None:
+        rango["$lte"] = monto_max
+    return {campo: rango} if rango else {}
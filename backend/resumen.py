@@ -0,0 +1,233 @@
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+import instantaneas
+
+# ==========================================
+# RESUMEN PRESUPUESTARIO MATERIALIZADO (pme_resumen)
+# ==========================================
+# Un documento por PME (_id = id_pme) con los montos agrupados por
+# uuid_accion:
+#
+#   acciones.<uuid>: {dimension, monto_sep, monto_total, n}
+#   recursos.<uuid>: {monto, n}
+#
+# Los endpoints de escritura lo mantienen con $inc. Guardar los recursos
+# por uuid (y no por acción existente) permite calcular los huérfanos al
+# leer, sin rastrear cuándo un recurso pierde o gana a su acción padre.
+#
+# Un documento sin "reconstruido" fue creado solo por incrementos (PME
+# con datos anteriores al resumen): se recalcula completo al leerlo.
+# Una instantánea (ver instantaneas.py) nace sin resumen y se calcula
+# sobre su vista la primera vez que se lee.
+#
+# Cada escritura sella `fecha_actualizacion`: el consolidado del
+# sostenedor (rollups.py) recalcula solo los PME cuyo resumen cambió.
+#
+#   python resumen.py reconstruir [id_pme]
+
+
+def _agrupar(docs: Iterable[dict], campos: list) -> dict:
+    """{id_pme: {uuid: {campo: suma, "n": cantidad}}}"""
+    grupos = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    for d in docs:
+        bucket = grupos[d.get("id_pme")][d.get("uuid_accion")]
+        for campo in campos:
+            bucket[campo] += d.get(campo) or 0
+        bucket["n"] += 1
+    return grupos
+
+
+class ResumenPME:
+    def __init__(self, bd):
+        self.bd = bd
+
+    # --- Mantenimiento incremental ---
+
+    async def _incrementar(self, seccion: str, campos: list, *partes: Tuple[Iterable[dict], int]):
+        """Aplica cada (docs, signo) de `partes` con un solo update por PME."""
+        incs = defaultdict(lambda: defaultdict(int))
+        dims = defaultdict(dict)
+        for docs, signo in partes:
+            docs = list(docs)
+            for id_pme, por_uuid in _agrupar(docs, campos).items():
+                for uuid_accion, bucket in por_uuid.items():
+                    for campo, valor in bucket.items():
+                        incs[id_pme][f"{seccion}.{uuid_accion}.{campo}"] += signo * valor
+            if seccion == "acciones" and signo > 0:
+                for d in docs:
+                    dims[d.get("id_pme")][f"acciones.{d.get('uuid_accion')}.dimension"] = d.get("dimension")
+        for id_pme in set(incs) | set(dims):
+            if id_pme is None:
+                continue
+            inc = {k: v for k, v in incs[id_pme].items() if v}
+            if not inc and not dims[id_pme]:
+                continue
+            cambio = {"$set": {**dims[id_pme], "fecha_actualizacion": datetime.now()}}
+            if inc:
+                cambio["$inc"] = inc
+            await self.bd.resumen.update_one({"_id": id_pme}, cambio, upsert=True)
+
+    async def sumar_recursos(self, docs: Iterable[dict], signo: int = 1):
+        await self._incrementar("recursos", ["monto"], (docs, signo))
+
+    async def sumar_acciones(self, docs: Iterable[dict], signo: int = 1):
+        await self._incrementar("acciones", ["monto_sep", "monto_total"], (docs, signo))
+
+    async def reemplazar_recursos(self, antes: Iterable[dict], despues: Iterable[dict]):
+        """Resta `antes` y suma `despues` en un solo update por PME."""
+        await self._incrementar("recursos", ["monto"], (antes, -1), (despues, 1))
+
+    async def reemplazar_acciones(self, antes: Iterable[dict], despues: Iterable[dict]):
+        await self._incrementar("acciones", ["monto_sep", "monto_total"], (antes, -1), (despues, 1))
+
+    async def reemplazar_recurso(self, antes: Optional[dict], despues: Optional[dict]):
+        """Aplica el cambio de un recurso (antes/después de un update, o None)."""
+        await self.reemplazar_recursos([antes] if antes else [], [despues] if despues else [])
+
+    async def reemplazar_accion(self, antes: Optional[dict], despues: Optional[dict]):
+        await self.reemplazar_acciones([antes] if antes else [], [despues] if despues else [])
+
+    async def quitar_recursos_de_uuid(self, uuid_accion: str, ids_pme: list):
+        """Los recursos de `uuid_accion` se borraron completos en esos PME."""
+        if ids_pme:
+            await self.bd.resumen.update_many({"_id": {"$in": ids_pme}}, {"$unset": {f"recursos.{uuid_accion}": ""},
+                                                                         "$set": {"fecha_actualizacion": datetime.now()}})
+
+    async def eliminar(self, id_pme: str):
+        await self.bd.resumen.delete_one({"_id": id_pme})
+
+    # --- Reconstrucción ---
+
+    def _pipeline_acciones(self, origen: list) -> list:
+        return origen + [
+            {"$group": {
+                "_id": {"p": "$id_pme", "u": "$uuid_accion"},
+                "dimension": {"$first": "$dimension"},
+                "monto_sep": {"$sum": "$monto_sep"},
+                "monto_total": {"$sum": "$monto_total"},
+                "n": {"$sum": 1},
+            }},
+        ]
+
+    def _pipeline_recursos(self, origen: list) -> list:
+        return origen + [
+            {"$group": {"_id": {"p": "$id_pme", "u": "$uuid_accion"}, "monto": {"$sum": "$monto"}, "n": {"$sum": 1}}},
+        ]
+
+    async def reconstruir(self, id_pme: str) -> dict:
+        """Recalcula el resumen de un PME desde acciones y recursos (su vista, si es una instantánea)."""
+        info = await instantaneas.cadena(self.bd, id_pme)
+
+        def origen(coleccion: str) -> list:
+            return instantaneas.etapas(info, coleccion) if info else [{"$match": {"id_pme": id_pme}}]
+
+        acciones = {
+            g["_id"]["u"]: {k: g[k] for k in ("dimension", "monto_sep", "monto_total", "n")}
+            async for g in await self.bd.acciones.aggregate(self._pipeline_acciones(origen("acciones")))
+        }
+        recursos = {
+            g["_id"]["u"]: {"monto": g["monto"], "n": g["n"]}
+            async for g in await self.bd.recursos.aggregate(self._pipeline_recursos(origen("recursos")))
+        }
+        ahora = datetime.now()
+        doc = {"_id": id_pme, "acciones": acciones, "recursos": recursos, "reconstruido": ahora, "fecha_actualizacion": ahora}
+        await self.bd.resumen.replace_one({"_id": id_pme}, doc, upsert=True)
+        return doc
+
+    async def reconstruir_todo(self):
+        """Recalcula todos los resúmenes en el servidor con $merge."""
+        ahora = datetime.now()
+        await self.bd.resumen.update_many({}, {"$set": {"acciones": {}, "recursos": {}, "reconstruido": ahora,
+                                                        "fecha_actualizacion": ahora}})
+        por_pme = [
+            {"$group": {"_id": "$_id.p", "items": {"$push": {"k": "$_id.u", "v": "$$ROOT"}}}},
+            {"$project": {"items": {"$map": {
+                "input": "$items", "as": "i",
+                "in": {"k": "$$i.k", "v": {"$unsetField": {"field": "_id", "input": "$$i.v"}}},
+            }}}},
+        ]
+        for col, seccion, pipeline in (
+            (self.bd.acciones, "acciones", self._pipeline_acciones([])),
+            (self.bd.recursos, "recursos", self._pipeline_recursos([])),
+        ):
+            # $merge no devuelve documentos; basta con consumir el cursor
+            cursor = await col.aggregate(pipeline + por_pme + [
+                {"$project": {seccion: {"$arrayToObject": "$items"}, "reconstruido": ahora, "fecha_actualizacion": ahora}},
+                {"$merge": {"into": self.bd.resumen.name, "whenMatched": "merge", "whenNotMatched": "insert"}},
+            ])
+            await cursor.to_list()
+        # El $merge agrupó solo lo propio de cada PME: las instantáneas van sobre su vista
+        async for pme in self.bd.pme.find({"bases.0": {"$exists": True}}, {"_id": 1}):
+            await self.reconstruir(str(pme["_id"]))
+
+    # --- Lectura ---
+
+    async def leer(self, id_pme: str) -> dict:
+        doc = await self.bd.resumen.find_one({"_id": id_pme})
+        if not doc or "reconstruido" not in doc:
+            doc = await self.reconstruir(id_pme)
+
+        acciones = {u: a for u, a in doc.get("acciones", {}).items() if a.get("n", 0) > 0}
+        recursos = {u: r for u, r in doc.get("recursos", {}).items() if r.get("n", 0) > 0}
+
+        por_accion = []
+        dimensiones = defaultdict(lambda: {"monto_recursos": 0, "monto_sep": 0, "monto_total": 0, "n_acciones": 0})
+        for uuid_accion, a in acciones.items():
+            rec = recursos.get(uuid_accion, {})
+            monto_rec = rec.get("monto", 0)
+            por_accion.append({
+                "uuid_accion": uuid_accion,
+                "dimension": a.get("dimension"),
+                "monto_sep": a.get("monto_sep", 0),
+                "monto_total": a.get("monto_total", 0),
+                "monto_recursos": monto_rec,
+                "n_recursos": rec.get("n", 0),
+                "saldo_sep": a.get("monto_sep", 0) - monto_rec,
+                "saldo_total": a.get("monto_total", 0) - monto_rec,
+            })
+            dim = dimensiones[a.get("dimension") or ""]
+            dim["monto_recursos"] += monto_rec
+            dim["monto_sep"] += a.get("monto_sep", 0)
+            dim["monto_total"] += a.get("monto_total", 0)
+            dim["n_acciones"] += a.get("n", 0)
+
+        huerfanos = [r for u, r in recursos.items() if u not in acciones]
+        return {
+            "id_pme": id_pme,
+            "monto_recursos": sum(r.get("monto", 0) for r in recursos.values()),
+            "n_recursos": sum(r["n"] for r in recursos.values()),
+            "monto_sep": sum(a.get("monto_sep", 0) for a in acciones.values()),
+            "monto_total": sum(a.get("monto_total", 0) for a in acciones.values()),
+            "huerfanos": {"n": sum(r["n"] for r in huerfanos), "monto": sum(r.get("monto", 0) for r in huerfanos)},
+            "dimensiones": [{"dimension": k, **v} for k, v in sorted(dimensiones.items())],
+            "acciones": por_accion,
+            "reconstruido": doc.get("reconstruido"),
+        }
+
+
+async def _main(id_pme: Optional[str] = None):
+    from database import BaseDatos
+
+    bd = BaseDatos()
+    bd.conectar()
+    try:
+        resumen = ResumenPME(bd)
+        if id_pme:
+            await resumen.reconstruir(id_pme)
+        else:
+            await resumen.reconstruir_todo()
+    finally:
+        await bd.cerrar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "reconstruir":
+        print("Uso: python resumen.py reconstruir [id_pme]")
+        sys.exit(2)
+
+    asyncio.run(_main(sys.argv[2] if len(sys.argv) > 2 else None))
+    print("✅ Resumen reconstruido")
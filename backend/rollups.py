@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+import identificadores
+from exportacion import titulo_hoja
+
+# ==========================================
+# CONSOLIDADO DEL SOSTENEDOR (rollups)
+# ==========================================
+# Comparar presupuestos entre colegios y años pedía leer los recursos de
+# cada PME. La colección "rollups" guarda un documento por
+# (id_colegio, year, dimension) con los montos SEP y total planificados,
+# lo ejecutado (recursos de sus acciones) y los conteos. Se calcula en
+# el servidor desde pme_resumen (ver resumen.py) con un $merge sobre esa
+# clave, que tiene índice único (ver indices.py).
+#
+# Cada pasada recalcula solo los PME cuyo resumen cambió desde la marca
+# anterior (guardada en configuracion, _id "rollups"), con un margen para
+# las escrituras que estaban en curso. Las filas de esos PME que el
+# $merge no tocó (una dimensión que quedó sin acciones) se borran por su
+# fecha_actualizacion. Los PME sin resumen completo se calculan antes:
+# en una pasada incremental solo se miran los resúmenes sin
+# "reconstruido" que cambiaron y los PME creados desde la marca (por la
+# fecha de su ObjectId); la pasada completa revisa todos.
+#
+# Las consultas (GET /api/rollups y /exportar) solo leen. Cada proceso
+# corre una tarea en segundo plano que cada ROLLUPS_INTERVALO_SEGUNDOS
+# intenta tomar el turno (campo `turno` en configuracion, update
+# condicional): de todos los workers, solo uno refresca en cada
+# intervalo. POST /api/rollups/refrescar fuerza una pasada y ?todo=true
+# la hace completa.
+#
+# Los recursos huérfanos (sin acción) no tienen dimensión y no se suman;
+# ver /api/pme/{id}/resumen.
+#
+#   ROLLUPS_INTERVALO_SEGUNDOS   pasada en segundo plano (30; 0 = solo POST /api/rollups/refrescar)
+#   ROLLUPS_CONCURRENCIA         consultas por colegio en paralelo al exportar (8)
+#
+#   python rollups.py refrescar [--todo]
+
+log = logging.getLogger("pme.rollups")
+
+INTERVALO = float(os.getenv("ROLLUPS_INTERVALO_SEGUNDOS", "30"))
+CONCURRENCIA = int(os.getenv("ROLLUPS_CONCURRENCIA", "8"))
+CLAVE = "rollups"
+# Escrituras del resumen selladas antes de la marca pero confirmadas después
+MARGEN = timedelta(seconds=5)
+SIN_DIMENSION = "Sin dimensión"
+MONTOS = ("monto_sep", "monto_total", "monto_recursos", "n_acciones", "n_recursos")
+
+
+def pipeline(filtro: dict, sello: datetime, destino: str = "rollups", resumen: str = "pme_resumen") -> list:
+    """Totales por (colegio, año, dimensión) de los PME de `filtro`, escritos con $merge."""
+    return [
+        {"$match": filtro},
+        {"$project": {"id_colegio": 1, "year": 1, "id_pme": {"$toString": "$_id"}}},
+        {"$lookup": {"from": resumen, "localField": "id_pme", "foreignField": "_id", "as": "r"}},
+        {"$unwind": "$r"},
+        {"$project": {"id_colegio": 1, "year": 1, "id_pme": 1,
+                      "acciones": {"$objectToArray": {"$ifNull": ["$r.acciones", {}]}},
+                      "recursos": {"$objectToArray": {"$ifNull": ["$r.recursos", {}]}}}},
+        {"$unwind": "$acciones"},
+        {"$match": {"acciones.v.n": {"$gt": 0}}},
+        {"$project": {
+            "id_colegio": 1, "year": 1, "id_pme": 1,
+            "dimension": {"$ifNull": ["$acciones.v.dimension", SIN_DIMENSION]},
+            "monto_sep": {"$ifNull": ["$acciones.v.monto_sep", 0]},
+            "monto_total": {"$ifNull": ["$acciones.v.monto_total", 0]},
+            "n_acciones": "$acciones.v.n",
+            # Los recursos de la acción (mismo uuid_accion)
+            "recurso": {"$arrayElemAt": [{"$filter": {
+                "input": "$recursos", "as": "rec", "cond": {"$eq": ["$$rec.k", "$acciones.k"]},
+            }}, 0]},
+        }},
+        {"$group": {
+            "_id": {"id_colegio": "$id_colegio", "year": "$year", "dimension": "$dimension"},
+            "id_pme": {"$first": "$id_pme"},
+            "monto_sep": {"$sum": "$monto_sep"},
+            "monto_total": {"$sum": "$monto_total"},
+            "monto_recursos": {"$sum": {"$ifNull": ["$recurso.v.monto", 0]}},
+            "n_acciones": {"$sum": "$n_acciones"},
+            "n_recursos": {"$sum": {"$ifNull": ["$recurso.v.n", 0]}},
+        }},
+        {"$project": {"_id": 0, "id_colegio": "$_id.id_colegio", "year": "$_id.year", "dimension": "$_id.dimension",
+                      "id_pme": 1, **{m: 1 for m in MONTOS}, "fecha_actualizacion": {"$literal": sello}}},
+        {"$merge": {"into": destino, "on": ["id_colegio", "year", "dimension"],
+                    "whenMatched": "merge", "whenNotMatched": "insert"}},
+    ]
+
+
+def _indicadores(fila: dict) -> dict:
+    """Saldos y porcentaje ejecutado sobre lo planificado SEP."""
+    fila["saldo_sep"] = fila["monto_sep"] - fila["monto_recursos"]
+    fila["saldo_total"] = fila["monto_total"] - fila["monto_recursos"]
+    fila["ejecucion_pct"] = round(100 * fila["monto_recursos"] / fila["monto_sep"], 1) if fila["monto_sep"] else None
+    return fila
+
+
+def _totalizar(filas: Iterable[dict], claves: tuple) -> List[dict]:
+    grupos: Dict[tuple, dict] = defaultdict(lambda: dict.fromkeys(MONTOS, 0))
+    for f in filas:
+        g = grupos[tuple(f.get(c) for c in claves)]
+        for m in MONTOS:
+            g[m] += f.get(m) or 0
+    return [_indicadores({**dict(zip(claves, k)), **v}) for k, v in sorted(grupos.items(), key=lambda i: str(i[0]))]
+
+
+class Rollups:
+    def __init__(self, bd, resumen, intervalo: float = INTERVALO):
+        self.bd = bd
+        self.resumen = resumen
+        self.intervalo = intervalo
+        # Se crean en el loop que los usa (ver ColaTrabajos.iniciar)
+        self._lock: Optional[asyncio.Lock] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    @property
+    def _config(self):
+        return self.bd.db["configuracion"]
+
+    # --- Refresco ---
+
+    async def _completar_resumenes(self, desde: Optional[datetime]) -> int:
+        """Los PME sin resumen completo (instantáneas sin leer, datos anteriores al resumen) se calculan antes.
+
+        Con `desde` solo se revisan los PME creados después y los resúmenes
+        incompletos que cambiaron; sin él, todos.
+        """
+        if desde is None:
+            listos = set(await self.bd.resumen.distinct("_id", {"reconstruido": {"$exists": True}}))
+            faltan = [str(p["_id"]) async for p in self.bd.pme.find({}, {"_id": 1}) if str(p["_id"]) not in listos]
+        else:
+            nuevos = [str(p["_id"]) async for p in self.bd.pme.find({"_id": {"$gte": ObjectId.from_datetime(desde.astimezone(timezone.utc))}}, {"_id": 1})]
+            listos = set(await self.bd.resumen.distinct("_id", {"_id": {"$in": nuevos}, "reconstruido": {"$exists": True}}))
+            incompletos = await self.bd.resumen.distinct(
+                "_id", {"reconstruido": {"$exists": False}, "fecha_actualizacion": {"$gte": desde}})
+            faltan = list(dict.fromkeys([i for i in nuevos if i not in listos] + incompletos))
+        for id_pme in faltan:
+            await self.resumen.reconstruir(id_pme)
+        return len(faltan)
+
+    async def _refrescar(self, todo: bool) -> dict:
+        t0, sello = time.monotonic(), datetime.now()
+        marca = None if todo else ((await self._config.find_one({"_id": CLAVE}) or {}).get("marca"))
+        completados = await self._completar_resumenes(marca - MARGEN if marca is not None else None)
+        ids = None
+        if marca is not None:
+            ids = await self.bd.resumen.distinct("_id", {"fecha_actualizacion": {"$gte": marca - MARGEN}})
+
+        if ids is None or ids:
+            try:
+                cursor = await self.bd.pme.aggregate(pipeline(
+                    {} if ids is None else identificadores.filtro_ids(ids), sello,
+                    self.bd.rollups.name, self.bd.resumen.name))
+                # $merge no devuelve documentos; basta con consumir el cursor
+                await cursor.to_list()
+            except OperationFailure as e:
+                if e.code != 11000:
+                    raise
+                # Otro worker insertó la misma fila a la vez: la marca no avanza y la próxima pasada lo repite
+                log.warning("Rollups: clave duplicada en el $merge, se reintenta en la próxima pasada")
+                return {"pme": 0, "eliminados": 0, "completa": ids is None, "marca": marca}
+            # Filas de esos PME que esta pasada no escribió
+            viejas = {"fecha_actualizacion": {"$lt": sello}}
+            if ids is not None:
+                viejas["id_pme"] = {"$in": ids}
+            eliminados = (await self.bd.rollups.delete_many(viejas)).deleted_count
+        else:
+            eliminados = 0
+
+        await self._config.update_one({"_id": CLAVE}, {"$set": {"marca": sello}}, upsert=True)
+        resultado = {"pme": len(ids) if ids is not None else await self.bd.pme.count_documents({}),
+                     "eliminados": eliminados, "completa": ids is None, "marca": sello}
+        log.info("Rollups refrescados", extra={**resultado, "resumenes_completados": completados,
+                                               "ms": round((time.monotonic() - t0) * 1000)})
+        return resultado
+
+    def _candado(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def refrescar(self, todo: bool = False) -> dict:
+        async with self._candado():
+            return await self._refrescar(todo)
+
+    # --- Tarea en segundo plano ---
+
+    async def iniciar(self):
+        if self._tarea is None and self.intervalo > 0:
+            self._tarea = asyncio.create_task(self._periodico())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def _tomar_turno(self) -> bool:
+        """True si este proceso refresca en este intervalo (un solo worker lo logra)."""
+        ahora = datetime.now()
+        # Un poco menos que el intervalo: el próximo ciclo de quien lo tomó ya lo encuentra vencido
+        turno = ahora + timedelta(seconds=self.intervalo * 0.9)
+        try:
+            res = await self._config.update_one(
+                {"_id": CLAVE, "$or": [{"turno": {"$lt": ahora}}, {"turno": {"$exists": False}}]},
+                {"$set": {"turno": turno}}, upsert=True)
+        except DuplicateKeyError:
+            # El documento existe y el turno no ha vencido: lo tiene otro worker
+            return False
+        return bool(res.modified_count or res.upserted_id is not None)
+
+    async def _periodico(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                if await self._tomar_turno():
+                    await self.refrescar()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Error al refrescar los rollups")
+
+    async def eliminar_pme(self, id_pme: str):
+        await self.bd.rollups.delete_many({"id_pme": id_pme})
+
+    # --- Consulta ---
+
+    def _filtro(self, colegios: Optional[List[str]], desde: Optional[int], hasta: Optional[int],
+                dimension: Optional[str]) -> dict:
+        filtro = {}
+        if colegios:
+            filtro["id_colegio"] = {"$in": colegios}
+        if desde is not None or hasta is not None:
+            # El año anterior a `desde` se lee para la variación
+            filtro["year"] = {k: v for k, v in (("$gte", desde - 1 if desde is not None else None), ("$lte", hasta))
+                              if v is not None}
+        if dimension:
+            filtro["dimension"] = dimension
+        return filtro
+
+    async def _nombres(self, ids: Iterable[str]) -> Dict[str, str]:
+        return {str(c["_id"]): c.get("nombre")
+                async for c in self.bd.colegios.find(identificadores.filtro_ids(ids), {"nombre": 1})}
+
+    async def _leer(self, colegios, desde, hasta, dimension, nombres: Optional[dict] = None) -> List[dict]:
+        filas = await self.bd.rollups.find(self._filtro(colegios, desde, hasta, dimension), {"_id": 0}) \
+            .sort([("id_colegio", 1), ("year", 1), ("dimension", 1)]).to_list()
+        if nombres is None:
+            nombres = await self._nombres({f["id_colegio"] for f in filas})
+        anterior = {(f["id_colegio"], f["year"], f["dimension"]): f["monto_sep"] for f in filas}
+        resultado = []
+        for f in filas:
+            if desde is not None and f["year"] < desde:
+                continue
+            previo = anterior.get((f["id_colegio"], f["year"] - 1, f["dimension"]))
+            f["nombre_colegio"] = nombres.get(f["id_colegio"])
+            f["variacion_sep"] = f["monto_sep"] - previo if previo is not None else None
+            f["variacion_sep_pct"] = round(100 * (f["monto_sep"] - previo) / previo, 1) if previo else None
+            resultado.append(_indicadores(f))
+        return resultado
+
+    async def consultar(self, colegios: Optional[List[str]] = None, desde: Optional[int] = None,
+                        hasta: Optional[int] = None, dimension: Optional[str] = None) -> dict:
+        """Filas por colegio, año y dimensión, con totales de la red por dimensión y por colegio."""
+        filas = await self._leer(colegios, desde, hasta, dimension)
+        marca = await self._config.find_one({"_id": CLAVE})
+        return {
+            "filas": filas,
+            "por_dimension": _totalizar(filas, ("year", "dimension")),
+            "por_colegio": _totalizar(filas, ("id_colegio", "nombre_colegio", "year")),
+            "total": _totalizar(filas, ())[0] if filas else None,
+            "actualizado": (marca or {}).get("marca"),
+        }
+
+    # --- Exportación ---
+
+    async def hojas_xlsx(self, colegios: Optional[List[str]] = None, desde: Optional[int] = None,
+                         hasta: Optional[int] = None, dimension: Optional[str] = None) -> list:
+        """Una hoja "Resumen" y una por colegio; las consultas por colegio van en paralelo."""
+        if not colegios:
+            colegios = sorted(await self.bd.rollups.distinct("id_colegio", self._filtro(None, desde, hasta, dimension)))
+        nombres = await self._nombres(colegios)
+        limite = asyncio.Semaphore(CONCURRENCIA)
+
+        async def de_colegio(id_colegio: str) -> List[dict]:
+            async with limite:
+                return await self._leer([id_colegio], desde, hasta, dimension, nombres)
+
+        por_colegio = await asyncio.gather(*(de_colegio(c) for c in colegios))
+
+        usados = {"resumen"}
+        resumen = ["Resumen", ["Colegio", "Año", "Monto SEP", "Monto total", "Ejecutado", "Saldo SEP", "Ejecución %"], []]
+        hojas = [resumen]
+        for id_colegio, filas in zip(colegios, por_colegio):
+            if not filas:
+                continue
+            resumen[2].extend(
+                [t["nombre_colegio"] or id_colegio, t["year"], t["monto_sep"], t["monto_total"], t["monto_recursos"],
+                 t["saldo_sep"], t["ejecucion_pct"]]
+                for t in _totalizar(filas, ("nombre_colegio", "year")))
+            hojas.append([
+                titulo_hoja(nombres.get(id_colegio) or id_colegio, usados),
+                ["Año", "Dimensión", "Monto SEP", "Variación SEP", "Variación SEP %", "Monto total", "Ejecutado",
+                 "Saldo SEP", "Ejecución %", "Acciones", "Recursos"],
+                [[f["year"], f["dimension"], f["monto_sep"], f["variacion_sep"], f["variacion_sep_pct"], f["monto_total"],
+                  f["monto_recursos"], f["saldo_sep"], f["ejecucion_pct"], f["n_acciones"], f["n_recursos"]]
+                 for f in filas],
+            ])
+        return [tuple(h) for h in hojas]
+
+
+async def _main(todo: bool):
+    from database import BaseDatos
+    from resumen import ResumenPME
+
+    bd = BaseDatos()
+    bd.conectar()
+    try:
+        print(await Rollups(bd, ResumenPME(bd)).refrescar(todo))
+    finally:
+        await bd.cerrar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "refrescar" or (len(sys.argv) > 2 and sys.argv[2] != "--todo"):
+        print("Uso: python rollups.py refrescar [--todo]")
+        sys.exit(2)
+
+    asyncio.run(_main(len(sys.argv) > 2))
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from indices import indices_faltantes
+
+# ==========================================
+# ARRANQUE Y SONDAS DE SALUD (/healthz, /readyz)
+# ==========================================
+# El lifespan de cada worker crea el cliente de Mongo y lanza la
+# inicialización (ping, calentar el pool, índices, usuarios iniciales,
+# cola de trabajos) como tarea en segundo plano: el servidor acepta
+# conexiones de inmediato aunque Atlas tarde en responder, y si Mongo no
+# está disponible la inicialización se reintenta con espera creciente en
+# vez de dejar la app a medio iniciar.
+#
+#   /healthz  el proceso responde (liveness; no toca la BD)
+#   /readyz   inicialización completa, Mongo responde y están todos los
+#             índices declarados (readiness; 503 si no)
+#
+# Los tiempos de arranque (import -> servidor aceptando -> listo) quedan
+# en /readyz, en el log y en la métrica pme_arranque_segundos.
+#
+#   ARRANQUE_ESPERA_MAX   segundos máximos entre reintentos (30)
+#   READYZ_TIMEOUT        timeout del ping de /readyz en segundos (2)
+
+ESPERA_INICIAL = 0.5
+ESPERA_MAX = float(os.getenv("ARRANQUE_ESPERA_MAX", "30"))
+READYZ_TIMEOUT = float(os.getenv("READYZ_TIMEOUT", "2"))
+
+log = logging.getLogger("pme.arranque")
+
+
+class Arranque:
+    def __init__(self, t_import: float):
+        self.t_import = t_import
+        self.t_servidor: Optional[float] = None
+        self.t_listo: Optional[float] = None
+        self.intentos = 0
+        self.ultimo_error: Optional[str] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    @property
+    def listo(self) -> bool:
+        return self.t_listo is not None
+
+    def lanzar(self, inicializar: Callable[[], Awaitable[None]]):
+        """Marca el servidor como aceptando requests y corre `inicializar` hasta que funcione."""
+        self.t_servidor = time.monotonic()
+        self.t_listo, self.intentos, self.ultimo_error = None, 0, None
+        log.info("Servidor aceptando conexiones", extra={"segundos": round(self.t_servidor - self.t_import, 3)})
+        self._tarea = asyncio.create_task(self._correr(inicializar))
+
+    async def _correr(self, inicializar):
+        espera = ESPERA_INICIAL
+        while True:
+            self.intentos += 1
+            try:
+                await inicializar()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.ultimo_error = str(e)
+                log.error("Inicialización fallida, se reintenta", extra={
+                    "intento": self.intentos, "espera_segundos": espera, "error": str(e)})
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, ESPERA_MAX)
+        self.t_listo = time.monotonic()
+        self.ultimo_error = None
+        log.info("Listo para recibir peticiones", extra=self.tiempos())
+
+    async def detener(self):
+        if self._tarea is not None and not self._tarea.done():
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+
+    def tiempos(self) -> dict:
+        def desde_import(t):
+            return round(t - self.t_import, 3) if t is not None else None
+        return {
+            "servidor_segundos": desde_import(self.t_servidor),
+            "listo_segundos": desde_import(self.t_listo),
+            "intentos": self.intentos,
+        }
+
+
+async def verificar_listo(bd, arranque: Arranque) -> dict:
+    """Estado para /readyz: {"listo": bool, ...} con el detalle de cada chequeo."""
+    estado = {"listo": False, "arranque": arranque.tiempos(), "pid": os.getpid()}
+    if not arranque.listo:
+        estado["motivo"] = "inicializando"
+        if arranque.ultimo_error:
+            estado["error"] = arranque.ultimo_error
+        return estado
+    try:
+        await bd.ping(READYZ_TIMEOUT)
+    except Exception as e:
+        estado.update(motivo="mongo no responde", error=str(e) or type(e).__name__)
+        return estado
+    faltantes = await indices_faltantes(bd.db)
+    if faltantes:
+        estado.update(motivo="faltan índices", indices_faltantes=faltantes)
+        return estado
+    estado["listo"] = True
+    return estado
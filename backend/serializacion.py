@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import Response
+
+# ==========================================
+# SERIALIZACIÓN RÁPIDA (ORJSON)
+# ==========================================
+# Los documentos de Mongo salen tal cual a orjson: ObjectId (y Decimal128)
+# se convierten en la misma pasada por `default`, y datetime lo serializa
+# orjson de forma nativa (ISO 8601, igual que jsonable_encoder). Así se
+# evitan el loop `d["_id"] = str(d["_id"])` y el jsonable_encoder genérico
+# de FastAPI, que en los PME grandes tomaban más que la consulta.
+#
+# Los endpoints de listados devuelven RespuestaJSON(...) directamente;
+# FastAPI solo aplica jsonable_encoder cuando el endpoint retorna datos.
+
+OPCIONES = orjson.OPT_NON_STR_KEYS
+
+
+def _defecto(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return float(obj.to_decimal())
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+def a_json(valor) -> bytes:
+    return orjson.dumps(valor, default=_defecto, option=OPCIONES)
+
+
+class RespuestaJSON(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return a_json(content)
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+import uvicorn
+
+from observabilidad import configurar_logging
+
+# ==========================================
+# MODO PRODUCCIÓN (VARIOS WORKERS)
+# ==========================================
+# `python servidor.py` levanta uvicorn con varios procesos, sin reloader.
+# Cada worker importa backend.py por su cuenta y crea su cliente de Mongo,
+# su caché y su despachador de trabajos en el lifespan (nada se comparte
+# en memoria: la cola de trabajos toma cada trabajo de forma atómica y las
+# invalidaciones de la caché pasan por Mongo, ver cache.py).
+# El supervisor de uvicorn reemplaza a los workers que terminan, ya sea
+# por caída o por reciclaje (WEB_MAX_REQUESTS).
+#
+#   WEB_WORKERS           procesos (por defecto, núcleos disponibles)
+#   WEB_HOST / WEB_PUERTO 0.0.0.0 / 8000
+#   WEB_MAX_REQUESTS      requests antes de reciclar un worker (10000; 0 = nunca)
+#   WEB_GRACEFUL_SEGUNDOS espera a los requests en curso al apagar (30)
+#   WEB_KEEPALIVE_SEGUNDOS keep-alive HTTP; mayor que el de nginx (75)
+#   WEB_CONCURRENCIA_MAX  conexiones por worker antes de responder 503 (sin límite)
+#   WEB_FORWARDED_IPS     proxies de confianza para X-Forwarded-For ("*")
+#
+# En desarrollo se sigue usando `uvicorn backend:app --reload` (un proceso).
+# Los procesos del pool de certificados (CERTIFICADOS_PROCESOS) son por worker.
+
+
+def _entero(nombre: str, defecto):
+    valor = os.getenv(nombre)
+    return int(valor) if valor not in (None, "") else defecto
+
+
+def workers_por_defecto() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # respeta el límite de CPU del contenedor
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def configuracion() -> dict:
+    max_requests = _entero("WEB_MAX_REQUESTS", 10000)
+    return {
+        "host": os.getenv("WEB_HOST", "0.0.0.0"),
+        "port": _entero("WEB_PUERTO", 8000),
+        "workers": max(_entero("WEB_WORKERS", workers_por_defecto()), 1),
+        "reload": False,
+        "limit_max_requests": max_requests or None,
+        "timeout_graceful_shutdown": _entero("WEB_GRACEFUL_SEGUNDOS", 30),
+        "timeout_keep_alive": _entero("WEB_KEEPALIVE_SEGUNDOS", 75),
+        "limit_concurrency": _entero("WEB_CONCURRENCIA_MAX", None),
+        "proxy_headers": True,
+        "forwarded_allow_ips": os.getenv("WEB_FORWARDED_IPS", "*"),
+        # El log de acceso lo escribe MiddlewareMetricas (observabilidad.py)
+        "access_log": False,
+        # Cada worker configura el logging al importar backend.py (mismo formato)
+        "log_config": None,
+    }
+
+
+if __name__ == "__main__":
+    configurar_logging()  # logs del supervisor
+    uvicorn.run("backend:app", **configuracion())
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# ==========================================
+# TRABAJOS EN SEGUNDO PLANO (colección jobs)
+# ==========================================
+# Clonación, importaciones, exportaciones y eliminación en cascada pueden
+# encolarse en vez de ejecutarse dentro del request: el endpoint guarda un
+# documento en `jobs` y responde con su id; un despachador en cada proceso
+# toma trabajos pendientes (find_one_and_update atómico, así dos workers
+# nunca toman el mismo) y los ejecuta respetando un cupo por tipo.
+#
+# Estados: pendiente -> en_curso -> completado | error
+#
+# Mientras corre, el trabajo actualiza `latido`. Si el proceso muere, el
+# trabajo queda en_curso con un latido viejo y cualquier despachador lo
+# devuelve a pendiente (hasta TRABAJOS_MAX_INTENTOS tomas). Un apagado
+# ordenado lo devuelve a pendiente de inmediato. El avance guardado
+# (`progreso.reanudar`) permite a cada tipo retomar donde quedó.
+#
+# Los archivos (planilla subida, exportación generada) van a
+# TRABAJOS_DIR y en `jobs` solo queda su nombre: el worker que encola, el
+# que ejecuta y el que atiende la descarga pueden ser distintos, así que
+# el directorio debe ser compartido por todos los procesos y contenedores
+# del backend (volumen pme_trabajos en docker-compose.yml). Sin
+# TRABAJOS_DIR se usa un directorio temporal local, que solo sirve con
+# un único contenedor.
+#
+#   TRABAJOS_CONCURRENCIA   cupos por tipo y proceso, p.ej. "importar=2,exportar=2"
+#   TRABAJOS_DIR            archivos subidos y exportaciones generadas (compartido)
+#   TRABAJOS_RETENCION_HORAS  vida de los trabajos terminados y sus archivos (48)
+
+CONCURRENCIA_DEFECTO = {"clonar": 1, "importar": 2, "exportar": 2, "eliminar": 1, "certificados": 1}
+MAX_INTENTOS = int(os.getenv("TRABAJOS_MAX_INTENTOS", "3"))
+RETENCION_HORAS = float(os.getenv("TRABAJOS_RETENCION_HORAS", "48"))
+DIRECTORIO = os.getenv("TRABAJOS_DIR", os.path.join(tempfile.gettempdir(), "pme_trabajos"))
+
+INTERVALO_SONDEO = 2.0   # segundos entre búsquedas de trabajos de otros procesos
+INTERVALO_LATIDO = 10.0
+LATIDO_VENCIDO = 60.0    # un trabajo sin latido por este tiempo se da por abandonado
+INTERVALO_AVANCE = 1.0   # escritura mínima entre actualizaciones de progreso
+INTERVALO_LIMPIEZA = 3600.0
+
+log = logging.getLogger("pme.trabajos")
+
+
+def concurrencia_configurada() -> Dict[str, int]:
+    limites = dict(CONCURRENCIA_DEFECTO)
+    for par in os.getenv("TRABAJOS_CONCURRENCIA", "").split(","):
+        if "=" in par:
+            tipo, n = par.split("=", 1)
+            limites[tipo.strip()] = int(n)
+    return limites
+
+
+def _terminado() -> dict:
+    ahora = datetime.now()
+    return {"terminado": ahora, "expira": ahora + timedelta(hours=RETENCION_HORAS)}
+
+
+def ruta_archivo(nombre: str) -> str:
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    return os.path.join(DIRECTORIO, nombre)
+
+
+class Avance:
+    """Callback de progreso que recibe cada tipo de trabajo.
+
+    `await avance(procesados, total, reanudar={...})` guarda el progreso
+    (como máximo una vez por INTERVALO_AVANCE, salvo `forzar=True`).
+    """
+
+    def __init__(self, cola: "ColaTrabajos", trabajo: dict):
+        self.cola = cola
+        self.id = trabajo["_id"]
+        self.reanudar = trabajo.get("progreso", {}).get("reanudar")
+        self._ultimo = 0.0
+
+    async def __call__(self, procesados: int, total: Optional[int] = None, reanudar: Optional[dict] = None,
+                       forzar: bool = False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo < INTERVALO_AVANCE:
+            return
+        self._ultimo = ahora
+        progreso = {"procesados": procesados, "total": total}
+        if total:
+            progreso["porcentaje"] = round(min(100.0, 100.0 * procesados / total), 1)
+        if reanudar is not None:
+            progreso["reanudar"] = reanudar
+        await self.cola.col.update_one(
+            {"_id": self.id, "estado": "en_curso"},
+            {"$set": {"progreso": progreso, "latido": datetime.now()}},
+        )
+
+
+class ColaTrabajos:
+    def __init__(self, bd, limites: Optional[Dict[str, int]] = None):
+        self.bd = bd
+        self.limites = limites or concurrencia_configurada()
+        self._tipos: Dict[str, Callable[[dict, Avance], Awaitable[dict]]] = {}
+        self._en_curso: Dict[str, asyncio.Task] = {}
+        self._por_tipo: Dict[str, int] = {}
+        # El Event se crea en iniciar(): en Python 3.9 queda atado al loop donde se construye
+        self._despertar: Optional[asyncio.Event] = None
+        self._despachador: Optional[asyncio.Task] = None
+
+    @property
+    def col(self):
+        return self.bd.db["jobs"]
+
+    def registrar(self, tipo: str, funcion: Callable[[dict, Avance], Awaitable[dict]]):
+        """`funcion(trabajo, avance)` ejecuta el trabajo y devuelve su resultado."""
+        self._tipos[tipo] = funcion
+        self.limites.setdefault(tipo, 1)
+
+    # --- API para los endpoints ---
+
+    async def encolar(self, tipo: str, params: dict, archivos: Optional[list] = None) -> str:
+        if tipo not in self._tipos:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        ahora = datetime.now()
+        trabajo = {
+            "_id": str(ObjectId()),
+            "tipo": tipo,
+            "params": params,
+            "estado": "pendiente",
+            "progreso": {"procesados": 0, "total": None},
+            "intentos": 0,
+            "archivos": archivos or [],
+            "creado": ahora,
+        }
+        await self.col.insert_one(trabajo)
+        self._avisar()
+        return trabajo["_id"]
+
+    async def obtener(self, id_trabajo: str) -> Optional[dict]:
+        return await self.col.find_one({"_id": id_trabajo}, {"params": 0, "archivos": 0, "progreso.reanudar": 0})
+
+    # --- Despachador ---
+
+    async def iniciar(self):
+        if self._despachador is None:
+            if "TRABAJOS_DIR" not in os.environ:
+                log.warning("TRABAJOS_DIR no definido: los archivos de los trabajos quedan en un directorio local",
+                            extra={"directorio": DIRECTORIO})
+            os.makedirs(DIRECTORIO, exist_ok=True)
+            self._despertar = asyncio.Event()
+            self._despachador = asyncio.create_task(self._despachar())
+
+    async def detener(self):
+        """Apagado ordenado: los trabajos en curso vuelven a pendiente para otro proceso."""
+        if self._despachador is not None:
+            self._despachador.cancel()
+            await asyncio.gather(self._despachador, return_exceptions=True)
+            self._despachador = None
+        tareas = list(self._en_curso.values())
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    def _avisar(self):
+        if self._despertar is not None:
+            self._despertar.set()
+
+    async def _despachar(self):
+        ultima_limpieza = 0.0
+        while True:
+            try:
+                if time.monotonic() - ultima_limpieza > INTERVALO_LIMPIEZA:
+                    await self.limpiar_vencidos()
+                    ultima_limpieza = time.monotonic()
+                await self._recuperar_abandonados()
+                while (trabajo := await self._tomar_siguiente()) is not None:
+                    self._lanzar(trabajo)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Error en el despachador de trabajos")
+
+            self._despertar.clear()
+            try:
+                await asyncio.wait_for(self._despertar.wait(), INTERVALO_SONDEO)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tomar_siguiente(self) -> Optional[dict]:
+        libres = [t for t in self._tipos if self._por_tipo.get(t, 0) < self.limites.get(t, 1)]
+        if not libres:
+            return None
+        ahora = datetime.now()
+        return await self.col.find_one_and_update(
+            {"estado": "pendiente", "tipo": {"$in": libres}},
+            {"$set": {"estado": "en_curso", "iniciado": ahora, "latido": ahora, "pid": os.getpid()},
+             "$inc": {"intentos": 1}},
+            sort=[("creado", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _recuperar_abandonados(self):
+        limite = datetime.now() - timedelta(seconds=LATIDO_VENCIDO)
+        abandonado = {"estado": "en_curso", "latido": {"$lt": limite}}
+        await self.col.update_many(
+            {**abandonado, "intentos": {"$gte": MAX_INTENTOS}},
+            {"$set": {"estado": "error", "error": "Trabajo abandonado demasiadas veces", **_terminado()}},
+        )
+        res = await self.col.update_many(abandonado, {"$set": {"estado": "pendiente"}})
+        if res.modified_count:
+            log.warning("Trabajos abandonados vuelven a la cola", extra={"trabajos": res.modified_count})
+
+    def _lanzar(self, trabajo: dict):
+        tipo = trabajo["tipo"]
+        self._por_tipo[tipo] = self._por_tipo.get(tipo, 0) + 1
+        tarea = asyncio.create_task(self._ejecutar(trabajo))
+        self._en_curso[trabajo["_id"]] = tarea
+
+        def al_terminar(_):
+            self._en_curso.pop(trabajo["_id"], None)
+            self._por_tipo[tipo] -= 1
+            self._avisar()
+        tarea.add_done_callback(al_terminar)
+
+    async def _latir(self, id_trabajo: str):
+        while True:
+            await asyncio.sleep(INTERVALO_LATIDO)
+            await self.col.update_one({"_id": id_trabajo, "estado": "en_curso"}, {"$set": {"latido": datetime.now()}})
+
+    async def _ejecutar(self, trabajo: dict):
+        latido = asyncio.create_task(self._latir(trabajo["_id"]))
+        filtro = {"_id": trabajo["_id"], "estado": "en_curso"}
+        datos_log = {"trabajo": trabajo["_id"], "tipo": trabajo["tipo"], "intento": trabajo.get("intentos")}
+        log.info("Trabajo iniciado", extra=datos_log)
+        t0 = time.monotonic()
+        try:
+            resultado = await self._tipos[trabajo["tipo"]](trabajo, Avance(self, trabajo))
+            await self.col.update_one(filtro, {"$set": {
+                "estado": "completado", "resultado": resultado, "progreso.porcentaje": 100.0, **_terminado(),
+            }})
+            log.info("Trabajo completado", extra={**datos_log, "segundos": round(time.monotonic() - t0, 2)})
+        except asyncio.CancelledError:
+            # Apagado del proceso: se devuelve sin consumir el intento
+            await asyncio.shield(self.col.update_one(filtro, {"$set": {"estado": "pendiente"}, "$inc": {"intentos": -1}}))
+            raise
+        except Exception as e:
+            log.exception("Trabajo con error", extra=datos_log)
+            await self.col.update_one(filtro, {"$set": {"estado": "error", "error": str(e), **_terminado()}})
+        finally:
+            latido.cancel()
+
+    # --- Limpieza ---
+
+    async def limpiar_vencidos(self):
+        """Borra los trabajos terminados hace más de RETENCION_HORAS y sus archivos."""
+        vencidos = await self.col.find({"expira": {"$lt": datetime.now()}}, {"archivos": 1}).to_list()
+        for t in vencidos:
+            for nombre in t.get("archivos", []):
+                try:
+                    os.remove(ruta_archivo(nombre))
+                except FileNotFoundError:
+                    pass
+        if vencidos:
+            await self.col.delete_many({"_id": {"$in": [t["_id"] for t in vencidos]}})
@@ -0,0 +1 @@
+# Benchmarks del backend (ver README de cada script)
@@ -0,0 +1,92 @@
+"""Compara el camino sync anterior (pymongo en el threadpool de Starlette,
+40 hilos) con el driver async para la misma consulta de listado.
+
+    python -m benchmarks.driver_async --id-pme <id> --concurrencia 200 --consultas 2000
+
+Usa MONGO_URI / DB_NAME y las opciones de pool de backend/database.py.
+Imprime un JSON con throughput y latencias de cada camino.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import anyio
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from database import BaseDatos, DB_NAME, MONGO_URI, opciones_cliente  # noqa: E402
+
+HILOS_STARLETTE = 40
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+async def _correr(nombre, consulta, concurrencia, consultas):
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias = []
+
+    async def una():
+        async with semaforo:
+            t0 = time.perf_counter()
+            await consulta()
+            latencias.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(consultas)))
+    total = time.perf_counter() - t0
+    return {
+        "camino": nombre,
+        "consultas": consultas,
+        "concurrencia": concurrencia,
+        "segundos": round(total, 3),
+        "consultas_por_segundo": round(consultas / total, 1),
+        "p50_ms": round(statistics.median(latencias), 2),
+        "p95_ms": round(_percentil(latencias, 95), 2),
+        "p99_ms": round(_percentil(latencias, 99), 2),
+    }
+
+
+async def main(args):
+    filtro = {"id_pme": args.id_pme}
+
+    # Camino anterior: MongoClient sync ejecutado en el threadpool (40 hilos)
+    sync_client = MongoClient(MONGO_URI, **opciones_cliente())
+    col_sync = sync_client[DB_NAME]["recursos"]
+    limitador = anyio.CapacityLimiter(HILOS_STARLETTE)
+
+    async def consulta_sync():
+        await anyio.to_thread.run_sync(lambda: list(col_sync.find(filtro)), limiter=limitador)
+
+    # Camino nuevo: AsyncMongoClient
+    bd = BaseDatos()
+    bd.conectar()
+
+    async def consulta_async():
+        await bd.recursos.find(filtro).to_list()
+
+    # Calentamiento de ambos pools
+    await consulta_sync()
+    await consulta_async()
+
+    resultados = [
+        await _correr("sync_threadpool", consulta_sync, args.concurrencia, args.consultas),
+        await _correr("async", consulta_async, args.concurrencia, args.consultas),
+    ]
+    sync_client.close()
+    await bd.cerrar()
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--id-pme", required=True)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--consultas", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
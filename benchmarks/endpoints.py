@@ -0,0 +1,415 @@
+"""Benchmark de endpoints: corre la app FastAPI real (en proceso, vía ASGI)
+contra un mongod local o mongomock y mide latencias y throughput.
+
+    python -m benchmarks.endpoints --mongomock --salida antes.json
+    python -m benchmarks.endpoints --escenarios listados,exportaciones --concurrencia 20
+    python -m benchmarks.endpoints --filas 1000,10000,100000 --escenarios importaciones
+    python -m benchmarks.endpoints --url http://localhost:8000 --db pme_benchmark --concurrencia 64
+    python -m benchmarks.endpoints --comparar antes.json despues.json
+
+Escenarios:
+  listados        GET colegios, PMEs de un colegio, acciones, recursos del PME y detalle
+  crear_pme       POST /api/pme con clonar=true (en secuencia: cada año clona el anterior)
+  importaciones   importadores de acciones y recursos con planillas de --filas filas
+  exportaciones   exportación de acciones y exportaciones custom de recursos (xlsx y csv)
+  consolidado     reporte de toda la red: recursos de cada PME (antes) contra /api/rollups
+                  y su XLSX por colegio; mide también el refresco completo
+
+Con mongod usa MONGO_URI y una base propia (--db, por defecto pme_benchmark)
+que se siembra con benchmarks.generador y se borra al final (salvo
+--conservar). Con --mongomock todo queda en memoria; ver
+benchmarks/mongomock_async.py para sus límites. Con --url las peticiones
+van por HTTP a un servidor ya levantado (p.ej. `python servidor.py` con
+varios workers), que debe usar la misma base (DB_NAME = --db).
+
+La salida es un JSON con la configuración de la corrida y, por escenario,
+p50/p95/p99 (ms), throughput y errores; --comparar muestra la razón
+después/antes de cada métrica. Requiere httpx (y mongomock con --mongomock).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ESCENARIOS = ["listados", "crear_pme", "importaciones", "exportaciones", "consolidado"]
+COLUMNAS_EXPORTACION = ["nombre_actividad", "monto", "recursos_actividad", "nombre_accion", "dimension"]
+MEDIDAS_COMPARABLES = ["p50_ms", "p95_ms", "p99_ms", "req_por_segundo", "filas_por_segundo"]
+
+
+def percentil(valores: list, p: float) -> float:
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def resumir(nombre: str, latencias: list, errores: int, segundos: float, concurrencia: int, **extra) -> dict:
+    resultado = {
+        "escenario": nombre,
+        "n": len(latencias),
+        "errores": errores,
+        "concurrencia": concurrencia,
+        "segundos": round(segundos, 3),
+        "req_por_segundo": round(len(latencias) / segundos, 2) if segundos else None,
+    }
+    if latencias:
+        resultado.update({
+            "p50_ms": round(statistics.median(latencias), 2),
+            "p95_ms": round(percentil(latencias, 95), 2),
+            "p99_ms": round(percentil(latencias, 99), 2),
+            "min_ms": round(min(latencias), 2),
+            "max_ms": round(max(latencias), 2),
+        })
+    resultado.update(extra)
+    return resultado
+
+
+async def medir(nombre: str, peticiones: list, concurrencia: int, **extra) -> dict:
+    """Ejecuta `peticiones` (funciones async que devuelven la respuesta) con la concurrencia dada.
+
+    Una respuesta con status >= 400 o una excepción cuenta como error
+    y no entra en las latencias.
+    """
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias, errores, bytes_totales = [], [], 0
+
+    async def una(peticion):
+        nonlocal bytes_totales
+        async with semaforo:
+            t0 = time.perf_counter()
+            try:
+                resp = await peticion()
+            except Exception as e:
+                errores.append(f"{type(e).__name__}: {e}")
+                return
+            ms = (time.perf_counter() - t0) * 1000
+            if resp.status_code >= 400:
+                errores.append(f"HTTP {resp.status_code}: {resp.text[:200]}")
+                return
+            latencias.append(ms)
+            bytes_totales += len(resp.content)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(una(p) for p in peticiones))
+    resultado = resumir(nombre, latencias, len(errores), time.perf_counter() - t0, concurrencia,
+                        bytes_por_respuesta=round(bytes_totales / len(latencias)) if latencias else 0, **extra)
+    if errores:
+        resultado["primer_error"] = errores[0]
+    return resultado
+
+
+# ==========================================
+# ESCENARIOS
+# ==========================================
+
+async def escenario_listados(http, datos: dict, args) -> list:
+    pmes = datos["pmes"]
+    rutas = {
+        "listar_colegios": lambda i: "/api/colegios",
+        "listar_pmes_colegio": lambda i: f"/api/pmes/colegio/{pmes[i % len(pmes)]['id_colegio']}",
+        "listar_acciones": lambda i: f"/api/acciones/{pmes[i % len(pmes)]['id_pme']}",
+        "listar_recursos_pme": lambda i: f"/api/recursos/pme/{pmes[i % len(pmes)]['id_pme']}",
+        "detalle_recursos_pme": lambda i: f"/api/recursos/pme/{pmes[i % len(pmes)]['id_pme']}/detalle",
+    }
+    resultados = []
+    for nombre, ruta in rutas.items():
+        peticiones = [lambda r=ruta(i): http.get(r) for i in range(args.repeticiones)]
+        resultados.append(await medir(nombre, peticiones, args.concurrencia))
+    return resultados
+
+
+async def escenario_crear_pme(http, datos: dict, args) -> list:
+    # Cada PME nuevo clona el del año anterior del mismo colegio: van en secuencia
+    ultimo = max(datos["years"])
+    colegios = datos["colegios"]
+    peticiones = []
+    for i in range(args.repeticiones):
+        cuerpo = {"year": ultimo + 1 + i // len(colegios), "id_colegio": colegios[i % len(colegios)],
+                  "director": "Benchmark", "observacion": "crear_pme", "clonar": True}
+        peticiones.append(lambda c=cuerpo: http.post("/api/pme", json=c))
+    por_pme = datos["acciones_por_pme"]
+    return [await medir("crear_pme_clonando", peticiones, 1,
+                        acciones_por_pme=por_pme, recursos_por_pme=por_pme * datos["recursos_por_accion"])]
+
+
+async def escenario_importaciones(http, datos: dict, args) -> list:
+    from bson import ObjectId
+    from benchmarks.generador import Generador
+
+    gen = Generador(args.semilla)
+    uuids = [gen.uuid() for _ in range(200)]
+    resultados = []
+    for tipo in ("acciones", "recursos"):
+        for filas in args.filas:
+            t0 = time.perf_counter()
+            planilla = gen.planilla(tipo, filas, uuids)
+            generada = time.perf_counter() - t0
+
+            def peticion(p=planilla, t=tipo):
+                # Cada importación va a un PME nuevo para que todas midan lo mismo
+                params = {"id_pme": str(ObjectId()), "year": max(datos["years"])}
+                archivo = {"file": ("planilla.xlsx", p, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+                return http.post(f"/api/{t}/importar_excel", params=params, files=archivo)
+
+            res = await medir(f"importar_{tipo}_{filas}", [peticion] * args.repeticiones_import, 1,
+                              filas=filas, bytes_planilla=len(planilla), segundos_generar_planilla=round(generada, 3))
+            if res.get("p50_ms"):
+                res["filas_por_segundo"] = round(filas / (res["p50_ms"] / 1000), 1)
+            resultados.append(res)
+    return resultados
+
+
+async def escenario_exportaciones(http, datos: dict, args) -> list:
+    pmes = datos["pmes"]
+    resultados = []
+    for formato in ("xlsx", "csv"):
+        casos = {
+            f"exportar_acciones_{formato}": lambda i, f=formato: http.get(
+                f"/api/acciones/exportar/{pmes[i % len(pmes)]['id_pme']}", params={"formato": f}),
+            f"exportar_recursos_pme_{formato}": lambda i, f=formato: http.post(
+                f"/api/recursos/exportar_custom/{pmes[i % len(pmes)]['id_pme']}", params={"formato": f},
+                json={"columnas": COLUMNAS_EXPORTACION}),
+            f"exportar_recursos_accion_{formato}": lambda i, f=formato: http.post(
+                f"/api/recursos/exportar_custom_accion/{pmes[i % len(pmes)]['uuid_accion']}",
+                params={"formato": f, "id_pme": pmes[i % len(pmes)]["id_pme"]},
+                json={"columnas": COLUMNAS_EXPORTACION}),
+        }
+        for nombre, caso in casos.items():
+            peticiones = [lambda c=caso, i=i: c(i) for i in range(args.repeticiones)]
+            resultados.append(await medir(nombre, peticiones, args.concurrencia))
+    por_pme = datos["acciones_por_pme"] * datos["recursos_por_accion"]
+    for r in resultados:
+        r["recursos_por_pme"] = por_pme
+    return resultados
+
+
+async def escenario_consolidado(http, datos: dict, args) -> list:
+    pmes = datos["pmes"]
+    t0 = time.perf_counter()
+    (await http.post("/api/rollups/refrescar", params={"todo": True})).raise_for_status()
+    refresco = round(time.perf_counter() - t0, 3)
+
+    async def red_por_pme():
+        # Lo que se hacía antes: los recursos de cada PME, uno tras otro
+        for p in pmes:
+            resp = await http.get(f"/api/recursos/pme/{p['id_pme']}")
+            if resp.status_code >= 400:
+                return resp
+        return resp
+
+    casos = {
+        "consolidado_por_pme": lambda i: red_por_pme(),
+        "consolidado_rollups": lambda i: http.get("/api/rollups"),
+        "consolidado_xlsx": lambda i: http.get("/api/rollups/exportar"),
+    }
+    resultados = []
+    for nombre, caso in casos.items():
+        peticiones = [lambda c=caso, i=i: c(i) for i in range(args.repeticiones)]
+        resultados.append(await medir(nombre, peticiones, args.concurrencia, pmes=len(pmes),
+                                      segundos_refresco_completo=refresco))
+    return resultados
+
+
+FUNCIONES = {
+    "listados": escenario_listados,
+    "crear_pme": escenario_crear_pme,
+    "importaciones": escenario_importaciones,
+    "exportaciones": escenario_exportaciones,
+    "consolidado": escenario_consolidado,
+}
+
+
+# ==========================================
+# CORRIDA
+# ==========================================
+
+async def esperar_listo(http, timeout: float = 60):
+    limite = time.monotonic() + timeout
+    while True:
+        resp = await http.get("/readyz")
+        if resp.status_code == 200:
+            return resp.json()
+        if time.monotonic() > limite:
+            raise RuntimeError(f"La app no quedó lista: {resp.text}")
+        await asyncio.sleep(0.1)
+
+
+async def autenticar(http):
+    """Login con el administrador sembrado; el token queda en las cabeceras del cliente."""
+    resp = await http.post("/api/login", json={"perfil": "administrador",
+                                               "contrasena": os.getenv("BENCHMARK_CONTRASENA", "admin123")})
+    resp.raise_for_status()
+    http.headers["Authorization"] = f"Bearer {resp.json()['token']}"
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _preparar_entorno(args):
+    """Variables y adaptadores que deben fijarse antes de importar el backend."""
+    os.environ["DB_NAME"] = args.db
+    if args.sin_cache:
+        os.environ["CACHE_TTL_SEGUNDOS"] = "0"
+    if args.mongomock:
+        from benchmarks import mongomock_async
+        mongomock_async.instalar()
+    sys.path.insert(0, os.path.join(RAIZ, "backend"))
+
+
+def _base_sync(args):
+    """Database sync para sembrar y limpiar (pymongo o mongomock)."""
+    if args.mongomock:
+        from benchmarks import mongomock_async
+        return None, mongomock_async.cliente_compartido()[args.db]
+    from pymongo import MongoClient
+    from database import MONGO_URI, opciones_cliente
+    cliente = MongoClient(MONGO_URI, **opciones_cliente())
+    return cliente, cliente[args.db]
+
+
+async def correr(args) -> dict:
+    _preparar_entorno(args)
+    import httpx
+    from benchmarks.generador import sembrar
+
+    cliente_sync, db = _base_sync(args)
+    years = list(range(args.year_inicial, args.year_inicial + args.years))
+    t0 = time.perf_counter()
+    sembrado = sembrar(db, args.colegios, years, args.acciones, args.recursos, args.semilla,
+                       args.objectid, args.huerfanos, limpiar=True)
+    segundos_sembrar = time.perf_counter() - t0
+    datos = {**sembrado, "years": years, "acciones_por_pme": args.acciones, "recursos_por_accion": args.recursos}
+
+    resultados = []
+
+    async def medir_escenarios(http):
+        # La inicialización (índices, usuarios, pool) corre en segundo plano
+        await esperar_listo(http)
+        await autenticar(http)
+        # Calentamiento: primera consulta y caché de imports
+        await http.get("/api/colegios")
+        for nombre in args.escenarios:
+            print(f"⏱️ Escenario {nombre}...", file=sys.stderr)
+            resultados.extend(await FUNCIONES[nombre](http, datos, args))
+
+    try:
+        if args.url:
+            limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+            async with httpx.AsyncClient(base_url=args.url, timeout=None, limits=limites) as http:
+                await medir_escenarios(http)
+        else:
+            # Los print del backend van a stderr para no mezclarse con el JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                import backend as app_backend
+                app = app_backend.app
+                async with app.router.lifespan_context(app):
+                    transporte = httpx.ASGITransport(app=app)
+                    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark", timeout=None) as http:
+                        await medir_escenarios(http)
+    finally:
+        if not args.conservar:
+            for nombre in db.list_collection_names():
+                db[nombre].drop()
+        if cliente_sync is not None:
+            cliente_sync.close()
+
+    return {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "mongo": "mongomock" if args.mongomock else "mongod",
+            "servidor": args.url or "en proceso (ASGI)",
+            "db": args.db,
+            "cache": None if args.url else not args.sin_cache,  # con --url depende del servidor
+            "parametros": {
+                "colegios": args.colegios, "years": years, "acciones_por_pme": args.acciones,
+                "recursos_por_accion": args.recursos, "huerfanos": args.huerfanos, "objectid": args.objectid,
+                "semilla": args.semilla, "repeticiones": args.repeticiones,
+                "repeticiones_import": args.repeticiones_import, "concurrencia": args.concurrencia,
+                "filas": args.filas,
+            },
+            "sembrado": {"pmes": len(sembrado["pmes"]), "acciones": sembrado["acciones"],
+                         "recursos": sembrado["recursos"], "huerfanos": sembrado["huerfanos"],
+                         "segundos": round(segundos_sembrar, 3)},
+        },
+        "resultados": resultados,
+    }
+
+
+def comparar(antes: dict, despues: dict) -> list:
+    """Razón después/antes por escenario (latencias < 1 y throughput > 1 es mejora)."""
+    previos = {r["escenario"]: r for r in antes["resultados"]}
+    filas = []
+    for r in despues["resultados"]:
+        base = previos.get(r["escenario"])
+        if base is None:
+            continue
+        fila = {"escenario": r["escenario"]}
+        for medida in MEDIDAS_COMPARABLES:
+            if base.get(medida) and r.get(medida) is not None:
+                fila[medida] = {"antes": base[medida], "despues": r[medida], "razon": round(r[medida] / base[medida], 3)}
+        filas.append(fila)
+    return filas
+
+
+def _lista(texto: str, tipo=str) -> list:
+    return [tipo(t.strip()) for t in texto.split(",") if t.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongomock", action="store_true", help="usa mongomock en memoria en vez de MONGO_URI")
+    parser.add_argument("--url", help="servidor ya levantado (en vez de la app en proceso)")
+    parser.add_argument("--db", default="pme_benchmark", help="base de datos de la corrida (se vacía)")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--repeticiones", type=int, default=200, help="peticiones por endpoint")
+    parser.add_argument("--repeticiones-import", type=int, default=3, help="importaciones por tamaño de planilla")
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--filas", default="1000,10000,100000", help="tamaños de planilla a importar")
+    parser.add_argument("--colegios", type=int, default=5)
+    parser.add_argument("--years", type=int, default=2, help="años de PME por colegio")
+    parser.add_argument("--year-inicial", type=int, default=2024)
+    parser.add_argument("--acciones", type=int, default=30, help="acciones por PME")
+    parser.add_argument("--recursos", type=int, default=6, help="recursos por acción")
+    parser.add_argument("--huerfanos", type=float, default=0.05)
+    parser.add_argument("--objectid", type=float, default=0.5)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--sin-cache", action="store_true", help="desactiva la caché de lecturas (CACHE_TTL_SEGUNDOS=0)")
+    parser.add_argument("--conservar", action="store_true", help="no borra la base al terminar")
+    parser.add_argument("--salida", help="archivo JSON de resultados (además de stdout)")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTES", "DESPUES"), help="compara dos corridas y termina")
+    args = parser.parse_args()
+
+    if args.comparar:
+        with open(args.comparar[0], encoding="utf-8") as a, open(args.comparar[1], encoding="utf-8") as d:
+            print(json.dumps(comparar(json.load(a), json.load(d)), indent=2, ensure_ascii=False))
+        sys.exit(0)
+
+    args.escenarios = _lista(args.escenarios)
+    desconocidos = set(args.escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+    args.filas = _lista(args.filas, int)
+    if args.url and args.mongomock:
+        parser.error("--url necesita un mongod compartido con el servidor (no --mongomock)")
+
+    informe = asyncio.run(correr(args))
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    print(texto)
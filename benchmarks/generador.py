@@ -0,0 +1,216 @@
+"""Generador de datos sintéticos con la forma de la base real.
+
+    python -m benchmarks.generador --colegios 10 --years 3 --acciones 40 --recursos 8 --limpiar
+    python -m benchmarks.generador --planilla recursos --filas 10000 --salida recursos.xlsx
+
+Siembra colegios × years PMEs, cada uno con `acciones` acciones y
+`recursos` recursos por acción. Igual que en los datos actuales:
+
+  - los `_id` mezclan string y ObjectId (--objectid, fracción de ObjectId)
+  - una parte de los recursos es huérfana (--huerfanos): su uuid_accion no
+    existe en el PME o quedó como "sin asignar" (importación sin uuid)
+
+La semilla (--semilla) fija los datos para poder comparar corridas.
+Escribe con el cliente sync de pymongo en MONGO_URI / DB_NAME. También
+arma planillas .xlsx con las columnas que esperan los importadores.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+DIMENSIONES = ["Gestión Pedagógica", "Liderazgo", "Convivencia Escolar", "Gestión de Recursos"]
+RESPONSABLES = ["UTP", "Dirección", "Convivencia", "Inspectoría", "Coordinación PIE"]
+INSUMOS = ["Resmas de papel", "Tóner", "Proyector", "Colaciones", "Transporte", "Material didáctico"]
+TAMANO_LOTE = 5000
+
+COLUMNAS_PLANILLA = {
+    "acciones": ["uuid_accion", "nombre_accion", "descripcion", "dimension", "subdimensiones",
+                 "responsable", "monto_sep", "monto_total"],
+    "recursos": ["uuid_accion", "nombre_actividad", "descripcion_actividad", "responsable",
+                 "medios_ver", "recursos_actividad", "monto"],
+}
+
+
+class Generador:
+    def __init__(self, semilla: int = 42, objectid: float = 0.5, huerfanos: float = 0.05):
+        self.rnd = random.Random(semilla)
+        self.objectid = objectid
+        self.huerfanos = huerfanos
+
+    def nuevo_id(self):
+        # Documentos antiguos con ObjectId nativo, nuevos con str(ObjectId())
+        segundos = 1704067200 + self.rnd.randrange(10 ** 8)  # desde 2024-01-01
+        oid = ObjectId("%08x%016x" % (segundos, self.rnd.getrandbits(64)))
+        return oid if self.rnd.random() < self.objectid else str(oid)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+    def colegio(self, i: int) -> dict:
+        return {
+            "_id": self.nuevo_id(),
+            "nombre": f"Colegio Sintético {i:04d}",
+            "rbd": str(10000 + i),
+            "rut": f"{70000000 + i}-{i % 10}",
+            "direccion": f"Calle {i} #{self.rnd.randint(100, 9999)}",
+            "telefono": f"+5657{self.rnd.randint(1000000, 9999999)}",
+            "director": f"Director {i}",
+            "imagen": None,
+        }
+
+    def pme(self, id_colegio: str, year: int) -> dict:
+        return {"_id": self.nuevo_id(), "year": year, "id_colegio": id_colegio,
+                "director": "Director(a)", "observacion": "Generado para benchmark"}
+
+    def accion(self, id_pme: str, year: int, i: int) -> dict:
+        monto = self.rnd.randrange(100000, 20000000, 1000)
+        return {
+            "_id": self.nuevo_id(),
+            "uuid_accion": self.uuid(),
+            "id_pme": id_pme,
+            "year": year,
+            "nombre_accion": f"Acción {i}: fortalecimiento de prácticas",
+            "descripcion": "Descripción de la acción con tildes y ñ. " * self.rnd.randint(1, 4),
+            "dimension": self.rnd.choice(DIMENSIONES),
+            "subdimensiones": self.rnd.sample(["Currículum", "Enseñanza", "Apoyo", "Formación"], 2),
+            "objetivo_estrategico": "Mejorar los aprendizajes",
+            "estrategia": "Acompañamiento docente",
+            "planes": "PME",
+            "responsable": self.rnd.choice(RESPONSABLES),
+            "recursos_necesarios_ejecucion": "Recursos SEP",
+            "medios_verificacion": "Actas y registros",
+            "monto_sep": monto,
+            "monto_total": monto + self.rnd.randrange(0, 1000000, 1000),
+            "fecha_actualizacion": datetime(year, 3, 1) + timedelta(minutes=self.rnd.randrange(500000)),
+        }
+
+    def recurso(self, id_pme: str, year: int, uuid_accion: str, i: int) -> dict:
+        if self.rnd.random() < self.huerfanos:
+            uuid_accion = "sin asignar" if self.rnd.random() < 0.5 else self.uuid()
+        return {
+            "_id": self.nuevo_id(),
+            "id_pme": id_pme,
+            "uuid_accion": uuid_accion,
+            "nombre_actividad": f"Actividad {i}",
+            "descripcion_actividad": "Detalle de la actividad realizada en el establecimiento. " * self.rnd.randint(1, 3),
+            "medios_ver": "Registro fotográfico, lista de asistencia",
+            "responsable": self.rnd.choice(RESPONSABLES),
+            "recursos_actividad": self.rnd.sample(INSUMOS, self.rnd.randint(1, 3)),
+            "monto": self.rnd.randrange(5000, 2000000, 500),
+            "year": year,
+            "fecha": datetime(year, 4, 1) + timedelta(minutes=self.rnd.randrange(500000)),
+        }
+
+    # --- Planillas para los importadores ---
+
+    def fila_planilla(self, tipo: str, i: int, uuids: list) -> list:
+        if tipo == "acciones":
+            acc = self.accion("", 2025, i)
+            acc["subdimensiones"] = ", ".join(acc["subdimensiones"])
+            acc["uuid_accion"] = acc["uuid_accion"] if self.rnd.random() < 0.5 else None
+            return [acc.get(c) for c in COLUMNAS_PLANILLA[tipo]]
+        rec = self.recurso("", 2025, self.rnd.choice(uuids) if uuids else "", i)
+        rec["recursos_actividad"] = ", ".join(rec["recursos_actividad"])
+        # Montos como vienen en las planillas reales: a veces texto con puntos y $
+        if self.rnd.random() < 0.3:
+            rec["monto"] = "$" + f"{rec['monto']:,}".replace(",", ".")
+        return [rec.get(c) for c in COLUMNAS_PLANILLA[tipo]]
+
+    def planilla(self, tipo: str, filas: int, uuids: list = ()) -> bytes:
+        """Planilla .xlsx con `filas` filas para el importador de `tipo`."""
+        wb = Workbook(write_only=True)
+        hoja = wb.create_sheet()
+        hoja.append(COLUMNAS_PLANILLA[tipo])
+        for i in range(filas):
+            hoja.append(self.fila_planilla(tipo, i, list(uuids)))
+        salida = io.BytesIO()
+        wb.save(salida)
+        return salida.getvalue()
+
+
+def _insertar(col, docs: list):
+    for i in range(0, len(docs), TAMANO_LOTE):
+        col.insert_many(docs[i:i + TAMANO_LOTE], ordered=False)
+
+
+def sembrar(db, colegios: int = 5, years=(2024, 2025), acciones: int = 30, recursos: int = 6,
+            semilla: int = 42, objectid: float = 0.5, huerfanos: float = 0.05, limpiar: bool = False) -> dict:
+    """Siembra los datos en `db` (Database sync de pymongo o mongomock).
+
+    Devuelve un resumen con los ids generados, que usa el harness para
+    elegir PMEs y acciones sobre los que medir.
+    """
+    if limpiar:
+        for nombre in ("colegios", "pme", "acciones", "recursos", "pme_resumen"):
+            db[nombre].delete_many({})
+
+    gen = Generador(semilla, objectid, huerfanos)
+    resumen = {"colegios": [], "pmes": [], "acciones": 0, "recursos": 0, "huerfanos": 0}
+    for c in range(colegios):
+        colegio = gen.colegio(c)
+        db["colegios"].insert_one(colegio)
+        resumen["colegios"].append(str(colegio["_id"]))
+
+        for year in years:
+            pme = gen.pme(str(colegio["_id"]), year)
+            db["pme"].insert_one(pme)
+            # Las referencias (id_pme, id_colegio) se guardan siempre como string
+            id_pme = str(pme["_id"])
+
+            docs_acc = [gen.accion(id_pme, year, i) for i in range(acciones)]
+            docs_rec = [gen.recurso(id_pme, year, acc["uuid_accion"], j)
+                        for acc in docs_acc for j in range(recursos)]
+            uuids = {acc["uuid_accion"] for acc in docs_acc}
+            _insertar(db["acciones"], docs_acc)
+            _insertar(db["recursos"], docs_rec)
+
+            resumen["pmes"].append({"id_pme": id_pme, "id_colegio": str(colegio["_id"]), "year": year,
+                                    "uuid_accion": docs_acc[0]["uuid_accion"] if docs_acc else None})
+            resumen["acciones"] += len(docs_acc)
+            resumen["recursos"] += len(docs_rec)
+            resumen["huerfanos"] += sum(1 for r in docs_rec if r["uuid_accion"] not in uuids)
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--colegios", type=int, default=5)
+    parser.add_argument("--years", default="2024,2025", help="lista separada por comas")
+    parser.add_argument("--acciones", type=int, default=30, help="acciones por PME")
+    parser.add_argument("--recursos", type=int, default=6, help="recursos por acción")
+    parser.add_argument("--objectid", type=float, default=0.5, help="fracción de _id ObjectId")
+    parser.add_argument("--huerfanos", type=float, default=0.05, help="fracción de recursos huérfanos")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--limpiar", action="store_true", help="vacía las colecciones antes de sembrar")
+    parser.add_argument("--planilla", choices=sorted(COLUMNAS_PLANILLA), help="solo genera una planilla .xlsx")
+    parser.add_argument("--filas", type=int, default=1000)
+    parser.add_argument("--salida", default="planilla.xlsx")
+    args = parser.parse_args()
+
+    if args.planilla:
+        gen = Generador(args.semilla, args.objectid, args.huerfanos)
+        with open(args.salida, "wb") as f:
+            f.write(gen.planilla(args.planilla, args.filas, [gen.uuid() for _ in range(50)]))
+        print(json.dumps({"planilla": args.planilla, "filas": args.filas, "salida": args.salida}))
+        sys.exit(0)
+
+    from pymongo import MongoClient
+    from database import DB_NAME, MONGO_URI, opciones_cliente
+
+    cliente = MongoClient(MONGO_URI, **opciones_cliente())
+    try:
+        res = sembrar(cliente[DB_NAME], args.colegios, [int(y) for y in args.years.split(",")], args.acciones,
+                      args.recursos, args.semilla, args.objectid, args.huerfanos, args.limpiar)
+    finally:
+        cliente.close()
+    print(json.dumps({k: (len(v) if isinstance(v, list) else v) for k, v in res.items()}, indent=2))
@@ -0,0 +1,237 @@
+"""Adaptador mínimo para correr el backend sobre mongomock (sin mongod).
+
+    from benchmarks import mongomock_async
+    mongomock_async.instalar()      # antes de importar database / backend
+
+Reemplaza pymongo.AsyncMongoClient por un cliente que envuelve un
+mongomock.MongoClient compartido, con la misma superficie async que usa
+el backend (find().to_list(), async for, await aggregate(...), etc.).
+Sirve para comparar el costo en Python de un cambio (serialización,
+validación, armado de respuestas); las latencias de E/S solo son
+representativas contra un mongod real.
+
+Limitaciones de mongomock: sin transacciones (el clonador usa su camino
+compensado) y sin $lookup con `pipeline`; los $lookup con localField y
+un pipeline de $match por igualdad + $limit se traducen a localField +
+$filter, que es lo que usa detalle.py. Un $merge final se emula
+insertando o actualizando cada resultado por los campos de `on`
+(rollups.py). La vista de una instantánea (instantaneas.py) usa
+operadores que mongomock no implementa: $indexOfArray sobre un arreglo
+literal pasa a $cond anidados, $$REMOVE a un campo inexistente y la
+etapa $unset a un $project de exclusión. bulk_write aplica las
+operaciones una a una (mongomock no acepta las de pymongo 4.x).
+"""
+import types
+
+import pymongo
+from pymongo.errors import BulkWriteError
+
+try:
+    import mongomock
+except ImportError:  # pragma: no cover
+    mongomock = None
+
+_CLIENTE = None
+
+
+def cliente_compartido():
+    """mongomock.MongoClient que ven el backend y el generador de datos."""
+    global _CLIENTE
+    if mongomock is None:
+        raise RuntimeError("mongomock no está instalado: pip install mongomock")
+    if _CLIENTE is None:
+        _CLIENTE = mongomock.MongoClient()
+    return _CLIENTE
+
+
+def _traducir_lookup(pipeline: list) -> list:
+    traducido = []
+    for etapa in pipeline:
+        lookup = etapa.get("$lookup")
+        if not lookup or "pipeline" not in lookup or "localField" not in lookup:
+            traducido.append(etapa)
+            continue
+        lookup = dict(lookup)
+        interno = lookup.pop("pipeline")
+        traducido.append({"$lookup": lookup})
+        condiciones = [
+            {"$eq": [f"$$x.{campo}", valor]}
+            for sub in interno if "$match" in sub
+            for campo, valor in sub["$match"].items()
+        ]
+        limite = next((sub["$limit"] for sub in interno if "$limit" in sub), None)
+        filtrado = {"$filter": {"input": f"${lookup['as']}", "as": "x", "cond": {"$and": condiciones}}}
+        if limite is not None:
+            filtrado = {"$slice": [filtrado, limite]}
+        traducido.append({"$addFields": {lookup["as"]: filtrado}})
+    return traducido
+
+
+def _traducir_expresiones(valor):
+    if isinstance(valor, list):
+        return [_traducir_expresiones(v) for v in valor]
+    if isinstance(valor, dict):
+        if isinstance(valor.get("$unset"), list):
+            return {"$project": {campo: 0 for campo in valor["$unset"]}}
+        if "$indexOfArray" in valor:
+            arreglo, expresion = valor["$indexOfArray"]
+            resultado = -1
+            for i in reversed(range(len(arreglo))):
+                resultado = {"$cond": [{"$eq": [expresion, arreglo[i]]}, i, resultado]}
+            return resultado
+        return {k: _traducir_expresiones(v) for k, v in valor.items()}
+    if valor == "$$REMOVE":
+        # Un campo que no existe: $set/$addFields no lo agrega
+        return "$__sin_campo__"
+    return valor
+
+
+def _traducir(pipeline: list) -> list:
+    return _traducir_lookup([_traducir_expresiones(etapa) for etapa in pipeline])
+
+
+class _Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._iter = None
+
+    def sort(self, *a, **k):
+        self._cursor = self._cursor.sort(*a, **k)
+        return self
+
+    def skip(self, n):
+        self._cursor = self._cursor.skip(n)
+        return self
+
+    def limit(self, n):
+        self._cursor = self._cursor.limit(n)
+        return self
+
+    def batch_size(self, _):
+        return self
+
+    async def to_list(self, length=None):
+        docs = list(self._cursor)
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iter is None:
+            self._iter = iter(self._cursor)
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def next(self):
+        return await self.__anext__()
+
+    async def close(self):
+        pass
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": "MOCK"}}}
+
+
+class _Coleccion:
+    def __init__(self, col):
+        self._col = col
+        self.name = col.name
+
+    def find(self, *a, **k):
+        k.pop("session", None)
+        return _Cursor(self._col.find(*a, **k))
+
+    async def aggregate(self, pipeline, **k):
+        if pipeline and "$merge" in pipeline[-1]:
+            return self._merge(pipeline[:-1], pipeline[-1]["$merge"])
+        return _Cursor(iter(self._col.aggregate(_traducir(pipeline))))
+
+    def _merge(self, pipeline, etapa):
+        destino = self._col.database[etapa["into"]]
+        for doc in self._col.aggregate(_traducir(pipeline)):
+            filtro = {c: doc.get(c) for c in etapa.get("on", ["_id"])}
+            cambios = {c: v for c, v in doc.items() if c != "_id"}
+            if not destino.update_one(filtro, {"$set": cambios}).matched_count:
+                destino.insert_one(doc)
+        return _Cursor(iter([]))
+
+    async def bulk_write(self, operaciones, ordered=True, **k):
+        cuenta = dict.fromkeys(("inserted_count", "matched_count", "modified_count", "deleted_count",
+                                "upserted_count"), 0)
+        errores = []
+        for i, op in enumerate(operaciones):
+            tipo = type(op).__name__
+            try:
+                if tipo == "InsertOne":
+                    self._col.insert_one(op._doc)
+                    cuenta["inserted_count"] += 1
+                    continue
+                if tipo in ("DeleteOne", "DeleteMany"):
+                    borrar = self._col.delete_one if tipo == "DeleteOne" else self._col.delete_many
+                    cuenta["deleted_count"] += borrar(op._filter).deleted_count
+                    continue
+                if tipo == "ReplaceOne":
+                    res = self._col.replace_one(op._filter, op._doc, upsert=bool(op._upsert))
+                else:
+                    actualizar = self._col.update_one if tipo == "UpdateOne" else self._col.update_many
+                    res = actualizar(op._filter, op._doc, upsert=bool(op._upsert))
+                cuenta["matched_count"] += res.matched_count
+                cuenta["modified_count"] += res.modified_count
+                cuenta["upserted_count"] += res.upserted_id is not None
+            except Exception as e:
+                errores.append({"index": i, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errores:
+            raise BulkWriteError({"writeErrors": errores, "nInserted": cuenta["inserted_count"],
+                                  "nMatched": cuenta["matched_count"], "nRemoved": cuenta["deleted_count"]})
+        return types.SimpleNamespace(**cuenta)
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self._col, nombre)
+
+        async def envuelto(*a, **k):
+            k.pop("session", None)
+            return metodo(*a, **k)
+        return envuelto
+
+
+class _BaseDatos:
+    def __init__(self, db):
+        self._db = db
+        self.name = db.name
+
+    def __getitem__(self, nombre):
+        return _Coleccion(self._db[nombre])
+
+    async def command(self, comando, *a, **k):
+        if comando in ("ping", "hello"):
+            return {"ok": 1.0}
+        return self._db.command(comando, *a, **k)
+
+    async def list_collection_names(self):
+        return self._db.list_collection_names()
+
+
+class ClienteAsync:
+    def __init__(self, *a, **k):
+        self._cliente = cliente_compartido()
+        self.admin = _BaseDatos(self._cliente["admin"])
+
+    def __getitem__(self, nombre):
+        return _BaseDatos(self._cliente[nombre])
+
+    async def aconnect(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def instalar():
+    """Debe llamarse antes de importar database.py (que importa AsyncMongoClient)."""
+    cliente_compartido()
+    pymongo.AsyncMongoClient = ClienteAsync
@@ -0,0 +1,76 @@
+"""Microbenchmark de serialización de listados: camino anterior
+(loop str(_id) + jsonable_encoder + json) contra orjson con `default`.
+
+    python -m benchmarks.serializacion --docs 5000 --repeticiones 20
+
+Usa documentos sintéticos con la forma de un recurso (ObjectId, datetime,
+listas). Imprime un JSON con el tiempo medio por respuesta de cada camino.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from serializacion import a_json  # noqa: E402
+
+
+def generar_docs(n: int) -> list:
+    base = datetime(2025, 3, 1)
+    return [{
+        "_id": ObjectId() if i % 2 else str(ObjectId()),
+        "id_pme": "65f0c0ffee0000000000abcd",
+        "uuid_accion": f"uuid-{i % 50}",
+        "nombre_actividad": f"Actividad {i}",
+        "descripcion_actividad": "Descripción de la actividad con tildes y ñ " * 3,
+        "responsable": "UTP",
+        "medios_ver": "Acta, registro fotográfico",
+        "recursos_actividad": ["Insumo A", "Insumo B", "Insumo C"],
+        "monto": 10000 + i,
+        "year": 2025,
+        "fecha": base + timedelta(minutes=i),
+    } for i in range(n)]
+
+
+def camino_anterior(docs: list) -> bytes:
+    for d in docs:
+        d["_id"] = str(d["_id"])
+    contenido = jsonable_encoder(docs)
+    return json.dumps(contenido, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def camino_orjson(docs: list) -> bytes:
+    return a_json(docs)
+
+
+def medir(funcion, n_docs: int, repeticiones: int) -> dict:
+    tiempos = []
+    for _ in range(repeticiones):
+        docs = generar_docs(n_docs)  # el camino anterior muta los documentos
+        t0 = time.perf_counter()
+        funcion(docs)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return {
+        "camino": funcion.__name__,
+        "docs": n_docs,
+        "media_ms": round(statistics.mean(tiempos), 2),
+        "p50_ms": round(statistics.median(tiempos), 2),
+        "min_ms": round(min(tiempos), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    resultados = [medir(f, args.docs, args.repeticiones) for f in (camino_anterior, camino_orjson)]
+    resultados.append({"aceleracion": round(resultados[0]["media_ms"] / resultados[1]["media_ms"], 1)})
+    print(json.dumps(resultados, indent=2))
@@ -0,0 +1,145 @@
+"""Benchmark de transporte: bytes en el cable y tiempo de carga con y sin
+compresión, para los estáticos del frontend y los listados de la API.
+
+    python -m benchmarks.transporte --mongomock
+    python -m benchmarks.transporte --mongomock --mbps 2 --rtt-ms 80 --salida transporte.json
+
+Estáticos: index.html y script.js tal cual (antes) contra lo que deja
+frontend/construir.sh (gzip -9, después). API: cada listado se pide a la
+app en proceso con `Accept-Encoding: identity` (antes) y `gzip`
+(después); se miden los bytes recibidos y la latencia del servidor, que
+incluye comprimir (ver backend/compresion.py).
+
+El tiempo estimado es latencia + rtt + bytes / ancho de banda (--mbps,
+por defecto 2 Mbps: la red compartida de un colegio). Con mongod o con
+--mongomock valen las mismas opciones de base que benchmarks.endpoints.
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.endpoints import RAIZ, _base_sync, _commit, _preparar_entorno, autenticar, esperar_listo, percentil
+
+ESTATICOS = ["index.html", "script.js"]
+CODIFICACIONES = {"antes": "identity", "despues": "gzip"}
+
+
+def estimar_ms(bytes_: int, args, latencia_ms: float = 0.0) -> float:
+    return round(latencia_ms + args.rtt_ms + bytes_ * 8 / (args.mbps * 1000), 1)
+
+
+def medir_estaticos(args) -> list:
+    resultados = []
+    for nombre in ESTATICOS:
+        with open(os.path.join(RAIZ, "frontend", nombre), "rb") as f:
+            crudo = f.read()
+        comprimido = gzip.compress(crudo, compresslevel=9)
+        resultados.append({
+            "recurso": f"frontend/{nombre}",
+            "antes": {"bytes": len(crudo), "ms_estimado": estimar_ms(len(crudo), args)},
+            "despues": {"bytes": len(comprimido), "ms_estimado": estimar_ms(len(comprimido), args)},
+            "razon_bytes": round(len(comprimido) / len(crudo), 3),
+        })
+    return resultados
+
+
+async def medir_ruta(http, ruta: str, codificacion: str, repeticiones: int, args) -> dict:
+    latencias, bytes_ = [], 0
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resp = await http.get(ruta, headers={"Accept-Encoding": codificacion})
+        latencias.append((time.perf_counter() - t0) * 1000)
+        resp.raise_for_status()
+        # Bytes tal como llegaron (httpx descomprime .content)
+        bytes_ = resp.num_bytes_downloaded
+    p50 = statistics.median(latencias)
+    return {"bytes": bytes_, "p50_ms": round(p50, 2), "p95_ms": round(percentil(latencias, 95), 2),
+            "ms_estimado": estimar_ms(bytes_, args, p50)}
+
+
+async def medir_api(http, datos: dict, args) -> list:
+    pme = datos["pmes"][0]
+    rutas = {
+        "listar_acciones": f"/api/acciones/{pme['id_pme']}",
+        "listar_recursos_pme": f"/api/recursos/pme/{pme['id_pme']}",
+        "detalle_recursos_pme": f"/api/recursos/pme/{pme['id_pme']}/detalle",
+        "exportar_acciones_csv": f"/api/acciones/exportar/{pme['id_pme']}?formato=csv",
+    }
+    resultados = []
+    for nombre, ruta in rutas.items():
+        print(f"⏱️ {nombre}...", file=sys.stderr)
+        fila = {"recurso": nombre}
+        for fase, codificacion in CODIFICACIONES.items():
+            fila[fase] = await medir_ruta(http, ruta, codificacion, args.repeticiones, args)
+        fila["razon_bytes"] = round(fila["despues"]["bytes"] / fila["antes"]["bytes"], 3)
+        fila["razon_ms_estimado"] = round(fila["despues"]["ms_estimado"] / fila["antes"]["ms_estimado"], 3)
+        resultados.append(fila)
+    return resultados
+
+
+async def correr(args) -> dict:
+    _preparar_entorno(args)
+    import httpx
+    from benchmarks.generador import sembrar
+
+    cliente_sync, db = _base_sync(args)
+    sembrado = sembrar(db, 1, [2025], args.acciones, args.recursos, args.semilla, 0.5, 0.05, limpiar=True)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            import backend as app_backend
+            app = app_backend.app
+            async with app.router.lifespan_context(app):
+                transporte = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark", timeout=None) as http:
+                    await esperar_listo(http)
+                    await autenticar(http)
+                    api = await medir_api(http, sembrado, args)
+    finally:
+        if not args.conservar:
+            for nombre in db.list_collection_names():
+                db[nombre].drop()
+        if cliente_sync is not None:
+            cliente_sync.close()
+
+    return {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "mongo": "mongomock" if args.mongomock else "mongod",
+            "red": {"mbps": args.mbps, "rtt_ms": args.rtt_ms},
+            "parametros": {"acciones_por_pme": args.acciones, "recursos_por_accion": args.recursos,
+                           "repeticiones": args.repeticiones},
+        },
+        "estaticos": medir_estaticos(args),
+        "api": api,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongomock", action="store_true", help="usa mongomock en memoria en vez de MONGO_URI")
+    parser.add_argument("--db", default="pme_benchmark", help="base de datos de la corrida (se vacía)")
+    parser.add_argument("--acciones", type=int, default=60, help="acciones del PME medido")
+    parser.add_argument("--recursos", type=int, default=8, help="recursos por acción")
+    parser.add_argument("--repeticiones", type=int, default=20, help="peticiones por ruta y codificación")
+    parser.add_argument("--mbps", type=float, default=2.0, help="ancho de banda para el tiempo estimado")
+    parser.add_argument("--rtt-ms", type=float, default=80.0, help="ida y vuelta de red para el tiempo estimado")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--sin-cache", action="store_true", help="desactiva la caché de lecturas (CACHE_TTL_SEGUNDOS=0)")
+    parser.add_argument("--conservar", action="store_true", help="no borra la base al terminar")
+    parser.add_argument("--salida", help="archivo JSON de resultados (además de stdout)")
+    args = parser.parse_args()
+
+    informe = asyncio.run(correr(args))
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    print(texto)
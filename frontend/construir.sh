@@ -0,0 +1,22 @@
+#!/bin/sh
+# Archivos que sirve nginx en producción (ver Dockerfile y nginx.conf):
+#   script.<hash>.js   nombre con el hash del contenido: se cachea un año
+#   index.html         apunta a ese nombre; se revalida en cada carga
+#   *.gz               precomprimidos (gzip -9) que nginx envía con gzip_static
+#
+#   sh construir.sh [destino]    (por defecto ./dist)
+set -eu
+
+ORIGEN=$(cd "$(dirname "$0")" && pwd)
+DESTINO=${1:-$ORIGEN/dist}
+mkdir -p "$DESTINO"
+
+HASH=$(sha256sum "$ORIGEN/script.js" | cut -c1-12)
+cp "$ORIGEN/script.js" "$DESTINO/script.$HASH.js"
+sed "s|src=\"script.js\"|src=\"script.$HASH.js\"|" "$ORIGEN/index.html" > "$DESTINO/index.html"
+grep -q "script.$HASH.js" "$DESTINO/index.html" || { echo "index.html no referencia script.js" >&2; exit 1; }
+
+for f in "$DESTINO/index.html" "$DESTINO/script.$HASH.js"; do
+  gzip -9 -c "$f" > "$f.gz"
+done
+echo "script.$HASH.js"
@@ -13,15 +13,26 @@ const txt = (id, t) => {
     }
 };
 
+// Cabecera con el token de la sesión (lo emite /login y expira)
+function authHeaders(extra = {}) {
+    const token = AppState.user && AppState.user.token;
+    return token ? { ...extra, 'Authorization': `Bearer ${token}` } : extra;
+}
+
 // Wrapper genérico para peticiones API
 async function apiCall(endpoint, method = 'GET', body = null, isFile = false) {
-    const options = { method };
+    const options = { method, headers: authHeaders() };
     if (body) {
         options.body = isFile ? body : JSON.stringify(body);
-        if (!isFile) options.headers = { 'Content-Type': 'application/json' };
+        if (!isFile) options.headers['Content-Type'] = 'application/json';
     }
     try {
         const res = await fetch(`${API}${endpoint}`, options);
+        if (res.status === 401 && AppState.user) {
+            // Token vencido: se vuelve a pedir el login
+            AppState.user = null;
+            toggleModal("modal-login", true);
+        }
         if (!res.ok) {
             // Intentar leer error como JSON, sino texto plano
             const errorText = await res.text();
@@ -60,6 +71,8 @@ function truncarTexto(texto, largo = 50) {
 // --- ESTADO GLOBAL ---
 const AppState = {
     // ... resto del estado ...
+    // Sincronización incremental: token de /cambios y qué listas del PME están completas
+    sync: { idPme: null, token: null, acciones: false, recursos: false },
     config: {
         sidebarOpen: true,
         colsAcciones: { num: true, nombre: true, dimension: true, monto: true, opciones: true },
@@ -285,7 +298,9 @@ async function procesarPME(clonar) {
         year: parseInt(val("pme-year")),
         director: director,
         observacion: obs,
-        clonar: clonar // TRUE (Botón Copiar) o FALSE (Botón Vacío)
+        clonar: clonar, // TRUE (Botón Copiar) o FALSE (Botón Vacío)
+        // Copia por referencia: cada acción o recurso se copia al editarlo
+        instantanea: clonar && $("pme-instantanea").checked
     };
 
     const btn = event.currentTarget; // Botón que se presionó
@@ -300,7 +315,9 @@ async function procesarPME(clonar) {
         
         let msg = "✅ PME Creado exitosamente.";
         if(clonar) {
-            msg += `\n📥 Se clonaron ${data.copiados} acciones del año anterior.`;
+            msg += data.instantanea
+                ? `\n📥 El año usa los datos del año anterior; cada acción se copia al editarla.`
+                : `\n📥 Se clonaron ${data.copiados} acciones del año anterior.`;
         } else {
             msg += `\n📄 Se creó un PME vacío.`;
         }
@@ -516,7 +533,9 @@ async function cargarAcciones() {
     $("loading-acciones").classList.remove("hidden-section");
     $("tabla-acciones").innerHTML = "";
     try {
-        AppState.acciones = await apiCall(`/acciones/${AppState.idPme}`);
+        const [acciones] = await Promise.all([apiCall(`/acciones/${AppState.idPme}`), prepararSync()]);
+        AppState.acciones = acciones;
+        AppState.sync.acciones = true;
         renderizarTablaAcciones(AppState.acciones);
     } catch (e) {} finally { $("loading-acciones").classList.add("hidden-section"); }
 }
@@ -630,15 +649,15 @@ async function guardarAccion(e) {
     try {
         await apiCall(url, method, payload);
         toggleModal("modal-accion", false);
-        cargarAcciones();
+        sincronizarCambios();
     } catch (e) { alert("Error al guardar acción"); }
 }
 
 async function eliminarAccion(uuid) {
     if (confirm("¿Estás seguro? Se borrará la acción y sus actividades.")) {
         try {
-            await apiCall(`/acciones/${uuid}`, "DELETE");
-            cargarAcciones();
+            await apiCall(`/acciones/${uuid}?id_pme=${AppState.idPme}`, "DELETE");
+            sincronizarCambios();
         } catch(e) { alert("Error eliminando"); }
     }
 }
@@ -651,7 +670,7 @@ async function descargarExcelAcciones() {
     btn.disabled = true; btn.innerHTML = "⏳";
 
     try {
-        const res = await fetch(`${API}/acciones/exportar/${AppState.idPme}`);
+        const res = await fetch(`${API}/acciones/exportar/${AppState.idPme}`, { headers: authHeaders() });
         if(!res.ok) throw await res.json();
         const blob = await res.blob();
         
@@ -684,7 +703,7 @@ async function cargarRecursos(uuidAccion) {
     const tbody = $("tabla-recursos");
     tbody.innerHTML = `<tr><td colspan="5" class="p-8 text-center text-gray-500">Cargando...</td></tr>`;
     try {
-        const data = await apiCall(`/recursos/${uuidAccion}`);
+        const data = await apiCall(`/recursos/${uuidAccion}?id_pme=${AppState.idPme}`);
         
         // --- CAMBIO IMPORTANTE: Guardamos en memoria ---
         AppState.recursosDetalle = data; 
@@ -738,7 +757,10 @@ async function cargarTodosRecursos() {
         if (AppState.acciones.length === 0) {
             AppState.acciones = await apiCall(`/acciones/${AppState.idPme}`);
         }
-        AppState.recursosGlobales = await apiCall(`/recursos/pme/${AppState.idPme}`);
+        // Recursos ya unidos con su acción padre (rec.accion) y la marca rec.huerfano
+        const [recursos] = await Promise.all([apiCall(`/recursos/pme/${AppState.idPme}/detalle`), prepararSync()]);
+        AppState.recursosGlobales = recursos;
+        AppState.sync.recursos = true;
         renderizarTablaRecursosGlobal(AppState.recursosGlobales);
     } catch (e) { console.error(e); } 
     finally { loading.classList.add("hidden-section"); }
@@ -768,7 +790,7 @@ function renderizarTablaRecursosGlobal(lista) {
     }
 
     lista.forEach((rec) => {
-        const accionPadre = AppState.acciones.find(a => a.uuid_accion === rec.uuid_accion);
+        const accionPadre = rec.accion;
         const nombreAccion = accionPadre ? `<span class="font-medium text-blue-800">${accionPadre.nombre_accion}</span>` : `<span class="text-red-500 font-bold text-xs bg-red-100 px-2 py-1 rounded">Huérfano</span>`;
         const descAccionTexto = accionPadre ? accionPadre.descripcion : "";
         const monto = rec.monto ? rec.monto.toLocaleString("es-CL") : "0";
@@ -811,8 +833,8 @@ function filtrarTablaRecursosGlobal() {
 
     // 2. Filtrar
     const filtrados = AppState.recursosGlobales.filter(rec => {
-        // Preparar datos
-        const accionPadre = AppState.acciones.find(a => a.uuid_accion === rec.uuid_accion);
+        // Preparar datos (la acción padre viene unida desde el backend)
+        const accionPadre = rec.accion;
         
         // Textos normalizados de cada campo
         const txtActividad = normalizarTexto(rec.nombre_actividad);
@@ -849,6 +871,69 @@ function filtrarTablaRecursosGlobal() {
 }
 
 
+// --- Sincronización incremental ---
+// Tras guardar o eliminar se piden solo los cambios desde el último token
+// (/pme/{id}/cambios) y se aplican sobre AppState, en vez de volver a
+// descargar todas las acciones y recursos del PME.
+
+async function prepararSync() {
+    // El token se pide junto con la carga completa: el servidor consulta con margen
+    const sync = AppState.sync;
+    if (sync.idPme === AppState.idPme && sync.token) return;
+    const r = await apiCall(`/pme/${AppState.idPme}/cambios`);
+    AppState.sync = { idPme: AppState.idPme, token: r.token, acciones: false, recursos: false };
+}
+
+async function sincronizarCambios() {
+    const sync = AppState.sync;
+    if (sync.idPme !== AppState.idPme || !sync.token) return recargarVistaPME();
+
+    let cambios;
+    try {
+        cambios = await apiCall(`/pme/${sync.idPme}/cambios?since=${sync.token}`);
+    } catch (e) { return recargarVistaPME(); }
+    // Token vencido o demasiados cambios: el servidor pide recargar todo
+    if (cambios.completo) return recargarVistaPME();
+
+    if (sync.acciones) {
+        AppState.acciones = aplicarCambios(AppState.acciones, cambios.acciones, cambios.eliminados.acciones);
+    }
+    if (sync.recursos) {
+        AppState.recursosGlobales = aplicarCambios(AppState.recursosGlobales, cambios.recursos, cambios.eliminados.recursos);
+        // Una acción editada o borrada cambia la columna "Acción Asociada" de recursos que no cambiaron
+        if (sync.acciones) unirAccionPadre(AppState.recursosGlobales, AppState.acciones);
+    }
+    sync.token = cambios.token;
+
+    if (!$("view-acciones").classList.contains("hidden-section")) filtrarTabla();
+    if (!$("view-gestion-recursos").classList.contains("hidden-section")) filtrarTablaRecursosGlobal();
+}
+
+function aplicarCambios(lista, cambiados, eliminados) {
+    // Por _id: un mismo cambio puede llegar dos veces sin duplicarse
+    const porId = new Map(lista.map(d => [d._id, d]));
+    eliminados.forEach(id => porId.delete(id));
+    cambiados.forEach(d => porId.set(d._id, d));
+    return [...porId.values()];
+}
+
+function unirAccionPadre(recursos, acciones) {
+    // Igual que el $lookup del backend: la primera acción del PME con ese uuid
+    const padres = new Map();
+    acciones.forEach(a => { if (!padres.has(a.uuid_accion)) padres.set(a.uuid_accion, a); });
+    recursos.forEach(rec => {
+        const padre = padres.get(rec.uuid_accion);
+        rec.accion = padre ? { nombre_accion: padre.nombre_accion, descripcion: padre.descripcion, dimension: padre.dimension } : null;
+        rec.huerfano = !padre;
+    });
+}
+
+function recargarVistaPME() {
+    AppState.sync.token = null;
+    if (!$("view-acciones").classList.contains("hidden-section")) cargarAcciones();
+    if (!$("view-gestion-recursos").classList.contains("hidden-section")) cargarTodosRecursos();
+}
+
 // ==============================================================
 // 7. LÓGICA COMPARTIDA (Guardar, Eliminar, Asociar)
 // ==============================================================
@@ -883,7 +968,7 @@ async function guardarRecurso(e) {
         toggleModal("modal-recurso", false);
         
         if (!$("view-gestion-recursos").classList.contains("hidden-section")) {
-            cargarTodosRecursos();
+            sincronizarCambios();
         } else {
             cargarRecursos(AppState.accionSeleccionada.uuid_accion);
         }
@@ -892,15 +977,15 @@ async function guardarRecurso(e) {
 
 async function eliminarRecurso(id) {
     if (confirm("¿Eliminar actividad?")) {
-        await apiCall(`/recursos/${id}`, "DELETE");
+        await apiCall(`/recursos/${id}?id_pme=${AppState.idPme}`, "DELETE");
         cargarRecursos(AppState.accionSeleccionada.uuid_accion);
     }
 }
 
 async function eliminarRecursoGlobal(id) {
     if (confirm("¿Eliminar actividad definitivamente?")) {
-        await apiCall(`/recursos/${id}`, "DELETE");
-        cargarTodosRecursos();
+        await apiCall(`/recursos/${id}?id_pme=${AppState.idPme}`, "DELETE");
+        sincronizarCambios();
     }
 }
 
@@ -931,6 +1016,12 @@ function abrirModalAsociar(recurso) {
         if (acc.uuid_accion === recurso.uuid_accion) option.selected = true;
         select.appendChild(option);
     });
+
+    // Con un huérfano se ofrece asociar de una vez todos los del PME
+    const otros = recurso.huerfano ? AppState.recursosGlobales.filter(r => r.huerfano && r._id !== recurso._id).length : 0;
+    $("asoc-todos-huerfanos").checked = false;
+    txt("asoc-n-huerfanos", otros);
+    $("asoc-huerfanos-opcion").classList.toggle("hidden", otros === 0);
     toggleModal("modal-asociar", true);
 }
 
@@ -943,20 +1034,18 @@ async function guardarAsociacion(e) {
 
     if (!accionNueva || !recursoOriginal) return alert("Error de datos.");
 
-    const payload = {
-        ...recursoOriginal,
-        id_pme: recursoOriginal.id_pme,
-        year: recursoOriginal.year,
-        recursos_actividad: recursoOriginal.recursos_actividad || [],
-        uuid_accion: uuidNueva, 
-        dimension: accionNueva.dimension
-    };
-    delete payload._id; 
+    // Un solo request para todos: el backend toma la dimensión de la acción destino
+    let ids = [idRecurso];
+    if ($("asoc-todos-huerfanos").checked) {
+        ids = ids.concat(AppState.recursosGlobales.filter(r => r.huerfano && r._id !== idRecurso).map(r => r._id));
+    }
+    const operaciones = ids.map(id => ({ op: "mover", id, uuid_accion: uuidNueva }));
 
     try {
-        await apiCall(`/recursos/${idRecurso}`, "PUT", payload);
+        const res = await apiCall(`/recursos/bulk`, "POST", { operaciones, id_pme: AppState.idPme });
         toggleModal("modal-asociar", false);
-        cargarTodosRecursos();
+        if (res.errores > 0) alert(`⚠️ ${res.errores} de ${res.total} actividades no se pudieron asociar.`);
+        sincronizarCambios();
     } catch (e) { alert("Error al asociar"); }
 }
 
@@ -1031,7 +1120,7 @@ async function guardarNuevoInsumo(e) {
         const vistaGlobalVisible = !$("view-gestion-recursos").classList.contains("hidden-section");
         
         if (vistaGlobalVisible) {
-            cargarTodosRecursos(); // Recargar tabla global
+            sincronizarCambios(); // Solo lo que cambió en la tabla global
         } else if (AppState.accionSeleccionada) {
             cargarRecursos(AppState.accionSeleccionada.uuid_accion); // Recargar tabla detalle
         } else {
@@ -1075,9 +1164,12 @@ async function subirExcelAcciones(e) {
     formData.append("file", file);
 
     try {
-        const url = `/acciones/importar_excel?id_pme=${AppState.idPme}&year=${AppState.year}`;
+        const modo = $("actualizar-excel").checked ? "actualizar" : "insertar";
+        const url = `/acciones/importar_excel?id_pme=${AppState.idPme}&year=${AppState.year}&modo=${modo}`;
         const data = await apiCall(url, "POST", formData, true); 
-        alert(`Éxito: ${data.total_registrados} registros.`);
+        alert(modo === "actualizar"
+            ? `Éxito: ${data.insertados} nuevas, ${data.actualizados} actualizadas, ${data.sin_cambios} sin cambios.`
+            : `Éxito: ${data.total_registrados} registros.`);
         toggleModal("modal-importar", false);
         cargarAcciones();
     } catch (e) { alert("Error: " + (e.detail || e)); }
@@ -1096,11 +1188,14 @@ async function subirExcelRecursos(e) {
     formData.append("file", file);
 
     try {
-        const url = `/recursos/importar_excel?id_pme=${AppState.idPme}&year=${AppState.year}`;
+        const modo = $("actualizar-excel-recursos").checked ? "actualizar" : "insertar";
+        const url = `/recursos/importar_excel?id_pme=${AppState.idPme}&year=${AppState.year}&modo=${modo}`;
         // NOTA: apiCall ya maneja blobs si retorna archivo, pero aqui retorna JSON
         const data = await apiCall(url, "POST", formData, true); 
         
-        let msg = `✅ Éxito: ${data.total_registrados} registros creados.`;
+        let msg = modo === "actualizar"
+            ? `✅ Éxito: ${data.insertados} creados, ${data.actualizados} actualizados, ${data.sin_cambios} sin cambios.`
+            : `✅ Éxito: ${data.total_registrados} registros creados.`;
         if(data.huérfanos > 0) {
             msg += `\n⚠️ Advertencia: ${data.huérfanos} actividades quedaron sin asignar (sin UUID Acción).`;
         }
@@ -1385,7 +1480,7 @@ async function generarCertificado(idRecurso) {
     if (!recurso && AppState.accionSeleccionada) {
         // Intentar buscar en la API si no lo tenemos a mano
         try {
-            const res = await apiCall(`/recursos/${AppState.accionSeleccionada.uuid_accion}`);
+            const res = await apiCall(`/recursos/${AppState.accionSeleccionada.uuid_accion}?id_pme=${AppState.idPme}`);
             recurso = res.find(r => r._id === idRecurso);
         } catch (e) { console.error(e); }
     }
@@ -1410,7 +1505,7 @@ async function generarCertificado(idRecurso) {
 // Helper para cargar dato si no está en memoria
 async function cargarYMostrarCertificado(id) {
     try {
-        const res = await apiCall(`/recursos/${AppState.accionSeleccionada.uuid_accion}`);
+        const res = await apiCall(`/recursos/${AppState.accionSeleccionada.uuid_accion}?id_pme=${AppState.idPme}`);
         const recurso = res.find(r => r._id === id);
         if(recurso) {
             mostrarModalCertificado(recurso);
@@ -1460,7 +1555,7 @@ async function generarPDFDesdeAPI(id) {
     // Buscamos la acción padre actual para obtener sus recursos
     if (AppState.accionSeleccionada) {
         try {
-            const res = await apiCall(`/recursos/${AppState.accionSeleccionada.uuid_accion}`);
+            const res = await apiCall(`/recursos/${AppState.accionSeleccionada.uuid_accion}?id_pme=${AppState.idPme}`);
             const recursoEncontrado = res.find(r => r._id === id);
             if(recursoEncontrado) {
                 crearPDF(recursoEncontrado);
@@ -1565,7 +1660,7 @@ async function descargarExcelAccionDetalle() {
     try {
         // 2. Fetch Blob
         const blob = await apiCall(
-            `/recursos/exportar_custom_accion/${uuid}`, 
+            `/recursos/exportar_custom_accion/${uuid}?id_pme=${AppState.idPme}`, 
             "POST", 
             { columnas: columnasSeleccionadas }
         );
@@ -1611,7 +1706,7 @@ async function descargarExcelRecursos() {
     try {
         const res = await fetch(`${API}/recursos/exportar_custom/${AppState.idPme}`, {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
+            headers: authHeaders({ "Content-Type": "application/json" }),
             body: JSON.stringify({ columnas: columnasSeleccionadas })
         });
         if(!res.ok) throw await res.json();
@@ -1630,6 +1725,34 @@ async function descargarExcelRecursos() {
     finally { btn.disabled = false; btn.innerHTML = original; }
 }
 
+// --- Certificados de todo el PME (ZIP generado en el servidor) ---
+async function descargarCertificadosPME() {
+    if (!AppState.idPme) return alert("Contexto no definido");
+    const btn = $("btn-certificados-pme");
+    const original = btn.innerHTML;
+    btn.disabled = true; btn.innerHTML = "⏳";
+
+    try {
+        const res = await fetch(`${API}/certificados/pme/${AppState.idPme}`, {
+            method: "POST",
+            headers: authHeaders({ "Content-Type": "application/json" }),
+            body: JSON.stringify({ campos: AppState.config.certFields })
+        });
+        if(!res.ok) throw await res.json();
+        const blob = await res.blob();
+
+        const url = window.URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = `Certificados_PME_${AppState.year}.zip`;
+        document.body.appendChild(a);
+        a.click();
+        window.URL.revokeObjectURL(url);
+        document.body.removeChild(a);
+    } catch(e) { alert("Error descarga: " + (e.detail || e)); }
+    finally { btn.disabled = false; btn.innerHTML = original; }
+}
+
 // --- UTILIDAD (Si no la tienes, agrégala) ---
 function normalizarTexto(texto) {
     if (!texto) return "";
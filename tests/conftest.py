@@ -0,0 +1,68 @@
+"""Pruebas de comportamiento del backend sobre mongomock (sin mongod).
+
+    pip install pytest mongomock httpx
+    python -m pytest -q
+
+La app corre en proceso con TestClient (lifespan completo: índices,
+usuarios sembrados, cola de trabajos) y con el adaptador de
+benchmarks/mongomock_async.py; ver ahí sus límites. Las pruebas
+comparten la base: cada una crea sus propios colegios y PME.
+"""
+import os
+import sys
+import time
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "backend"))
+
+# Antes de importar el backend (database.py lee el entorno al importarse)
+os.environ["DB_NAME"] = "pme_pruebas"
+os.environ.setdefault("ROLLUPS_INTERVALO_SEGUNDOS", "0")
+os.environ.setdefault("CACHE_TTL_SEGUNDOS", "0")
+
+from benchmarks import mongomock_async  # noqa: E402
+
+mongomock_async.instalar()
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import backend  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def cliente():
+    """TestClient autenticado como el administrador sembrado."""
+    with TestClient(backend.app) as c:
+        for _ in range(100):
+            if c.get("/readyz").status_code == 200:
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError("La app no quedó lista")
+        resp = c.post("/api/login", json={"perfil": "administrador", "contrasena": "admin123"})
+        resp.raise_for_status()
+        c.headers["Authorization"] = f"Bearer {resp.json()['token']}"
+        yield c
+
+
+@pytest.fixture
+def db(cliente):
+    """Base mongomock sync, para preparar y revisar datos por debajo de la API."""
+    return mongomock_async.cliente_compartido()[os.environ["DB_NAME"]]
+
+
+@pytest.fixture
+def nuevo_pme(cliente):
+    """Crea un colegio y devuelve una función que le agrega PME: nuevo_pme(year, **extra) -> id_pme."""
+    marca = uuid.uuid4().hex[:8]
+    id_colegio = cliente.post("/api/colegios", json={"nombre": f"Colegio {marca}", "rbd": marca, "rut": marca}).json()["id"]
+
+    def crear(year: int = 2025, **extra) -> str:
+        resp = cliente.post("/api/pme", json={"year": year, "id_colegio": id_colegio, "director": "d",
+                                              "observacion": "o", **extra})
+        resp.raise_for_status()
+        return resp.json()["id_pme"]
+    return crear
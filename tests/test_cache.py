@@ -0,0 +1,43 @@
+"""Caché de lecturas con varios workers: invalidar en uno deja obsoleta la entrada del otro."""
+import pytest
+
+import backend
+from cache import CacheLRU
+
+
+@pytest.fixture
+def workers(cliente, db):
+    yield CacheLRU(ttl=60, bd=backend.bd), CacheLRU(ttl=60, bd=backend.bd)
+    db.cache_versiones.delete_many({})
+
+
+def leer(cliente, cache: CacheLRU, clave: tuple):
+    versiones = cliente.portal.call(cache.versiones, clave)
+    return cache.obtener(clave, versiones), versiones
+
+
+def test_invalidar_en_un_worker_vale_para_el_otro(cliente, workers):
+    uno, otro = workers
+    clave = ("acciones", "P-cache", "")
+    _, versiones = leer(cliente, otro, clave)
+    otro.guardar(clave, [{"monto_sep": 1}], versiones)
+    assert leer(cliente, otro, clave)[0] is not None
+
+    cliente.portal.call(uno.invalidar_grupo, "acciones", "P-cache")
+
+    assert leer(cliente, otro, clave)[0] is None
+    assert otro.estadisticas()["obsoletos"] == 1
+
+
+def test_invalidar_otra_clave_no_afecta(cliente, workers):
+    uno, otro = workers
+    clave = ("pme_buscar", "C-cache", 2025)
+    _, versiones = leer(cliente, otro, clave)
+    otro.guardar(clave, {"exist": True}, versiones)
+
+    cliente.portal.call(uno.invalidar, ("pme_buscar", "C-cache", 2026))
+    assert leer(cliente, otro, clave)[0] is not None
+
+    # Invalidar el grupo completo alcanza a todas sus claves
+    cliente.portal.call(uno.invalidar_grupo, "pme_buscar")
+    assert leer(cliente, otro, clave)[0] is None
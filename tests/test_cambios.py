@@ -0,0 +1,68 @@
+"""/api/pme/{id}/cambios: marcas de eliminación para lo borrado o movido a otro PME."""
+
+
+def token(cliente, id_pme: str) -> str:
+    return cliente.get(f"/api/pme/{id_pme}/cambios").json()["token"]
+
+
+def cambios(cliente, id_pme: str, since: str) -> dict:
+    resp = cliente.get(f"/api/pme/{id_pme}/cambios", params={"since": since})
+    resp.raise_for_status()
+    return resp.json()
+
+
+def preparar(cliente, id_pme: str, year: int, n: int = 2):
+    uuid_a = cliente.post("/api/acciones", json={"id_pme": id_pme, "year": year, "nombre_accion": "A",
+                                                 "descripcion": "d", "dimension": "Gestión"}).json()["uuid"]
+    ids = [cliente.post("/api/recursos", json={"id_pme": id_pme, "year": year, "uuid_accion": uuid_a,
+                                               "nombre_actividad": f"R{i}", "monto": 10}).json()["id"] for i in range(n)]
+    return uuid_a, ids
+
+
+def test_sin_token_o_con_token_vencido_pide_carga_completa(cliente, nuevo_pme):
+    id_pme = nuevo_pme(2025)
+
+    assert cliente.get(f"/api/pme/{id_pme}/cambios").json()["completo"] is True
+    assert cambios(cliente, id_pme, "1")["completo"] is True
+    assert cambios(cliente, id_pme, "basura")["completo"] is True
+
+
+def test_eliminar_deja_marca_y_no_vuelve_como_cambio(cliente, nuevo_pme):
+    id_pme = nuevo_pme(2025)
+    _, (borrado, queda) = preparar(cliente, id_pme, 2025)
+    desde = token(cliente, id_pme)
+
+    assert cliente.delete(f"/api/recursos/{borrado}", params={"id_pme": id_pme}).status_code == 200
+    respuesta = cambios(cliente, id_pme, desde)
+
+    assert respuesta["completo"] is False
+    assert borrado in respuesta["eliminados"]["recursos"]
+    assert queda not in respuesta["eliminados"]["recursos"]
+    assert borrado not in [r["_id"] for r in respuesta["recursos"]]
+
+
+def test_mover_a_otro_pme_deja_marca_solo_en_el_origen(cliente, nuevo_pme):
+    origen, destino = nuevo_pme(2025), nuevo_pme(2026)
+    _, (movido, _) = preparar(cliente, origen, 2025)
+    uuid_destino, _ = preparar(cliente, destino, 2026, n=0)
+    desde_origen, desde_destino = token(cliente, origen), token(cliente, destino)
+
+    cliente.put(f"/api/recursos/{movido}", json={"id_pme": destino, "year": 2026, "uuid_accion": uuid_destino}) \
+        .raise_for_status()
+
+    assert movido in cambios(cliente, origen, desde_origen)["eliminados"]["recursos"]
+    en_destino = cambios(cliente, destino, desde_destino)
+    assert movido in [r["_id"] for r in en_destino["recursos"]]
+    assert movido not in en_destino["eliminados"]["recursos"]
+
+
+def test_eliminar_un_heredado_deja_marca_en_la_instantanea(cliente, nuevo_pme):
+    base = nuevo_pme(2024)
+    _, (heredado, _) = preparar(cliente, base, 2024)
+    anio = nuevo_pme(2025, clonar=True, instantanea=True)
+    desde_base, desde_anio = token(cliente, base), token(cliente, anio)
+
+    assert cliente.delete(f"/api/recursos/{heredado}", params={"id_pme": anio}).status_code == 200
+
+    assert heredado in cambios(cliente, anio, desde_anio)["eliminados"]["recursos"]
+    assert heredado not in cambios(cliente, base, desde_base)["eliminados"]["recursos"]
@@ -0,0 +1,46 @@
+"""POST /api/pme/clonar: solo copia a un PME destino vacío; repetirla no duplica."""
+from datetime import datetime, timedelta
+
+import clonacion
+import identificadores
+
+
+def preparar(cliente, nuevo_pme):
+    origen = nuevo_pme(2024)
+    uuid_a = cliente.post("/api/acciones", json={"id_pme": origen, "year": 2024, "nombre_accion": "A",
+                                                 "descripcion": "d", "dimension": "Gestión"}).json()["uuid"]
+    cliente.post("/api/recursos", json={"id_pme": origen, "year": 2024, "uuid_accion": uuid_a,
+                                        "nombre_actividad": "R", "monto": 10}).raise_for_status()
+    return origen, nuevo_pme(2025)
+
+
+def clonar(cliente, origen: str, destino: str, **params):
+    return cliente.post("/api/pme/clonar", params=params, json={"id_pme_origen": origen, "id_pme_destino": destino})
+
+
+def test_clonar_dos_veces_no_duplica(cliente, db, nuevo_pme):
+    origen, destino = preparar(cliente, nuevo_pme)
+
+    assert clonar(cliente, origen, destino).json()["acciones"] == 1
+    assert clonar(cliente, origen, destino).status_code == 409
+    assert clonar(cliente, origen, destino, segundo_plano=True).status_code == 409
+
+    assert db.acciones.count_documents({"id_pme": destino}) == 1
+    assert db.recursos.count_documents({"id_pme": destino}) == 1
+    # La reserva se libera al terminar, también cuando se rechaza
+    assert "clonando" not in db.pme.find_one(identificadores.filtro_id(destino))
+
+
+def test_clonacion_en_curso_rechaza_la_segunda(cliente, db, nuevo_pme):
+    origen, destino = preparar(cliente, nuevo_pme)
+    filtro = identificadores.filtro_id(destino)
+
+    db.pme.update_one(filtro, {"$set": {"clonando": datetime.now()}})
+    assert clonar(cliente, origen, destino).status_code == 409
+    assert db.acciones.count_documents({"id_pme": destino}) == 0
+
+    # Una reserva vencida (proceso caído a mitad de camino) no bloquea
+    vencida = datetime.now() - timedelta(seconds=clonacion.RESERVA_SEGUNDOS + 1)
+    db.pme.update_one(filtro, {"$set": {"clonando": vencida}})
+    assert clonar(cliente, origen, destino).status_code == 200
+    assert db.acciones.count_documents({"id_pme": destino}) == 1
@@ -0,0 +1,48 @@
+"""Migración de _id string a ObjectId: reanudación de un lote cortado y filtros sobre ids mezclados."""
+from bson import ObjectId
+
+import backend
+import identificadores
+
+
+def test_filtro_ids_encuentra_string_y_objectid_en_una_consulta(db):
+    como_string = str(ObjectId())
+    como_objectid = ObjectId()
+    db.recursos.insert_many([{"_id": como_string, "id_pme": "P-mezcla"}, {"_id": como_objectid, "id_pme": "P-mezcla"}])
+
+    filtro = identificadores.filtro_ids([como_string, str(como_objectid)])
+
+    assert {str(d["_id"]) for d in db.recursos.find(filtro)} == {como_string, str(como_objectid)}
+    # Un id que llega como ObjectId también encuentra su versión string sin migrar
+    assert db.recursos.find_one(identificadores.filtro_id(ObjectId(como_string)))["_id"] == como_string
+    db.recursos.delete_many({"id_pme": "P-mezcla"})
+
+
+def test_migracion_termina_el_lote_cortado_y_actualiza_referencias(cliente, db):
+    ids = [str(ObjectId()) for _ in range(5)]
+    db.recursos.insert_many([{"_id": i, "id_pme": "P-migrar", "monto": n} for n, i in enumerate(ids)])
+    # Copia de una instantánea y raíz oculta que apuntan al primero por su _id string
+    db.recursos.insert_one({"_id": ObjectId(), "id_pme": "P-hija", "origen": ids[0], "monto": 0})
+    id_hija = ObjectId()
+    db.pme.insert_one({"_id": id_hija, "id_colegio": "C-migrar", "year": 2030, "ocultos": {"recursos": [ids[1]]}})
+
+    # Corrida anterior cortada a mitad de lote: el original ya se borró y solo queda el respaldo
+    cortado = db.recursos.find_one({"_id": ids[0]})
+    db[identificadores.RESPALDO].insert_one(
+        {"_id": ObjectId(ids[0]), "coleccion": "recursos", "doc": {**cortado, "_id": ObjectId(ids[0])}})
+    db.recursos.delete_one({"_id": ids[0]})
+
+    migrador = identificadores.MigradorIds(backend.bd, tamano_lote=2)
+    cliente.portal.call(migrador.migrar, "recursos")
+
+    migrados = list(db.recursos.find({"id_pme": "P-migrar"}).sort("monto", 1))
+    assert [d["_id"] for d in migrados] == [ObjectId(i) for i in ids]
+    assert db.recursos.count_documents({"_id": {"$type": "string"}}) == 0
+    assert db[identificadores.RESPALDO].count_documents({}) == 0
+    assert db.recursos.find_one({"id_pme": "P-hija"})["origen"] == ObjectId(ids[0])
+    assert db.pme.find_one({"_id": id_hija})["ocultos"]["recursos"] == [ObjectId(ids[1])]
+
+    # Volver a correrla no mueve nada
+    assert cliente.portal.call(migrador.migrar, "recursos") == 0
+    db.recursos.delete_many({"id_pme": {"$in": ["P-migrar", "P-hija"]}})
+    db.pme.delete_one({"_id": id_hija})
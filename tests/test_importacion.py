@@ -0,0 +1,63 @@
+"""Importación en modo "actualizar": volver a subir la misma planilla no duplica ni reescribe."""
+import io
+
+from openpyxl import Workbook
+
+ENCABEZADO = ["uuid_accion", "nombre_actividad", "descripcion_actividad", "monto", "recursos_actividad"]
+
+
+def planilla(filas: list) -> bytes:
+    wb = Workbook()
+    wb.active.append(ENCABEZADO)
+    for fila in filas:
+        wb.active.append(fila)
+    salida = io.BytesIO()
+    wb.save(salida)
+    return salida.getvalue()
+
+
+def importar(cliente, id_pme: str, filas: list) -> dict:
+    resp = cliente.post("/api/recursos/importar_excel", params={"id_pme": id_pme, "year": 2025, "modo": "actualizar"},
+                        files={"file": ("recursos.xlsx", planilla(filas))})
+    resp.raise_for_status()
+    return resp.json()
+
+
+def conteos(reporte: dict) -> tuple:
+    return reporte["insertados"], reporte["actualizados"], reporte["sin_cambios"], reporte["total_rechazados"]
+
+
+def test_reimportar_la_misma_planilla_es_idempotente(cliente, db, nuevo_pme):
+    id_pme = nuevo_pme(2025)
+    # Dos filas con la misma clave (acción + nombre): se emparejan con dos documentos distintos
+    filas = [["u-1", "Taller", "d", 100, "a, b"], ["u-1", "Taller", "d", 100, "a, b"], ["u-2", "Salida", "d", 50, ""]]
+
+    assert conteos(importar(cliente, id_pme, filas)) == (3, 0, 0, 0)
+    fechas = {d["_id"]: d["fecha_actualizacion"] for d in db.recursos.find({"id_pme": id_pme})}
+
+    for _ in range(2):
+        reporte = importar(cliente, id_pme, filas)
+        assert conteos(reporte) == (0, 0, 3, 0)
+        assert reporte["total_registrados"] == 0
+    # Las filas sin cambios no se escribieron
+    assert {d["_id"]: d["fecha_actualizacion"] for d in db.recursos.find({"id_pme": id_pme})} == fechas
+    assert cliente.get(f"/api/pme/{id_pme}/resumen").json()["monto_recursos"] == 250
+
+
+def test_reimportar_con_cambios_actualiza_solo_esas_filas(cliente, db, nuevo_pme):
+    id_pme = nuevo_pme(2025)
+    filas = [["u-1", "Taller", "d", 100, ""], ["u-2", "Salida", "d", 50, ""]]
+    importar(cliente, id_pme, filas)
+    ids = {d["nombre_actividad"]: d["_id"] for d in db.recursos.find({"id_pme": id_pme})}
+
+    filas[1][3] = 75
+    filas.append(["u-3", "Nueva", "d", 5, ""])
+    reporte = importar(cliente, id_pme, filas)
+
+    assert conteos(reporte) == (1, 1, 1, 0)
+    assert reporte["total_registrados"] == 2
+    salida = db.recursos.find_one({"id_pme": id_pme, "nombre_actividad": "Salida"})
+    # Se actualizó el mismo documento (sin upsert de uno nuevo)
+    assert salida["_id"] == ids["Salida"] and salida["monto"] == 75
+    assert db.recursos.count_documents({"id_pme": id_pme}) == 3
+    assert cliente.get(f"/api/pme/{id_pme}/resumen").json()["monto_recursos"] == 180
@@ -0,0 +1,95 @@
+"""Instantáneas copy-on-write: lectura, escritura y eliminación desde el año que hereda."""
+
+
+def crear_accion(cliente, id_pme: str, year: int, nombre: str, monto_sep: int) -> str:
+    resp = cliente.post("/api/acciones", json={"id_pme": id_pme, "year": year, "nombre_accion": nombre,
+                                               "descripcion": "d", "dimension": "Gestión", "monto_sep": monto_sep})
+    resp.raise_for_status()
+    return resp.json()["uuid"]
+
+
+def editar_accion(cliente, uuid_accion: str, id_pme: str, year: int, monto_sep: int):
+    return cliente.put(f"/api/acciones/{uuid_accion}", json={
+        "id_pme": id_pme, "year": year, "nombre_accion": "A", "descripcion": "d", "dimension": "Gestión",
+        "monto_sep": monto_sep})
+
+
+def crear_recurso(cliente, id_pme: str, year: int, uuid_accion: str, nombre: str, monto: int) -> str:
+    resp = cliente.post("/api/recursos", json={"id_pme": id_pme, "year": year, "uuid_accion": uuid_accion,
+                                               "nombre_actividad": nombre, "monto": monto})
+    resp.raise_for_status()
+    return resp.json()["id"]
+
+
+def montos_acciones(cliente, id_pme: str) -> dict:
+    return {a["nombre_accion"]: a["monto_sep"] for a in cliente.get(f"/api/acciones/{id_pme}").json()}
+
+
+def montos_recursos(cliente, id_pme: str) -> dict:
+    return {r["nombre_actividad"]: r["monto"] for r in cliente.get(f"/api/recursos/pme/{id_pme}").json()}
+
+
+def preparar(cliente, nuevo_pme):
+    base = nuevo_pme(2024)
+    uuid_a = crear_accion(cliente, base, 2024, "A", 100)
+    crear_accion(cliente, base, 2024, "B", 50)
+    id_r = crear_recurso(cliente, base, 2024, uuid_a, "R", 10)
+    anio = nuevo_pme(2025, clonar=True, instantanea=True)
+    return base, anio, uuid_a, id_r
+
+
+def test_instantanea_lee_lo_heredado_sin_copiar(cliente, db, nuevo_pme):
+    base, anio, _, _ = preparar(cliente, nuevo_pme)
+
+    assert montos_acciones(cliente, anio) == {"A": 100, "B": 50}
+    assert montos_recursos(cliente, anio) == {"R": 10}
+    # Nada se copió físicamente al año nuevo
+    assert db.acciones.count_documents({"id_pme": anio}) == 0
+    assert db.recursos.count_documents({"id_pme": anio}) == 0
+
+
+def test_editar_desde_la_instantanea_materializa_una_copia(cliente, db, nuevo_pme):
+    base, anio, uuid_a, _ = preparar(cliente, nuevo_pme)
+
+    assert editar_accion(cliente, uuid_a, anio, 2025, 300).status_code == 200
+
+    assert montos_acciones(cliente, anio) == {"A": 300, "B": 50}
+    assert montos_acciones(cliente, base) == {"A": 100, "B": 50}
+    copia = db.acciones.find_one({"id_pme": anio, "uuid_accion": uuid_a})
+    original = db.acciones.find_one({"id_pme": base, "uuid_accion": uuid_a})
+    assert copia["origen"] == original["_id"]
+
+
+def test_editar_la_base_no_cambia_lo_que_ve_la_instantanea(cliente, nuevo_pme):
+    base, anio, uuid_a, id_r = preparar(cliente, nuevo_pme)
+
+    editar_accion(cliente, uuid_a, base, 2024, 999).raise_for_status()
+    cliente.put(f"/api/recursos/{id_r}", json={"id_pme": base, "year": 2024, "uuid_accion": uuid_a,
+                                               "monto": 77}).raise_for_status()
+    crear_accion(cliente, base, 2024, "C", 1)
+
+    assert montos_acciones(cliente, base) == {"A": 999, "B": 50, "C": 1}
+    assert montos_acciones(cliente, anio) == {"A": 100, "B": 50}
+    assert montos_recursos(cliente, anio) == {"R": 10}
+
+
+def test_eliminar_desde_la_instantanea_oculta_sin_borrar_la_base(cliente, db, nuevo_pme):
+    base, anio, uuid_a, id_r = preparar(cliente, nuevo_pme)
+
+    assert cliente.delete(f"/api/recursos/{id_r}", params={"id_pme": anio}).status_code == 200
+    assert montos_recursos(cliente, anio) == {}
+    assert montos_recursos(cliente, base) == {"R": 10}
+
+    assert cliente.delete(f"/api/acciones/{uuid_a}", params={"id_pme": anio}).status_code == 200
+    assert montos_acciones(cliente, anio) == {"B": 50}
+    assert montos_acciones(cliente, base) == {"A": 100, "B": 50}
+    assert db.acciones.count_documents({"id_pme": base}) == 2
+
+
+def test_resumen_de_la_instantanea_sigue_su_vista(cliente, nuevo_pme):
+    base, anio, uuid_a, _ = preparar(cliente, nuevo_pme)
+
+    editar_accion(cliente, uuid_a, anio, 2025, 300).raise_for_status()
+
+    assert cliente.get(f"/api/pme/{anio}/resumen").json()["monto_sep"] == 350
+    assert cliente.get(f"/api/pme/{base}/resumen").json()["monto_sep"] == 150
@@ -0,0 +1,44 @@
+"""/api/acciones/bulk: las operaciones solo tocan acciones del PME indicado."""
+import uuid
+
+
+def crear_accion(cliente, id_pme: str, year: int, uuid_accion: str = None) -> str:
+    resp = cliente.post("/api/acciones", json={"id_pme": id_pme, "year": year, "nombre_accion": "A",
+                                               "descripcion": "d", "dimension": "Gestión",
+                                               **({"uuid_accion": uuid_accion} if uuid_accion else {})})
+    resp.raise_for_status()
+    return resp.json()["uuid"]
+
+
+def masivo(cliente, operaciones: list, **extra) -> dict:
+    resp = cliente.post("/api/acciones/bulk", json={"operaciones": operaciones, **extra})
+    resp.raise_for_status()
+    return resp.json()
+
+
+def test_uuid_de_otro_pme_no_se_encuentra(cliente, db, nuevo_pme):
+    ajeno, propio = nuevo_pme(2024), nuevo_pme(2025)
+    uuid_a = crear_accion(cliente, ajeno, 2024)
+    cliente.post("/api/recursos", json={"id_pme": ajeno, "year": 2024, "uuid_accion": uuid_a,
+                                        "nombre_actividad": "R", "monto": 10}).raise_for_status()
+
+    res = masivo(cliente, [{"op": "eliminar", "id": uuid_a}], id_pme=propio)
+
+    assert res["resultados"][0]["ok"] is False
+    assert res["resultados"][0]["error"] == "Acción no encontrada"
+    assert db.acciones.count_documents({"id_pme": ajeno}) == 1
+    assert db.recursos.count_documents({"id_pme": ajeno}) == 1
+
+
+def test_uuid_repetido_entre_pme_sin_id_pme_es_ambiguo(cliente, db, nuevo_pme):
+    uno, otro = nuevo_pme(2024), nuevo_pme(2025)
+    repetido = str(uuid.uuid4())
+    for id_pme, year in ((uno, 2024), (otro, 2025)):
+        crear_accion(cliente, id_pme, year, repetido)
+
+    res = masivo(cliente, [{"op": "eliminar", "id": repetido}])
+    assert res["resultados"][0]["error"] == "Está en 2 PME distintos; indicar id_pme"
+    assert db.acciones.count_documents({"uuid_accion": repetido}) == 2
+
+    assert masivo(cliente, [{"op": "eliminar", "id": repetido}], id_pme=otro)["ok"] == 1
+    assert [a["id_pme"] for a in db.acciones.find({"uuid_accion": repetido})] == [uno]
@@ -0,0 +1,44 @@
+"""Paginación keyset: valores repetidos del orden se desempatan por _id, aun con _id de tipos mezclados."""
+import pytest
+from bson import ObjectId
+
+
+def recorrer(cliente, id_pme: str, orden: str, desc: bool, limite: int) -> list:
+    vistos, cursor = [], None
+    while True:
+        params = {"orden": orden, "desc": desc, "limite": limite, **({"cursor": cursor} if cursor else {})}
+        pagina = cliente.get(f"/api/recursos/pme/{id_pme}/pagina", params=params).json()
+        vistos += [r["_id"] for r in pagina["items"]]
+        cursor = pagina["cursor_siguiente"]
+        if cursor is None:
+            return vistos
+
+
+@pytest.fixture
+def repetidos(db):
+    """Recursos con el mismo monto (y uno sin monto), con _id string y ObjectId."""
+    id_pme = f"P-keyset-{ObjectId()}"
+    docs = [{"_id": ObjectId(), "monto": 10} for _ in range(4)] + \
+           [{"_id": str(ObjectId()), "monto": 10} for _ in range(3)] + \
+           [{"_id": ObjectId(), "monto": 5}, {"_id": ObjectId()}]
+    db.recursos.insert_many([{**d, "id_pme": id_pme, "uuid_accion": "u"} for d in docs])
+    yield id_pme, docs
+    db.recursos.delete_many({"id_pme": id_pme})
+
+
+def orden_bson(doc: dict) -> tuple:
+    # null < número; entre _id, string < ObjectId
+    monto = doc.get("monto")
+    return (monto is not None, monto or 0, isinstance(doc["_id"], ObjectId), str(doc["_id"]))
+
+
+@pytest.mark.parametrize("desc", [False, True])
+@pytest.mark.parametrize("limite", [1, 2, 3])
+def test_cursor_no_repite_ni_salta_filas_con_valores_repetidos(cliente, repetidos, desc, limite):
+    id_pme, docs = repetidos
+
+    vistos = recorrer(cliente, id_pme, "monto", desc, limite)
+
+    esperado = [str(d["_id"]) for d in sorted(docs, key=orden_bson, reverse=desc)]
+    assert vistos == esperado
+